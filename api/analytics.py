@@ -0,0 +1,137 @@
+# api/analytics.py
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .services import get_rate_snapshot
+from .stats import analytics_version
+
+# group_by value -> DataFrame column(s) it groups on
+DIMENSIONS = {
+    'category': ['category'],
+    'month': ['month'],
+    'employee': ['employee_id', 'employee'],
+    'manager': ['manager_id'],
+}
+DEFAULT_STATUSES = ('pending', 'in_progress', 'approved')
+COLUMNS = ['amount', 'currency', 'category', 'status', 'created_at', 'employee_id', 'employee__username', 'employee__manager_id']
+
+
+def analytics_setting(name):
+    defaults = {'CACHE_TTL': 300, 'MAX_GROUPS': 5000}
+    return getattr(settings, 'ANALYTICS', {}).get(name, defaults[name])
+
+
+def spend_analytics(queryset, company_id, currency, group_by, statuses=DEFAULT_STATUSES, cache_key_parts=()):
+    """
+    Spend totals, percentiles and a monthly trend for the expenses in ``queryset``, converted to
+    ``currency``. Results are cached per company under a version that api.stats bumps on every
+    expense write, so a cached answer is never older than the last committed change (exchange
+    rates may lag by up to CACHE_TTL seconds).
+    """
+    params = json.dumps([company_id, currency, group_by, sorted(statuses), *cache_key_parts], default=str)
+    key = f'analytics:{company_id}:{analytics_version(company_id)}:{hashlib.sha256(params.encode()).hexdigest()}'
+    result = cache.get(key)
+    if result is None:
+        result = compute_spend(queryset.filter(status__in=statuses), currency, group_by)
+        cache.set(key, result, analytics_setting('CACHE_TTL'))
+    return result
+
+
+def load_frame(queryset):
+    """
+    Read the scoped columns straight from a database cursor, skipping the ORM's per-row field
+    converters, and parse amounts and timestamps as whole columns.
+    """
+    sql, params = queryset.values_list(*COLUMNS).query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        frame = pd.DataFrame.from_records(iter_rows(cursor), columns=COLUMNS)
+    frame = frame.rename(columns={'employee__username': 'employee', 'employee__manager_id': 'manager_id'})
+    frame['manager_id'] = frame['manager_id'].astype('Int64')
+    frame['amount'] = pd.to_numeric(frame['amount']).astype('float64')
+    created = pd.to_datetime(frame['created_at'], utc=True, format='ISO8601')
+    frame['month'] = created.dt.strftime('%Y-%m')
+    return frame
+
+
+def iter_rows(cursor, size=5000):
+    while rows := cursor.fetchmany(size):
+        yield from rows
+
+
+def convert(frame, currency):
+    """Convert every amount with one lookup per distinct currency and a single vector multiply."""
+    snapshot = get_rate_snapshot(currency)
+    currencies = frame['currency'].unique()
+    rates = {code: 1.0 if code == currency else (snapshot.rate(code, currency) if snapshot else None) for code in currencies}
+    factors = frame['currency'].map({code: np.nan if rate is None else float(rate) for code, rate in rates.items()})
+    return (frame['amount'] * factors).round(2)
+
+
+def describe(values):
+    if not len(values):
+        return {'count': 0, 'total': 0.0, 'mean': None, 'p50': None, 'p90': None, 'p99': None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        'count': int(len(values)),
+        'total': round(float(values.sum()), 2),
+        'mean': round(float(values.mean()), 2),
+        'p50': round(float(p50), 2),
+        'p90': round(float(p90), 2),
+        'p99': round(float(p99), 2),
+    }
+
+
+def compute_spend(queryset, currency, group_by):
+    frame = load_frame(queryset)
+    frame['converted'] = convert(frame, currency) if len(frame) else pd.Series(dtype='float64')
+    unconverted = int(frame['converted'].isna().sum())
+    frame = frame.dropna(subset=['converted'])
+    frame['approved'] = frame['converted'].where(frame['status'] == 'approved', 0.0)
+
+    summary = describe(frame['converted'].to_numpy())
+    summary['approved_total'] = round(float(frame['approved'].sum()), 2)
+    summary['unconverted_count'] = unconverted
+
+    groups = []
+    if group_by and len(frame):
+        keys = [column for dimension in group_by for column in DIMENSIONS[dimension]]
+        grouped = frame.groupby(keys, sort=True, dropna=False)
+        table = grouped['converted'].agg(['count', 'sum', 'mean'])
+        table['approved_total'] = grouped['approved'].sum()
+        quantiles = grouped['converted'].quantile([0.5, 0.9]).unstack()
+        table['p50'], table['p90'] = quantiles[0.5], quantiles[0.9]
+        table = table.sort_values('sum', ascending=False).head(analytics_setting('MAX_GROUPS')).reset_index()
+        for row in table.itertuples(index=False):
+            row = row._asdict()
+            group = {column: none_if_nan(row[column]) for column in keys}
+            group.update({
+                'count': int(row['count']),
+                'total': round(float(row['sum']), 2),
+                'mean': round(float(row['mean']), 2),
+                'p50': round(float(row['p50']), 2),
+                'p90': round(float(row['p90']), 2),
+                'approved_total': round(float(row['approved_total']), 2),
+            })
+            groups.append(group)
+
+    monthly = frame.groupby('month', sort=True)['converted'].agg(['count', 'sum'])
+    change = monthly['sum'].pct_change() * 100
+    trend = [
+        {'month': month, 'count': int(count), 'total': round(float(total), 2), 'change_pct': none_if_nan(round(float(pct), 1))}
+        for month, count, total, pct in zip(monthly.index, monthly['count'], monthly['sum'], change)
+    ]
+    return {'currency': currency, 'group_by': list(group_by), 'summary': summary, 'groups': groups, 'trend': trend}
+
+
+def none_if_nan(value):
+    # Missing keys (no manager) and undefined changes (first month, growth from zero) become null
+    if value is None or pd.isna(value) or (isinstance(value, float) and np.isinf(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
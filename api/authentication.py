@@ -0,0 +1,168 @@
+# api/authentication.py
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.db.models import F
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .models import Company, User
+from .routing import bind_user, primary_of
+
+# User fields copied into access tokens; changing any of them bumps User.token_version
+CLAIM_FIELDS = ('username', 'role', 'company_id', 'manager_id', 'is_staff', 'is_active')
+
+
+def auth_setting(name):
+    defaults = {'CACHE_SIZE': 10000, 'VERSION_TTL': 300}
+    return getattr(settings, 'AUTH_CLAIMS', {}).get(name, defaults[name])
+
+
+def token_claims(user):
+    company = user.company
+    return {
+        'username': user.username,
+        'role': user.role,
+        'company_id': user.company_id,
+        'currency': company.default_currency if company else None,
+        'manager_id': user.manager_id,
+        'is_staff': user.is_staff,
+        'token_version': user.token_version,
+    }
+
+
+def claims_user(user_id, claims):
+    """
+    A User built from token claims without a query. Fields that are not in the token are
+    deferred, so reading one (e.g. ``email``) loads it from the database like ``.only()`` would.
+    """
+    db = router.db_for_read(User)
+    fields = {
+        'id': user_id,
+        'username': claims['username'],
+        'role': claims['role'],
+        'company_id': claims['company_id'],
+        'manager_id': claims['manager_id'],
+        'is_staff': claims['is_staff'],
+        'is_active': True,
+        'token_version': claims['token_version'],
+    }
+    user = from_values(User, db, fields)
+    if claims['company_id'] is not None:
+        company = from_values(Company, db, {'id': claims['company_id'], 'default_currency': claims['currency']})
+        User._meta.get_field('company').set_cached_value(user, company)
+    return user
+
+
+def from_values(model, db, values):
+    # Model.from_db takes values in concrete field order and defers the rest
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db(db, names, [values[name] for name in names])
+
+
+def token_version_key(user_id):
+    return f'token-version:{user_id}'
+
+
+def current_token_version(user_id):
+    """
+    The user's token version, or None for a missing or inactive user. Cached until it changes;
+    the TTL only bounds how long a read that raced a change can keep a stale value.
+    """
+    key = token_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # From the primary: a lagging replica would let revoked tokens through
+        primary = primary_of(router.db_for_read(User))
+        row = User.objects.using(primary).filter(pk=user_id).values_list('token_version', 'is_active').first()
+        version = row[0] if row and row[1] else -1
+        cache.set(key, version, auth_setting('VERSION_TTL'))
+    return version if version >= 0 else None
+
+
+def bump_token_versions(users):
+    """Invalidate every token issued to ``users`` (a User queryset) so far."""
+    user_ids = list(users.values_list('pk', flat=True))
+    User.objects.filter(pk__in=user_ids).update(token_version=F('token_version') + 1)
+    transaction.on_commit(lambda: forget_token_versions(user_ids), using=router.db_for_write(User))
+
+
+def forget_token_versions(user_ids):
+    cache.delete_many([token_version_key(user_id) for user_id in user_ids])
+    _users.discard(user_ids)
+
+
+class UserCache:
+    """Full User rows for tokens whose claims cannot be used, tagged with their token version."""
+
+    def __init__(self):
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None or user.token_version != version:
+                return None
+            self._users.move_to_end(user_id)
+            return user
+
+    def put(self, user):
+        with self._lock:
+            self._users[user.pk] = user
+            self._users.move_to_end(user.pk)
+            while len(self._users) > auth_setting('CACHE_SIZE'):
+                self._users.popitem(last=False)
+
+    def discard(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+_users = UserCache()
+
+
+def clear_user_cache():
+    _users.clear()
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the signed claims instead of loading the User row.
+
+    The token's ``token_version`` is checked against a counter kept in the Django cache (and
+    read from the database only on a miss), so changing a user's role, company, manager or
+    active flag, or their company's currency, takes effect on the next request. Tokens issued
+    before such a change, or without claims, fall back to a full User row held in a bounded
+    per-process cache until the version moves again.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = User._meta.pk.to_python(validated_token[jwt_settings.USER_ID_CLAIM])
+        except (KeyError, ValidationError):
+            user_id = None
+        # Moves the request to the company's shard before any user query runs
+        bind_user(user_id, validated_token.get('company_id'))
+        version = current_token_version(user_id) if user_id is not None else None
+        if version is None or jwt_settings.CHECK_REVOKE_TOKEN:
+            # Missing or inactive users, and password-bound tokens, take simplejwt's own checks
+            return super().get_user(validated_token)
+        if validated_token.get('token_version') == version:
+            return claims_user(user_id, validated_token)
+        user = _users.get(user_id, version)
+        if user is None:
+            user = super().get_user(validated_token)
+            bind_user(user.pk, user.company_id)
+            if user.token_version == version:
+                _users.put(user)
+        return user
@@ -0,0 +1,127 @@
+# api/configcache.py
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def config_cache_setting(name):
+    defaults = {'MAX_ENTRIES': 1000}
+    return getattr(settings, 'CONFIG_CACHE', {}).get(name, defaults[name])
+
+
+def _version_key(company_id):
+    return f'company-config-version:{company_id}'
+
+
+def _modified_key(company_id):
+    return f'company-config-modified:{company_id}'
+
+
+def config_version(company_id):
+    """
+    ``(version, last_modified)`` of a company's workflows, rules and users. A missing counter
+    starts from the current time in milliseconds, so one lost from the cache never comes back
+    as a value that earlier responses were cached under.
+    """
+    values = cache.get_many([_version_key(company_id), _modified_key(company_id)])
+    version, modified = values.get(_version_key(company_id)), values.get(_modified_key(company_id))
+    if version is None:
+        now = time.time()
+        cache.add(_version_key(company_id), int(now * 1000), timeout=None)
+        cache.add(_modified_key(company_id), int(now), timeout=None)
+        return config_version(company_id)
+    return version, modified or int(time.time())
+
+
+def bump_config_version(company_id, using=None):
+    """Called for every write to a company's configuration; takes effect once the write on ``using`` commits."""
+    def bump():
+        key = _version_key(company_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), timeout=None)
+        cache.set(_modified_key(company_id), int(time.time()), timeout=None)
+    if company_id is not None:
+        transaction.on_commit(bump, using=using)
+
+
+class ResponseCache:
+    """Serialized response data keyed on (company, version, path, format), least recently used evicted first."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > config_cache_setting('MAX_ENTRIES'):
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_responses = ResponseCache()
+
+
+def clear_response_cache():
+    _responses.clear()
+
+
+def not_modified(request, etag, modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = parse_etags(if_none_match)
+        return '*' in tags or etag in tags
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and modified <= since
+
+
+class CompanyConfigCacheMixin:
+    """
+    Versioned reads for viewsets whose data only changes with the company's configuration
+    version (see api.signals). Reads carry an ETag and Last-Modified and answer conditional
+    requests with 304; otherwise the serialized data is served from an in-process cache, so a
+    steady-state read runs no queries at all.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.versioned_read(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.versioned_read(super().retrieve, request, *args, **kwargs)
+
+    def versioned_read(self, read, request, *args, **kwargs):
+        company_id = request.user.company_id
+        version, modified = config_version(company_id)
+        etag = f'"config-{company_id}-{version}"'
+        headers = {'ETag': etag, 'Last-Modified': http_date(modified), 'Cache-Control': 'private, no-cache'}
+        if not_modified(request, etag, modified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        key = (company_id, version, request.get_full_path(), request.accepted_renderer.format)
+        data = _responses.get(key)
+        if data is None:
+            response = read(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            _responses.put(key, data)
+        return Response(data, headers=headers)
@@ -0,0 +1,160 @@
+# api/currency.py
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATES_FILE = Path(__file__).resolve().parent / 'data' / 'exchange_rates.json'
+
+
+class RateProviderError(Exception):
+    pass
+
+
+class RateProvider:
+    """Source of exchange rates. ``fetch`` returns ``{currency: rate}`` quoted against ``base``."""
+
+    def fetch(self, base):
+        raise NotImplementedError
+
+
+class ExchangeRateAPIProvider(RateProvider):
+    url = 'https://api.exchangerate-api.com/v4/latest/{base}'
+
+    def __init__(self, timeout=5):
+        self.timeout = timeout
+
+    def fetch(self, base):
+        try:
+            response = requests.get(self.url.format(base=base), timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()['rates']
+        except (requests.RequestException, ValueError, KeyError) as exc:
+            raise RateProviderError(f"Could not fetch {base} rates: {exc}") from exc
+
+
+class FileRateProvider(RateProvider):
+    """Reads rates from a local JSON file (``{"base": "USD", "rates": {...}}``) for tests and air-gapped hosts."""
+
+    def __init__(self, path=None):
+        self.path = Path(path or DEFAULT_RATES_FILE)
+
+    def fetch(self, base):
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError) as exc:
+            raise RateProviderError(f"Could not read {self.path}: {exc}") from exc
+        rates = dict(data['rates'])
+        rates.setdefault(data['base'], 1)
+        if base not in rates:
+            raise RateProviderError(f"No {base} rate in {self.path}")
+        pivot = rates[base]
+        return {code: rate / pivot for code, rate in rates.items()}
+
+
+class RateSnapshot:
+    def __init__(self, base, rates, fetched_at):
+        self.base = base
+        self.rates = rates
+        self.fetched_at = fetched_at
+
+    def rate(self, from_currency, to_currency):
+        if from_currency == to_currency:
+            return 1
+        if from_currency == self.base:
+            return self.rates.get(to_currency)
+        source = self.rates.get(from_currency)
+        if not source:
+            return None
+        if to_currency == self.base:
+            return 1 / source
+        target = self.rates.get(to_currency)
+        return target / source if target else None
+
+    def convert(self, amount, from_currency, to_currency):
+        if from_currency == to_currency:
+            return amount
+        rate = self.rate(from_currency, to_currency)
+        return round(float(amount) * rate, 2) if rate else None
+
+
+class RateTable:
+    """
+    Keeps one rate snapshot per base currency. Snapshots are refreshed after ``ttl``
+    seconds, the least recently used base is evicted past ``max_bases``, and an
+    expired snapshot is served as last known good while the provider is failing.
+    """
+
+    def __init__(self, provider, ttl=3600, max_bases=32, retry_after=60):
+        self.provider = provider
+        self.ttl = ttl
+        self.max_bases = max_bases
+        self.retry_after = retry_after
+        self._snapshots = OrderedDict()
+        self._failed_at = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self, base):
+        now = time.monotonic()
+        with self._lock:
+            snapshot = self._snapshots.get(base)
+            if snapshot:
+                self._snapshots.move_to_end(base)
+                if now - snapshot.fetched_at < self.ttl:
+                    return snapshot
+            if now - self._failed_at.get(base, -self.retry_after) < self.retry_after:
+                return snapshot
+        try:
+            rates = self.provider.fetch(base)
+        except RateProviderError as exc:
+            logger.warning("%s; serving %s", exc, 'last known rates' if snapshot else 'no rates')
+            with self._lock:
+                self._failed_at[base] = now
+            return snapshot
+        snapshot = RateSnapshot(base, rates, now)
+        with self._lock:
+            self._failed_at.pop(base, None)
+            self._snapshots[base] = snapshot
+            self._snapshots.move_to_end(base)
+            while len(self._snapshots) > self.max_bases:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self._failed_at.clear()
+
+
+_rate_table = None
+
+
+def get_rate_table():
+    global _rate_table
+    if _rate_table is None:
+        config = settings.EXCHANGE_RATES
+        provider = import_string(config['PROVIDER'])(**config.get('OPTIONS', {}))
+        _rate_table = RateTable(
+            provider,
+            ttl=config.get('TTL', 3600),
+            max_bases=config.get('MAX_BASES', 32),
+            retry_after=config.get('RETRY_AFTER', 60),
+        )
+    return _rate_table
+
+
+@receiver(setting_changed)
+def reset_rate_table(setting, **kwargs):
+    global _rate_table
+    if setting == 'EXCHANGE_RATES':
+        _rate_table = None
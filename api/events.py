@@ -0,0 +1,108 @@
+# api/events.py
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class InProcessBroker:
+    """
+    Fan-out of small event dicts to asyncio subscribers in this process.
+
+    Publishing is thread-safe, so sync request handlers can wake up streams served on the
+    ASGI event loop. Another broker (Redis pub/sub, Postgres LISTEN/NOTIFY) can replace it
+    through settings.EVENT_BROKER as long as it offers the same publish/subscribe methods.
+    """
+    queue_size = 100
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, event)
+
+    @staticmethod
+    def _offer(queue, event):
+        # Events are wake-ups; when a slow consumer's queue is full it will catch up from the database anyway
+        if not queue.full():
+            queue.put_nowait(event)
+
+    def subscribe(self, channel):
+        return Subscription(self, channel)
+
+    def _add(self, channel, entry):
+        with self._lock:
+            self._subscribers[channel].add(entry)
+
+    def _remove(self, channel, entry):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers:
+                subscribers.discard(entry)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+
+class Subscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = asyncio.Queue(maxsize=broker.queue_size)
+        self._entry = None
+
+    async def __aenter__(self):
+        self._entry = (asyncio.get_running_loop(), self.queue)
+        self.broker._add(self.channel, self._entry)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broker._remove(self.channel, self._entry)
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'EVENT_BROKER', 'api.events.InProcessBroker'))()
+    return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'EVENT_BROKER':
+        _broker = None
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def publish_user_events(user_ids, event):
+    """Notify each user's open streams once the current transaction commits."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    broker = get_broker()
+
+    def publish():
+        for user_id in user_ids:
+            broker.publish(user_channel(user_id), event)
+    transaction.on_commit(publish)
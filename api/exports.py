@@ -0,0 +1,170 @@
+# api/exports.py
+import csv
+from collections import defaultdict
+from io import StringIO
+from itertools import islice
+
+from .models import Approval
+from .services import get_rate_snapshot
+
+# (column, values_list lookup); approvals and converted amounts are filled in per chunk
+COLUMNS = [
+    ('id', 'id'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+    ('employee_id', 'employee_id'),
+    ('employee', 'employee__username'),
+    ('employee_email', 'employee__email'),
+    ('category', 'category'),
+    ('description', 'description'),
+    ('amount', 'amount'),
+    ('currency', 'currency'),
+    ('status', 'status'),
+    ('workflow', 'workflow__name'),
+]
+HEADER = [name for name, _ in COLUMNS] + ['converted_amount', 'converted_currency', 'approvals']
+# ?output= value -> (content type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+# Spreadsheets run CSV cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class ExportUnavailable(Exception):
+    pass
+
+
+class ExpenseExport:
+    """
+    Streams a company's expenses as CSV, Parquet or Arrow without holding more than one chunk of
+    rows in memory. Expenses are read through ``iterator()`` (a server-side cursor on PostgreSQL),
+    their approvals with one query per chunk, and every row converts from one rate snapshot.
+    """
+    chunk_size = 2000
+
+    def __init__(self, queryset, currency, chunk_size=None):
+        self.queryset = queryset.order_by('id')
+        self.currency = currency
+        self.chunk_size = chunk_size or self.chunk_size
+        self.snapshot = get_rate_snapshot(currency)
+
+    def chunks(self):
+        rows = self.queryset.values_list(*(lookup for _, lookup in COLUMNS)).iterator(chunk_size=self.chunk_size)
+        while chunk := list(islice(rows, self.chunk_size)):
+            approvals = defaultdict(list)
+            chain = Approval.objects.filter(expense_id__in=[row[0] for row in chunk]).order_by('expense_id', 'sequence')
+            for expense_id, sequence, approver, decision in chain.values_list('expense_id', 'sequence', 'approver__username', 'status'):
+                approvals[expense_id].append(f'{sequence}:{approver}:{decision}')
+            yield [row + (self.convert(row[8], row[9]), self.currency, '; '.join(approvals[row[0]])) for row in chunk]
+
+    def convert(self, amount, currency):
+        if currency == self.currency:
+            return float(amount)
+        return self.snapshot.convert(amount, currency, self.currency) if self.snapshot else None
+
+    def csv(self):
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(HEADER)
+        for chunk in self.chunks():
+            writer.writerows([csv_cell(value) for value in row] for row in chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def record_batches(self):
+        pa = require_pyarrow()
+        schema = arrow_schema(pa)
+        for chunk in self.chunks():
+            columns = list(zip(*chunk))
+            yield pa.RecordBatch.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+    def parquet(self):
+        """One Parquet row group per chunk, flushed to the client as soon as it is written."""
+        pa = require_pyarrow()
+        import pyarrow.parquet as pq
+        sink = ChunkSink()
+        with pq.ParquetWriter(sink, arrow_schema(pa)) as writer:
+            for batch in self.record_batches():
+                writer.write_batch(batch)
+                yield sink.drain()
+        yield sink.drain()
+
+    def arrow(self):
+        pa = require_pyarrow()
+        sink = ChunkSink()
+        with pa.ipc.new_stream(sink, arrow_schema(pa)) as writer:
+            for batch in self.record_batches():
+                writer.write_batch(batch)
+                yield sink.drain()
+        yield sink.drain()
+
+
+class ChunkSink:
+    """Write-only file object that hands written bytes back to a streaming response."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def csv_cell(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    # Text typed in by users (descriptions, categories, usernames) is quoted so Excel and Sheets show it as text
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ExportUnavailable("Parquet and Arrow exports need the optional 'pyarrow' package.")
+    return pyarrow
+
+
+def arrow_schema(pa):
+    string = pa.string()
+    return pa.schema([
+        ('id', pa.int64()),
+        ('created_at', pa.timestamp('us', tz='UTC')),
+        ('updated_at', pa.timestamp('us', tz='UTC')),
+        ('employee_id', pa.int64()),
+        ('employee', string),
+        ('employee_email', string),
+        ('category', string),
+        ('description', string),
+        ('amount', pa.decimal128(10, 2)),
+        ('currency', string),
+        ('status', string),
+        ('workflow', string),
+        ('converted_amount', pa.float64()),
+        ('converted_currency', string),
+        ('approvals', string),
+    ])
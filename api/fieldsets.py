@@ -0,0 +1,137 @@
+# api/fieldsets.py
+import copy
+
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class FieldsetError(ValueError):
+    pass
+
+
+def parse_paths(value):
+    # 'id,expense.amount,expense.employee' -> {'id': {}, 'expense': {'amount': {}, 'employee': {}}}
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if not name:
+                break
+            node = node.setdefault(name, {})
+    return tree
+
+
+class Shape:
+    """
+    Which fields of a serializer to render and which of its relations to nest.
+
+    ``fields`` is None for every field, or a tree of the chosen ones. ``expand`` is None for
+    the serializer's own default (its declared nested serializers), or a tree of the relations
+    to nest; relations left out of it are rendered as primary keys, at every level.
+    """
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields
+        self.expand = expand
+
+    @property
+    def full(self):
+        return self.fields is None and self.expand is None
+
+    def includes(self, name):
+        return self.fields is None or name in self.fields
+
+    def expands(self, name):
+        return self.expand is None or name in self.expand
+
+    def nests(self, name):
+        return self.includes(name) and self.expands(name)
+
+    def child(self, name):
+        fields = self.fields.get(name) if self.fields is not None else None
+        return Shape(fields or None, self.expand.get(name, {}) if self.expand is not None else None)
+
+    def check(self, serializer_class, path=''):
+        fields = {name for name, field in serializer_class().fields.items() if not field.write_only}
+        collapsed = getattr(serializer_class, 'collapsed', {})
+        unknown = [path + name for name in self.fields or () if name not in fields]
+        if unknown:
+            raise FieldsetError(f"Unknown field: {', '.join(unknown)}.")
+        unexpandable = [path + name for name in self.expand or () if name not in collapsed]
+        if unexpandable:
+            raise FieldsetError(f"Cannot expand: {', '.join(unexpandable)}.")
+        for name, subtree in (self.fields or {}).items():
+            if subtree and not (name in collapsed and self.expands(name)):
+                raise FieldsetError(f"{path}{name} has no fields to choose; expand it first.")
+        for name in collapsed:
+            child = self.child(name)
+            if self.nests(name) and not child.full:
+                nested = serializer_class().fields[name]
+                child.check(type(getattr(nested, 'child', nested)), f'{path}{name}.')
+
+
+FULL = Shape()
+
+
+def request_shape(request):
+    params = request.query_params
+    return Shape(
+        parse_paths(params['fields']) if 'fields' in params else None,
+        parse_paths(params['expand']) if 'expand' in params else None,
+    )
+
+
+class ShapedSerializerMixin:
+    """
+    Renders the fields a Shape chooses. ``collapsed`` maps each nested relation to the field
+    that replaces it when the shape does not expand it; nested serializers get the child shape.
+    """
+    collapsed = {}
+
+    def __init__(self, *args, shape=None, **kwargs):
+        self.shape = shape
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        shape = self.shape
+        if shape is None or shape.full:
+            return fields
+        if shape.fields is not None:
+            fields = {name: field for name, field in fields.items() if name in shape.fields}
+        for name in self.collapsed:
+            if name not in fields:
+                continue
+            if shape.expands(name):
+                nested = fields[name]
+                getattr(nested, 'child', nested).shape = shape.child(name)
+            else:
+                fields[name] = copy.deepcopy(self.collapsed[name])
+        return fields
+
+
+class FieldsetMixin:
+    """
+    ``?fields=`` and ``?expand=`` on a viewset's reads (``shaped_actions``). The request's shape
+    is checked against the serializer before any query runs, handed to the serializer, and
+    left in ``self.shape`` so get_queryset loads only the relations that get rendered.
+    """
+    shaped_actions = ('list', 'retrieve')
+    shape = FULL
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.shaped_actions and request.method in ('GET', 'HEAD'):
+            self.shape = request_shape(request)
+            if not self.shape.full:
+                self.shape.check(self.get_serializer_class())
+
+    def get_serializer(self, *args, **kwargs):
+        if not self.shape.full and issubclass(self.get_serializer_class(), ShapedSerializerMixin):
+            kwargs.setdefault('shape', self.shape)
+        return super().get_serializer(*args, **kwargs)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, FieldsetError):
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return super().handle_exception(exc)
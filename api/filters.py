@@ -0,0 +1,101 @@
+# api/filters.py
+import re
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Expense
+
+# Text search configuration; the GIN index created in migration 0012 is built with it
+SEARCH_CONFIG = 'english'
+STATUSES = {value for value, _ in Expense.STATUS_CHOICES}
+WORD = re.compile(r'\w+')
+
+
+class FilterError(ValueError):
+    pass
+
+
+def split(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def day_start(value, param):
+    day = parse_date(value)
+    if day is None:
+        raise FilterError(f"'{param}' must be a date (YYYY-MM-DD).")
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def decimal_param(value, param):
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise FilterError(f"'{param}' must be a number.")
+    # NaN, sNaN and Infinity parse, but no amount column can hold them
+    if not number.is_finite():
+        raise FilterError(f"'{param}' must be a finite number.")
+    return number
+
+
+def filter_expenses(queryset, params):
+    """
+    Apply the expense list filters in ``params`` (a QueryDict):
+
+    status, category, currency and employee take comma-separated values; from / to are
+    inclusive dates in the current time zone; min_amount / max_amount bound the amount in the
+    expense's own currency; search matches words in the description or category.
+    Dates become ``created_at`` ranges rather than ``__date`` lookups so the composite
+    (company, ..., created_at) indexes stay usable.
+    """
+    if 'status' in params:
+        statuses = split(params['status'])
+        unknown = [value for value in statuses if value not in STATUSES]
+        if unknown:
+            raise FilterError(f"Unknown status: {', '.join(unknown)}.")
+        queryset = queryset.filter(status__in=statuses)
+    if 'category' in params:
+        queryset = queryset.filter(category__in=split(params['category']))
+    if 'currency' in params:
+        queryset = queryset.filter(currency__in=[value.upper() for value in split(params['currency'])])
+    if 'employee' in params:
+        employees = split(params['employee'])
+        if not all(value.isdigit() for value in employees):
+            raise FilterError("'employee' takes user ids.")
+        queryset = queryset.filter(employee_id__in=[int(value) for value in employees])
+    if 'from' in params:
+        queryset = queryset.filter(created_at__gte=day_start(params['from'], 'from'))
+    if 'to' in params:
+        queryset = queryset.filter(created_at__lt=day_start(params['to'], 'to') + timedelta(days=1))
+    if 'min_amount' in params:
+        queryset = queryset.filter(amount__gte=decimal_param(params['min_amount'], 'min_amount'))
+    if 'max_amount' in params:
+        queryset = queryset.filter(amount__lte=decimal_param(params['max_amount'], 'max_amount'))
+    if params.get('search', '').strip():
+        queryset = search_expenses(queryset, params['search'])
+    return queryset
+
+
+def search_expenses(queryset, text):
+    """
+    Full-text search over description and category. PostgreSQL matches a web-style query
+    (quoted phrases, ``or``, ``-word``) against the GIN-indexed search vector; other databases
+    require every word to appear in either column.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery
+        return queryset.annotate(search_vector=search_vector()).filter(
+            search_vector=SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+        )
+    for word in WORD.findall(text):
+        queryset = queryset.filter(Q(description__icontains=word) | Q(category__icontains=word))
+    return queryset
+
+
+def search_vector():
+    from django.contrib.postgres.search import SearchVector
+    return SearchVector('description', 'category', config=SEARCH_CONFIG)
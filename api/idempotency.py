@@ -0,0 +1,70 @@
+# api/idempotency.py
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+
+def idempotency_setting(name):
+    defaults = {'TTL': 86400}
+    return getattr(settings, 'IDEMPOTENCY', {}).get(name, defaults[name])
+
+
+def fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def replay(record, request_fingerprint):
+    if record.fingerprint != request_fingerprint:
+        return Response({'error': 'This Idempotency-Key was used for a different request.'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view):
+    """
+    Make a view method safe to retry with an ``Idempotency-Key`` header. The key is claimed by
+    inserting its record before the view runs, in the same transaction as the view's writes:
+    a concurrent request with the same key blocks on the unique index until this one commits
+    and then replays the stored response, and a view that raises leaves no record behind.
+    Keys are scoped to the user and expire after IDEMPOTENCY['TTL'] seconds.
+    """
+    @functools.wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(self, request, *args, **kwargs)
+        if not key or len(key) > IdempotencyRecord._meta.get_field('key').max_length:
+            return Response({'error': 'Idempotency-Key must be 1 to 255 characters.'}, status=status.HTTP_400_BAD_REQUEST)
+        request_fingerprint = fingerprint(request)
+        records = IdempotencyRecord.objects.filter(user_id=request.user.pk)
+        cutoff = timezone.now() - timedelta(seconds=idempotency_setting('TTL'))
+        # A retry of a committed request costs one read
+        record = records.filter(key=key, created_at__gte=cutoff).first()
+        if record is not None:
+            return replay(record, request_fingerprint)
+        db = router.db_for_write(IdempotencyRecord)
+        with transaction.atomic(using=db):
+            records.filter(created_at__lt=cutoff).delete()
+            try:
+                with transaction.atomic(using=db):
+                    record = IdempotencyRecord.objects.create(user_id=request.user.pk, key=key, fingerprint=request_fingerprint)
+            except IntegrityError:
+                return replay(records.get(key=key), request_fingerprint)
+            response = view(self, request, *args, **kwargs)
+            record.status_code, record.response = response.status_code, response.data
+            record.save(update_fields=['status_code', 'response'])
+        return response
+    return wrapper
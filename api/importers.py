@@ -0,0 +1,148 @@
+# api/importers.py
+import csv
+import json
+import time
+from itertools import islice
+
+from django.db import DatabaseError, router, transaction
+from rest_framework import serializers
+
+from .models import Expense, User, ApprovalWorkflow
+from .services import create_approval_workflows
+from .stats import record_expense_created
+
+
+class ExpenseImportRowSerializer(serializers.Serializer):
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    currency = serializers.CharField(max_length=3, default='USD')
+    category = serializers.CharField(max_length=100)
+    description = serializers.CharField()
+    workflow = serializers.IntegerField(required=False, allow_null=True)
+    employee = serializers.CharField(required=False, allow_blank=True)
+
+    def to_internal_value(self, data):
+        # Blank CSV cells mean "not provided"
+        if isinstance(data, dict):
+            data = {key: value for key, value in data.items() if key and value not in ('', None)}
+        return super().to_internal_value(data)
+
+
+def iter_lines(source, bad_lines):
+    """
+    Decode a binary line stream (an uploaded file or the request body) lazily. Lines that are
+    not UTF-8 are decoded with replacement characters and their errors left in ``bad_lines``
+    by line number, for the records that contain them to be reported.
+    """
+    for number, line in enumerate(source, start=1):
+        try:
+            line = line.decode('utf-8')
+        except UnicodeDecodeError as exc:
+            bad_lines[number] = ValueError(f'Line {number} is not valid UTF-8: {exc.reason} at byte {exc.start}.')
+            line = line.decode('utf-8', errors='replace')
+        if number == 1:
+            line = line.lstrip('\ufeff')
+        yield line
+
+
+def iter_records(source, file_format):
+    bad_lines = {}
+    lines = iter_lines(source, bad_lines)
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        last_line = 0
+        for row_number, record in enumerate(reader, start=1):
+            # A record spans the lines read since the previous one (and the header, for the first)
+            errors = [bad_lines.pop(number) for number in range(last_line + 1, reader.line_num + 1) if number in bad_lines]
+            last_line = reader.line_num
+            yield row_number, errors[0] if errors else record
+        return
+    row_number = 0
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        row_number += 1
+        if number in bad_lines:
+            yield row_number, bad_lines.pop(number)
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            record = exc
+        yield row_number, record
+
+
+class ExpenseImporter:
+    """
+    Streams CSV or JSON Lines expense records into the database ``chunk_size`` rows at a time.
+
+    Each chunk is validated in memory, then its expenses, approvals and notifications are written
+    with one batched insert per table inside a single transaction. Invalid rows are reported and
+    skipped; a chunk that fails to write is reported without aborting the rest of the file.
+    """
+    chunk_size = 1000
+    max_reported_errors = 1000
+
+    def __init__(self, user, chunk_size=None):
+        self.user = user
+        self.company = user.company
+        self.chunk_size = chunk_size or self.chunk_size
+        self.row_serializer = ExpenseImportRowSerializer()
+        self.workflow_ids = set(ApprovalWorkflow.objects.filter(company=self.company).values_list('id', flat=True))
+        if user.role == 'admin':
+            self.employees = {u.username: u for u in User.objects.filter(company=self.company).only('id', 'username', 'manager_id')}
+        else:
+            self.employees = {user.username: user}
+        self.created = self.failed = 0
+        self.errors = []
+
+    def run(self, source, file_format):
+        started = time.perf_counter()
+        records = iter_records(source, file_format)
+        while chunk := list(islice(records, self.chunk_size)):
+            self.import_chunk(chunk)
+        elapsed = time.perf_counter() - started
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round((self.created + self.failed) / elapsed) if elapsed else None,
+        }
+
+    def import_chunk(self, chunk):
+        expenses, row_numbers = [], []
+        for row_number, record in chunk:
+            try:
+                expenses.append(self.build_expense(record))
+                row_numbers.append(row_number)
+            except serializers.ValidationError as exc:
+                self.report(row_number, exc.detail)
+        if not expenses:
+            return
+        try:
+            with transaction.atomic(using=router.db_for_write(Expense)):
+                Expense.objects.bulk_create(expenses)
+                create_approval_workflows(expenses)
+                record_expense_created(expenses)
+        except DatabaseError as exc:
+            for row_number in row_numbers:
+                self.report(row_number, {'non_field_errors': [f'Could not save this chunk: {exc}']})
+            return
+        self.created += len(expenses)
+
+    def build_expense(self, record):
+        if not isinstance(record, dict):
+            raise serializers.ValidationError({'non_field_errors': [f'Malformed record: {record}']})
+        data = self.row_serializer.run_validation(record)
+        employee = self.employees.get(data.pop('employee', None) or self.user.username)
+        if employee is None:
+            raise serializers.ValidationError({'employee': ['Unknown employee for this company.']})
+        if data.get('workflow') is not None and data['workflow'] not in self.workflow_ids:
+            raise serializers.ValidationError({'workflow': ['Unknown workflow for this company.']})
+        workflow_id = data.pop('workflow', None)
+        return Expense(employee=employee, company=self.company, workflow_id=workflow_id, **data)
+
+    def report(self, row_number, detail):
+        self.failed += 1
+        if len(self.errors) < self.max_reported_errors:
+            self.errors.append({'row': row_number, 'errors': detail})
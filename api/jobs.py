@@ -0,0 +1,184 @@
+# api/jobs.py
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .events import publish_user_events
+from .models import Job, Notification
+
+logger = logging.getLogger(__name__)
+
+# kind -> handler taking a list of payloads; every kind is handled in batches
+handlers = {}
+
+
+def job_handler(kind):
+    def register(func):
+        handlers[kind] = func
+        return func
+    return register
+
+
+class PartialFailure(Exception):
+    """
+    Raised by handlers whose work cannot be rolled back (sending email) once some payloads
+    are done: ``failed`` maps the index of each failed payload to its error. The rest are
+    finished as done and never run again.
+    """
+
+    def __init__(self, failed):
+        super().__init__(f"{len(failed)} payload(s) failed")
+        self.failed = failed
+
+
+def queue_setting(name):
+    defaults = {
+        'EAGER': False,
+        'BATCH_SIZE': 100,
+        'MAX_ATTEMPTS': 5,
+        'BACKOFF_SECONDS': 10,
+        'MAX_BACKOFF_SECONDS': 3600,
+        'RUNNING_TIMEOUT': 600,
+        'KEEP_DONE_SECONDS': 86400,
+    }
+    return getattr(settings, 'JOB_QUEUE', {}).get(name, defaults[name])
+
+
+def enqueue(kind, payload):
+    """
+    Queue a job. The row is written in the caller's transaction, so it is only picked up
+    if that transaction commits. In EAGER mode (tests, single-process dev) it runs inline.
+    """
+    if kind not in handlers:
+        raise ValueError(f"No handler registered for job kind '{kind}'")
+    if queue_setting('EAGER'):
+        handlers[kind]([payload])
+        return None
+    return Job.objects.create(kind=kind, payload=payload)
+
+
+def claim_jobs(batch_size):
+    now = timezone.now()
+    with transaction.atomic(using=router.db_for_write(Job)):
+        # Jobs left running by a crashed worker count as a failed attempt: back to the queue,
+        # or failed once they are out of attempts, so a job that kills its worker stops coming back
+        stale = Job.objects.filter(status='running', updated_at__lt=now - timedelta(seconds=queue_setting('RUNNING_TIMEOUT')))
+        error = 'The worker stopped while running this job.'
+        stale.filter(attempts__gte=queue_setting('MAX_ATTEMPTS') - 1).update(
+            status='failed', attempts=F('attempts') + 1, last_error=error, updated_at=now)
+        stale.update(status='queued', attempts=F('attempts') + 1, last_error=error, updated_at=now)
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='queued', run_at__lte=now)
+            .order_by('run_at', 'id')[:batch_size]
+        )
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(status='running', updated_at=now)
+    return jobs
+
+
+def run_pending(batch_size=None):
+    """Claim and run one batch of due jobs; returns how many were claimed."""
+    jobs = claim_jobs(batch_size or queue_setting('BATCH_SIZE'))
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+    for kind, batch in by_kind.items():
+        handler = handlers.get(kind)
+        if handler is None:
+            finish(batch, error=f"No handler registered for job kind '{kind}'", retry=False)
+            continue
+        try:
+            with transaction.atomic(using=router.db_for_write(Job)):
+                handler([job.payload for job in batch])
+        except PartialFailure as exc:
+            for index, job in enumerate(batch):
+                if index in exc.failed:
+                    logger.error("Job %s failed: %s", job, exc.failed[index])
+                    finish([job], error=exc.failed[index])
+            finish([job for index, job in enumerate(batch) if index not in exc.failed])
+        except Exception:
+            if len(batch) == 1:
+                logger.exception("Job %s failed", batch[0])
+                finish(batch, error=format_error())
+                continue
+            # Retry the batch job by job so one bad payload does not hold back the rest
+            for job in batch:
+                try:
+                    with transaction.atomic(using=router.db_for_write(Job)):
+                        handler([job.payload])
+                except Exception:
+                    logger.exception("Job %s failed", job)
+                    finish([job], error=format_error())
+                else:
+                    finish([job])
+        else:
+            finish(batch)
+    purge_done()
+    return len(jobs)
+
+
+def finish(jobs, error=None, retry=True):
+    now = timezone.now()
+    if error is None:
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(status='done', last_error='', updated_at=now)
+        return
+    for job in jobs:
+        job.attempts += 1
+        job.last_error = error
+        job.updated_at = now
+        if retry and job.attempts < queue_setting('MAX_ATTEMPTS'):
+            delay = min(queue_setting('BACKOFF_SECONDS') * 2 ** (job.attempts - 1), queue_setting('MAX_BACKOFF_SECONDS'))
+            job.status, job.run_at = 'queued', now + timedelta(seconds=delay)
+        else:
+            job.status = 'failed'
+    Job.objects.bulk_update(jobs, ['attempts', 'last_error', 'status', 'run_at', 'updated_at'])
+
+
+def purge_done():
+    cutoff = timezone.now() - timedelta(seconds=queue_setting('KEEP_DONE_SECONDS'))
+    Job.objects.filter(status='done', updated_at__lt=cutoff).delete()
+
+
+def format_error():
+    return traceback.format_exc(limit=5)
+
+
+@job_handler('notifications')
+def create_notifications(payloads):
+    notifications = Notification.objects.bulk_create(
+        Notification(user_id=user_id, message=message)
+        for payload in payloads
+        for user_id, message in payload['notifications']
+    )
+    publish_user_events((n.user_id for n in notifications), {'type': 'notification'})
+
+
+@job_handler('send_email')
+def send_emails(payloads):
+    # One SMTP connection for the whole batch, one message at a time, so a failure never resends delivered mail
+    failed = {}
+    with get_connection() as connection:
+        for index, payload in enumerate(payloads):
+            message = EmailMessage(payload['subject'], payload['message'], payload['from_email'], payload['recipient_list'])
+            try:
+                connection.send_messages([message])
+            except Exception:
+                failed[index] = format_error()
+    if failed:
+        raise PartialFailure(failed)
+
+
+def send_notifications(notifications):
+    """Queue unsaved Notification objects for a batched insert off the request path."""
+    if notifications:
+        enqueue('notifications', {'notifications': [[n.user_id, n.message] for n in notifications]})
+
+
+def send_email(subject, message, from_email, recipient_list):
+    enqueue('send_email', {'subject': subject, 'message': message, 'from_email': from_email, 'recipient_list': recipient_list})
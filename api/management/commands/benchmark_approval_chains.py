@@ -0,0 +1,87 @@
+# api/management/commands/benchmark_approval_chains.py
+import random
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Approval, ApprovalRule, ApprovalWorkflow, Company, Expense, User, WorkflowStep
+from api.services import create_approval_workflows, process_approval_actions
+from api.stats import record_expense_created
+
+AUTO_APPROVE_LIMIT = Decimal('50.00')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Run expenses through a long workflow with realistic rejection and auto-approval rates and report "
+        "approval rows written per expense, against writing every step up front."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=2000)
+        parser.add_argument('--steps', type=int, default=6)
+        parser.add_argument('--reject-rate', type=float, default=0.1, help="Chance that each step rejects.")
+        parser.add_argument('--auto-approve-rate', type=float, default=0.4,
+                            help="Share of expenses under the amount rule, auto-approved at the first step.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        company = Company.objects.create(name=f"Approval Chain Benchmark {options['seed']}", default_currency='USD')
+        approvers = User.objects.bulk_create(
+            User(username=f'chainbench-{company.pk}-{step}', role='manager', company=company, password='!')
+            for step in range(options['steps'])
+        )
+        employee = User.objects.create(username=f'chainbench-{company.pk}-e', role='employee', company=company, password='!')
+        workflow = ApprovalWorkflow.objects.create(name='Benchmark', company=company)
+        WorkflowStep.objects.bulk_create(
+            WorkflowStep(workflow=workflow, approver=approver, sequence=step) for step, approver in enumerate(approvers, 1)
+        )
+        ApprovalRule.objects.create(company=company, rule_type='amount_threshold', amount_threshold=AUTO_APPROVE_LIMIT)
+        Expense.objects.bulk_create(
+            Expense(employee=employee, company=company, workflow=workflow, currency='USD', category='Travel', description='Benchmark',
+                    amount=AUTO_APPROVE_LIMIT / 2 if self.rng.random() < options['auto_approve_rate'] else AUTO_APPROVE_LIMIT * 10)
+            for _ in range(options['expenses'])
+        )
+        expenses = list(Expense.objects.filter(company=company).select_related('employee'))
+        record_expense_created(expenses)
+        create_approval_workflows(expenses)
+
+        decisions = 0
+        for step in range(1, options['steps'] + 1):
+            pending = list(Approval.objects.filter(expense__company=company, sequence=step, status='pending')
+                           .select_related('approver', 'expense__employee'))
+            by_decision = defaultdict(list)
+            for approval in pending:
+                by_decision['rejected' if self.rng.random() < options['reject_rate'] else 'approved'].append(approval)
+            for decision, approvals in by_decision.items():
+                process_approval_actions(approvals, decision, '')
+            decisions += len(pending)
+
+        count, steps = options['expenses'], options['steps']
+        materialized = Approval.objects.filter(expense__company=company).count()
+        outcomes = {status: Expense.objects.filter(company=company, status=status).count() for status in ('approved', 'rejected')}
+        self.stdout.write(
+            f"{count} expenses, {steps}-step workflow, {options['reject_rate']:.0%} rejection per step, "
+            f"{options['auto_approve_rate']:.0%} under the auto-approval rule: "
+            f"{outcomes['approved']} approved, {outcomes['rejected']} rejected, {decisions} decisions"
+        )
+        self.stdout.write(f"{'':<22}{'approval rows':>14}{'rows written/expense':>22}")
+        for label, rows in (('all steps up front', count * steps), ('active steps only', materialized)):
+            # Rows written: every inserted approval plus one update per decision
+            self.stdout.write(f"{label:<22}{rows:>14}{(rows + decisions) / count:>22.2f}")
+        self.stdout.write(f"approval table growth: {materialized / (count * steps):.0%} of eager")
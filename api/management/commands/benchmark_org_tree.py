@@ -0,0 +1,115 @@
+# api/management/commands/benchmark_org_tree.py
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.models import Company, Expense, OrgTreePath, User
+from api.orgtree import move_subtree, rebuild_org_tree, subtree_user_ids
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark the org tree index: rebuild, subtree-scoped queries against a recursive walk, and subtree moves."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--levels', type=int, default=12, help="Depth of the tree below the root.")
+        parser.add_argument('--expenses', type=int, default=2, help="Expenses per user.")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Keep the generated company instead of rolling back.")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self.run(options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        company = Company.objects.create(name=f"Org Tree Benchmark {options['seed']}", default_currency='USD')
+        levels = self.build_tree(company, options['users'], options['levels'])
+        users = [user for level in levels for user in level]
+        Expense.objects.bulk_create(
+            (Expense(employee=user, company=company, amount=Decimal(self.rng.randint(100, 100000)) / 100,
+                     currency='USD', category='Travel', description='Benchmark expense')
+             for user in users for _ in range(options['expenses'])),
+            batch_size=5000,
+        )
+
+        started = time.perf_counter()
+        rebuild_org_tree([company.pk])
+        rebuild_seconds = time.perf_counter() - started
+        paths = OrgTreePath.objects.filter(descendant__company=company).count()
+        self.stdout.write(f"tree: {len(users)} users, {len(levels) - 1} levels, {paths} closure rows, rebuilt in {rebuild_seconds * 1000:.0f} ms")
+
+        director = self.rng.choice(levels[1])
+        indexed = self.timed(options['repeat'], lambda: Expense.objects.filter(employee__in=subtree_user_ids(director), company=company).count())
+        walked = self.timed(options['repeat'], lambda: Expense.objects.filter(employee__in=self.walk(director), company=company).count())
+        assert indexed[0] == walked[0], (indexed[0], walked[0])
+        self.stdout.write(f"subtree of a level-1 director: {indexed[0]} expenses")
+        self.report('closure table', indexed)
+        self.report('recursive walk', walked)
+
+        # Move a mid-level manager (and its subtree) under a manager in another branch
+        middle = len(levels) // 2
+        mover = self.rng.choice(levels[middle])
+        below = set(OrgTreePath.objects.filter(ancestor=mover).values_list('descendant_id', flat=True))
+        target = self.rng.choice([user for user in levels[middle - 1] if user.pk not in below and user.pk != mover.manager_id])
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            move_subtree(mover, target.pk)
+            User.objects.filter(pk=mover.pk).update(manager=target)
+        move_seconds = time.perf_counter() - started
+        self.stdout.write(f"move of a level-{middle} subtree ({len(below)} users): {move_seconds * 1000:.1f} ms, {len(queries)} queries")
+
+    def build_tree(self, company, count, depth):
+        # An admin root and `depth` levels growing by a constant ratio, sized to add up to `count`;
+        # reports are dealt round-robin over a shuffled level above so every manager has a team
+        prefix = f"orgbench-{company.pk}"
+        ratio = 1.0
+        while sum(round(ratio ** level) for level in range(1, depth + 1)) < count - 1:
+            ratio += 0.01
+        levels = [User.objects.bulk_create([User(username=f'{prefix}-0', role='admin', company=company, password='!')])]
+        made = 1
+        for level in range(1, depth + 1):
+            size = max(1, round(ratio ** level)) if level < depth else max(1, count - made)
+            parents = self.rng.sample(levels[-1], len(levels[-1]))
+            levels.append(User.objects.bulk_create(
+                [User(username=f'{prefix}-{made + i}', role='manager' if level < depth else 'employee', company=company,
+                      password='!', manager=parents[i % len(parents)]) for i in range(size)],
+                batch_size=5000,
+            ))
+            made += size
+        return levels
+
+    def walk(self, manager):
+        # What scoping costs without the index: one query per level of the tree
+        found, frontier = [], [manager.pk]
+        while frontier:
+            frontier = list(User.objects.filter(manager_id__in=frontier).values_list('id', flat=True))
+            found.extend(frontier)
+        return found
+
+    def timed(self, repeat, query):
+        samples, result = [], None
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                result = query()
+                samples.append(time.perf_counter() - started)
+        return result, sorted(samples), len(queries)
+
+    def report(self, label, measured):
+        _, samples, queries = measured
+        self.stdout.write(f"  {label}: median {samples[len(samples) // 2] * 1000:.2f} ms, worst {samples[-1] * 1000:.2f} ms, {queries} queries")
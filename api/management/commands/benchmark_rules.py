@@ -0,0 +1,64 @@
+# api/management/commands/benchmark_rules.py
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from api.models import ApprovalRule, Expense
+from api.rules import compile_rules
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark compiled approval rule evaluation (no database access)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', type=int, default=20, help="Top-level rules per company.")
+        parser.add_argument('--decisions', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        rules = self.build_rules(options['rules'], rng)
+        started = time.perf_counter()
+        rule_set = compile_rules(rules)
+        compile_seconds = time.perf_counter() - started
+
+        categories = ['Travel', 'Meals', 'Software', 'Hardware', 'Training']
+        decisions = [
+            (Expense(amount=Decimal(rng.randint(1, 5000)), category=rng.choice(categories)), rng.randint(1, 500), rng.randint(0, 4))
+            for _ in range(min(options['decisions'], 10000))
+        ]
+        count, approved = options['decisions'], 0
+        started = time.perf_counter()
+        for i in range(count):
+            expense, approver_id, approved_count = decisions[i % len(decisions)]
+            approved += rule_set.evaluate(expense, approver_id, approved_count, 5) == 'approved'
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f"rules: {len(rules)} rows, compiled in {compile_seconds * 1e6:.0f} us")
+        self.stdout.write(f"decisions: {count}, auto-approved: {approved}")
+        self.stdout.write(f"per decision: {elapsed / count * 1e6:.2f} us ({count / elapsed:,.0f} decisions/s)")
+
+    def build_rules(self, count, rng):
+        # Unsaved rule rows mixing every rule type, with composites holding two conditions each
+        rules, next_id = [], 1
+        for _ in range(count):
+            kind = rng.choice(['percentage', 'specific_approver', 'amount_threshold', 'category', 'all', 'any'])
+            rule = ApprovalRule(id=next_id, rule_type=kind)
+            next_id += 1
+            rules.append(rule)
+            if kind in ('all', 'any'):
+                for child_kind in ('amount_threshold', 'category'):
+                    rules.append(self.fill(ApprovalRule(id=next_id, rule_type=child_kind, parent_id=rule.id), rng))
+                    next_id += 1
+            else:
+                self.fill(rule, rng)
+        return rules
+
+    def fill(self, rule, rng):
+        rule.threshold_percentage = rng.choice([60, 80, 100])
+        rule.specific_approver_id = rng.randint(1000, 2000)
+        rule.amount_threshold = Decimal(rng.choice([25, 50, 100]))
+        rule.category = rng.choice(['Meals', 'Training'])
+        return rule
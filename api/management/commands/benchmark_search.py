@@ -0,0 +1,111 @@
+# api/management/commands/benchmark_search.py
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.utils import timezone
+
+from api.filters import filter_expenses
+from api.models import Company, Expense, User
+
+CATEGORIES = ['Travel', 'Meals', 'Lodging', 'Software', 'Hardware', 'Training', 'Office Supplies']
+WORDS = [
+    'taxi', 'airport', 'hotel', 'flight', 'train', 'lunch', 'dinner', 'breakfast', 'client', 'team',
+    'conference', 'workshop', 'license', 'subscription', 'laptop', 'monitor', 'keyboard', 'parking',
+    'fuel', 'mileage', 'coffee', 'printer', 'paper', 'course', 'certification', 'visa', 'rental',
+    'car', 'offsite', 'customer', 'meeting', 'renewal', 'annual', 'quarterly', 'sprint', 'launch',
+]
+QUERIES = [
+    ('search one word', {'search': 'conference'}),
+    ('search two words', {'search': 'client dinner'}),
+    ('status + last 30 days', {'status': 'approved', 'from': 30}),
+    ('category + amount range', {'category': 'Software', 'min_amount': '100', 'max_amount': '500'}),
+    ('search + status', {'search': 'hotel', 'status': 'pending'}),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark filtered and full-text expense list queries (first page) over a large synthetic company."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--employees', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Keep the generated company instead of rolling back.")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self.run(options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        company = Company.objects.create(name=f"Search Benchmark {options['seed']}", default_currency='USD')
+        employees = User.objects.bulk_create(
+            User(username=f'searchbench-{company.pk}-{i}', role='employee', company=company, password='!')
+            for i in range(options['employees'])
+        )
+        started = time.perf_counter()
+        self.insert_expenses(company, [employee.pk for employee in employees], options['rows'])
+        with connection.cursor() as cursor:
+            # Fresh statistics, so the planner picks between the composite indexes as it would in production
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(Expense._meta.db_table)}')
+        self.stdout.write(f"inserted {options['rows']:,} expenses in {time.perf_counter() - started:.1f} s ({connection.vendor})")
+
+        today = timezone.localdate()
+        scope = Expense.objects.filter(company=company)
+        for label, params in QUERIES:
+            query = QueryDict(mutable=True)
+            for name, value in params.items():
+                query[name] = (today - timedelta(days=value)).isoformat() if name == 'from' else value
+            queryset = filter_expenses(scope, query).order_by('-created_at', '-id')[:options['page_size'] + 1]
+            samples = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                rows = len(list(queryset.values_list('id', flat=True)))
+                samples.append(time.perf_counter() - started)
+            samples.sort()
+            self.stdout.write(
+                f"{label:<26} {rows:>3} rows  median {samples[len(samples) // 2] * 1000:7.2f} ms"
+                f"  p95 {samples[int(len(samples) * 0.95) - 1] * 1000:7.2f} ms  ({query.urlencode()})"
+            )
+
+    def insert_expenses(self, company, employee_ids, count, batch=10000):
+        # Raw executemany with explicit created_at values: bulk_create would stamp every row with
+        # auto_now_add, and building millions of model instances dominates otherwise
+        meta = Expense._meta
+        names = ['employee', 'company', 'amount', 'currency', 'category', 'description', 'status',
+                 'receipt_status', 'receipt_error', 'created_at', 'updated_at']
+        fields = [meta.get_field(name) for name in names]
+        quote = connection.ops.quote_name
+        sql = (f"INSERT INTO {quote(meta.db_table)} ({', '.join(quote(field.column) for field in fields)}) "
+               f"VALUES ({', '.join(['%s'] * len(fields))})")
+        now = timezone.now()
+        statuses = ['pending'] * 3 + ['in_progress', 'approved', 'approved', 'rejected']
+        with connection.cursor() as cursor:
+            for start in range(0, count, batch):
+                rows = []
+                for _ in range(min(batch, count - start)):
+                    created = now - timedelta(seconds=self.rng.randint(0, 730 * 86400))
+                    values = [
+                        self.rng.choice(employee_ids), company.pk, Decimal(self.rng.randint(500, 200000)) / 100,
+                        self.rng.choice(['USD', 'EUR', 'GBP', 'INR']), self.rng.choice(CATEGORIES),
+                        ' '.join(self.rng.sample(WORDS, self.rng.randint(3, 7))), self.rng.choice(statuses),
+                        '', '', created, created,
+                    ]
+                    rows.append([field.get_db_prep_save(value, connection) for field, value in zip(fields, values)])
+                cursor.executemany(sql, rows)
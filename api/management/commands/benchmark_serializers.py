@@ -0,0 +1,80 @@
+# api/management/commands/benchmark_serializers.py
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.models import Approval, Company, Expense, User
+from api.renderers import FastJSONRenderer
+from api.rowserializers import approval_rows, expense_rows
+from api.serializers import ApprovalListSerializer, ExpenseListSerializer
+
+CURRENCIES = ['USD', 'EUR', 'INR', 'GBP']
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows/second of the list serializers over model instances with the values_list() row "
+        "serializers, each including the query and JSON rendering, and check that both render the same bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='1000,10000,100000', help="Comma-separated row counts.")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement; the fastest counts.")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['rows'].split(','))
+        try:
+            with transaction.atomic():
+                self.run(sizes, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, sizes, repeat):
+        company = Company.objects.create(name='Serializer Benchmark', default_currency='EUR')
+        manager = User.objects.create(username=f'serbench-{company.pk}-m', role='manager', company=company, password='!')
+        employee = User.objects.create(username=f'serbench-{company.pk}-e', role='employee', company=company, manager=manager, password='!')
+        request = APIRequestFactory().get('/api/expenses/')
+        request.user = manager
+        context = {'request': request}
+        self.stdout.write(f"{'endpoint':<12}{'rows':>8}{'serializers rows/s':>20}{'row path rows/s':>18}{'speedup':>9}")
+        created = 0
+        for size in sizes:
+            expenses = Expense.objects.bulk_create(
+                (Expense(employee=employee, company=company, amount=Decimal(1000 + i) / 100, currency=CURRENCIES[i % 4],
+                         category='Travel', description=f'Benchmark expense {i}') for i in range(created, size)),
+                batch_size=5000,
+            )
+            Approval.objects.bulk_create((Approval(expense=expense, approver=manager, sequence=1) for expense in expenses), batch_size=5000)
+            created = size
+            expense_queryset = Expense.objects.filter(company=company).order_by('-created_at', '-id')
+            approval_queryset = Approval.objects.filter(approver=manager).order_by('-id')
+            cases = [
+                ('expenses',
+                 lambda: JSONRenderer().render(ExpenseListSerializer(list(expense_queryset), many=True, context=context).data),
+                 lambda: FastJSONRenderer().render(expense_rows.serialize(expense_rows.rows(expense_queryset), context))),
+                ('approvals',
+                 lambda: JSONRenderer().render(ApprovalListSerializer(list(approval_queryset.select_related('expense__employee')), many=True, context=context).data),
+                 lambda: FastJSONRenderer().render(approval_rows.serialize(approval_rows.rows(approval_queryset), context))),
+            ]
+            for label, current, fast in cases:
+                if current() != fast():
+                    raise CommandError(f"{label}: the row path renders different bytes at {size} rows")
+                before, after = self.best(current, repeat), self.best(fast, repeat)
+                self.stdout.write(f"{label:<12}{size:>8}{size / before:>20,.0f}{size / after:>18,.0f}{before / after:>8.1f}x")
+
+    def best(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
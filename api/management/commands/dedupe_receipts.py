@@ -0,0 +1,38 @@
+# api/management/commands/dedupe_receipts.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Expense, receipt_storage
+from api.receipts import release_files
+from api.storage import content_hash
+
+
+class Command(BaseCommand):
+    help = "Move receipts stored before content-addressed storage into it, sharing identical files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        storage = receipt_storage()
+        moved = missing = 0
+        expenses = Expense.objects.exclude(receipt='').exclude(receipt__isnull=True).only('id', 'receipt', 'receipt_thumbnail')
+        for expense in expenses.iterator(chunk_size=500):
+            fields = {}
+            for field in ('receipt', 'receipt_thumbnail'):
+                name = getattr(expense, field).name
+                if not name or content_hash(name):
+                    continue
+                if not storage.exists(name):
+                    missing += 1
+                    continue
+                if not options['dry_run']:
+                    with storage.open(name, 'rb') as handle:
+                        fields[field] = storage.save(name, handle)
+            if not fields:
+                continue
+            with transaction.atomic():
+                Expense.objects.filter(pk=expense.pk).update(**fields)
+                release_files(storage, [getattr(expense, field).name for field in fields])
+            moved += len(fields)
+        self.stdout.write(f"Moved {moved} file(s) into content-addressed storage; {missing} missing.")
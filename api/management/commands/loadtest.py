@@ -0,0 +1,155 @@
+# api/management/commands/loadtest.py
+import json
+import math
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from datetime import datetime, timezone
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+# endpoint name -> relative weight in the request mix
+ENDPOINTS = {
+    'expenses': 4,
+    'approvals': 2,
+    'approvals/act': 1,
+    'dashboard-stats': 2,
+    'notifications': 2,
+}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(ms for ms, _ in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, ok in samples if not ok),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else None,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class VirtualUser:
+    """One logged-in client. Approvers keep a small backlog of pending approvals to act on."""
+
+    def __init__(self, base_url, username, password, role, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.role = role
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.pending = []
+        response = self.session.post(f'{self.base_url}/api/token/', json={'username': username, 'password': password}, timeout=timeout)
+        if response.status_code != 200:
+            raise CommandError(f"Could not log in as {username}: HTTP {response.status_code}")
+        self.session.headers['Authorization'] = f"Bearer {response.json()['access']}"
+
+    def call(self, endpoint):
+        """Run one request; returns (latency ms, ok), or None when there is nothing to do."""
+        if endpoint == 'approvals/act':
+            if not self.pending:
+                return None
+            method, path, body = 'post', f'approvals/{self.pending.pop()}/act/', {'decision': 'approved', 'comment': 'loadtest'}
+        else:
+            method, path, body = 'get', f'{endpoint}/', None
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, f'{self.base_url}/api/{path}', json=body, timeout=self.timeout)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = round((time.perf_counter() - started) * 1000, 2)
+        if ok and endpoint == 'approvals':
+            self.pending = [row['id'] for row in response.json()['results'] if row['status'] == 'pending']
+        return elapsed, ok
+
+
+class Command(BaseCommand):
+    help = "Drive the API concurrently with users from a seed_data manifest and report per-endpoint latency as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manifest', required=True, help="JSON file written by `seed_data --manifest`.")
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run after logging in.")
+        parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+
+    def handle(self, *args, **options):
+        with open(options['manifest']) as handle:
+            manifest = json.load(handle)
+        rng = random.Random(options['seed'])
+        accounts = [user for company in manifest['companies'] for user in company['users']]
+        # Approvers are the only ones with approvals to list and act on, so make sure some are in the mix
+        approvers = [user for user in accounts if user['role'] in ('manager', 'admin')]
+        others = [user for user in accounts if user['role'] == 'employee']
+        rng.shuffle(approvers)
+        rng.shuffle(others)
+        chosen = [user for pair in zip_longest(approvers, others) for user in pair if user][:options['concurrency']]
+        if not chosen:
+            raise CommandError("The manifest has no users.")
+
+        users = [
+            VirtualUser(options['base_url'], account['username'], manifest['password'], account['role'], options['timeout'])
+            for account in chosen
+        ]
+        samples = {endpoint: [] for endpoint in options['endpoints']}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['duration']
+
+        def worker(index, user):
+            worker_rng = random.Random(options['seed'] * 1000 + index)
+            endpoints = [e for e in options['endpoints'] if user.role != 'employee' or not e.startswith('approvals')]
+            weights = [ENDPOINTS[e] for e in endpoints]
+            while endpoints and time.perf_counter() < deadline:
+                endpoint = worker_rng.choices(endpoints, weights)[0]
+                result = user.call(endpoint)
+                if result is not None:
+                    with lock:
+                        samples[endpoint].append(result)
+
+        started_at, started = datetime.now(timezone.utc), time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(users)) as pool:
+            for future in [pool.submit(worker, index, user) for index, user in enumerate(users)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        report = {
+            'commit': current_commit(),
+            'started_at': started_at.isoformat(),
+            'base_url': options['base_url'],
+            'concurrency': len(users),
+            'duration_seconds': round(elapsed, 3),
+            'endpoints': {endpoint: summarize(values, elapsed) for endpoint, values in samples.items()},
+            'total': summarize([sample for values in samples.values() for sample in values], elapsed),
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stdout.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,38 @@
+# api/management/commands/rebuild_dashboard_stats.py
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from api.stats import compute_dashboard_stats, rebuild_dashboard_stats, stored_dashboard_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the dashboard rollups from the expense table, reporting any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='companies', help="Limit to a company id (repeatable).")
+        parser.add_argument('--check', action='store_true', help="Only report drift; exit with status 1 if any is found.")
+
+    def handle(self, *args, **options):
+        companies = options['companies']
+        expected = {key: self.normalize(value) for key, value in compute_dashboard_stats(companies).items()}
+        stored = {key: self.normalize(value) for key, value in stored_dashboard_stats(companies).items()}
+        drift = sorted(
+            (key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key)),
+            key=lambda key: (key[0], key[1], key[2] or 0),
+        )
+        for company_id, scope, user_id in drift:
+            key = (company_id, scope, user_id)
+            self.stdout.write(f"company={company_id} scope={scope} user={user_id}: stored {stored.get(key)} expected {expected.get(key)}")
+        self.stdout.write(f"{len(drift)} drifted rollup(s) out of {len(expected)}.")
+        if options['check']:
+            if drift:
+                raise SystemExit(1)
+            return
+        rebuild_dashboard_stats(companies)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(expected)} rollup(s)."))
+
+    @staticmethod
+    def normalize(value):
+        pending, approved, amount = value
+        return (pending, approved, Decimal(amount).quantize(Decimal('0.01')))
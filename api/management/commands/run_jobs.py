@@ -0,0 +1,33 @@
+# api/management/commands/run_jobs.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import run_pending
+from api.routing import use_routing
+
+
+class Command(BaseCommand):
+    help = "Process queued background jobs (email delivery, notification fan-out)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the jobs that are due now, then exit.")
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--sleep', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--shard', default='default', help="Database alias whose queue to process (one worker per shard).")
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            with use_routing(shard=options['shard']):
+                while True:
+                    claimed = run_pending(options['batch_size'])
+                    total += claimed
+                    if claimed:
+                        continue
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Processed {total} job(s).")
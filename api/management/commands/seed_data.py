@@ -0,0 +1,117 @@
+# api/management/commands/seed_data.py
+import json
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Approval, ApprovalRule, ApprovalWorkflow, Company, Expense, User, WorkflowStep
+from api.orgtree import rebuild_org_tree
+from api.services import create_approval_workflows, process_approval_actions
+from api.stats import record_expense_created
+
+CATEGORIES = ['Travel', 'Meals', 'Lodging', 'Software', 'Hardware', 'Training', 'Office Supplies']
+CURRENCIES = ['USD', 'EUR', 'GBP', 'INR', 'JPY']
+
+
+class Command(BaseCommand):
+    help = "Seed synthetic companies, manager trees, workflows, rules, expenses and approvals for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=1)
+        parser.add_argument('--users', type=int, default=200, help="Users per company, including the admin.")
+        parser.add_argument('--fanout', type=int, default=8, help="Direct reports per manager.")
+        parser.add_argument('--workflows', type=int, default=3, help="Workflows per company.")
+        parser.add_argument('--steps', type=int, default=3, help="Steps per workflow.")
+        parser.add_argument('--rules', type=int, default=2, help="Approval rules per company.")
+        parser.add_argument('--expenses', type=int, default=20, help="Expenses per employee.")
+        parser.add_argument('--decided', type=float, default=0.5, help="Share of first approvals to act on.")
+        parser.add_argument('--password', default='loadtest-password')
+        parser.add_argument('--prefix', default='lt')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--manifest', help="Write the seeded usernames and roles to this JSON file for `loadtest`.")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        # Hash once; every seeded user shares the password
+        self.password_hash = make_password(options['password'])
+        manifest = {'password': options['password'], 'companies': []}
+        for index in range(options['companies']):
+            with transaction.atomic():
+                manifest['companies'].append(self.seed_company(index, options))
+            self.stdout.write(f"Seeded company {index + 1}/{options['companies']}")
+        if options['manifest']:
+            with open(options['manifest'], 'w') as handle:
+                json.dump(manifest, handle, indent=2)
+            self.stdout.write(f"Wrote {options['manifest']}")
+
+    def seed_company(self, index, options):
+        prefix = f"{options['prefix']}{options['seed']}-{index}"
+        company = Company.objects.create(name=f"Load Test {prefix}", default_currency=self.rng.choice(CURRENCIES))
+        admin = self.create_users(company, [(f'{prefix}-admin', 'admin', None)])[0]
+
+        # Breadth-first manager tree with `fanout` reports per manager. Levels are managers while
+        # another full level still fits; everyone left over becomes an employee of the last level.
+        managers, employees, frontier, count = [], [], [admin], 1
+        while count < options['users']:
+            size = len(frontier) * options['fanout']
+            if count + size * (options['fanout'] + 1) <= options['users']:
+                role = 'manager'
+            else:
+                role, size = 'employee', options['users'] - count
+            specs = [(f'{prefix}-{role[0]}{count + i}', role, frontier[i % len(frontier)]) for i in range(size)]
+            level = self.create_users(company, specs)
+            count += size
+            (managers if role == 'manager' else employees).extend(level)
+            frontier = level
+        # bulk_create skips the signals that maintain the org tree
+        rebuild_org_tree([company.pk])
+
+        approvers = managers + [admin] if managers else [admin]
+        workflows = []
+        for w in range(options['workflows']):
+            workflow = ApprovalWorkflow.objects.create(name=f'Workflow {w + 1}', company=company)
+            WorkflowStep.objects.bulk_create(
+                WorkflowStep(workflow=workflow, approver=self.rng.choice(approvers), sequence=s + 1) for s in range(options['steps'])
+            )
+            workflows.append(workflow)
+        for r in range(options['rules']):
+            if r % 2 == 0:
+                ApprovalRule.objects.create(company=company, rule_type='percentage', threshold_percentage=self.rng.choice([60, 80]))
+            else:
+                ApprovalRule.objects.create(company=company, rule_type='amount_threshold', amount_threshold=Decimal(self.rng.choice([25, 50])))
+
+        submitters = employees or managers
+        expenses = Expense.objects.bulk_create(
+            Expense(
+                employee=employee, company=company,
+                workflow=self.rng.choice(workflows + [None]) if workflows else None,
+                amount=Decimal(self.rng.randint(500, 500000)) / 100, currency=self.rng.choice(CURRENCIES),
+                category=self.rng.choice(CATEGORIES), description=f'{self.rng.choice(CATEGORIES)} expense #{n}',
+            )
+            for employee in submitters
+            for n in range(options['expenses'])
+        )
+        create_approval_workflows(expenses)
+        record_expense_created(expenses)
+
+        first_steps = list(Approval.objects.filter(expense__company=company, sequence=1).select_related('approver', 'expense__employee'))
+        decided = self.rng.sample(first_steps, int(len(first_steps) * options['decided']))
+        for decision in ('approved', 'rejected'):
+            batch = [approval for i, approval in enumerate(decided) if (i % 4 == 3) == (decision == 'rejected')]
+            for start in range(0, len(batch), 1000):
+                process_approval_actions(batch[start:start + 1000], decision, 'Seeded decision')
+
+        return {
+            'id': company.pk,
+            'users': [{'username': user.username, 'role': user.role} for user in [admin] + managers + employees],
+        }
+
+    def create_users(self, company, specs):
+        return User.objects.bulk_create(
+            User(username=username, role=role, company=company, manager=manager, password=self.password_hash,
+                 email=f'{username}@example.com')
+            for username, role, manager in specs
+        )
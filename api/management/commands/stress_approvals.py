@@ -0,0 +1,152 @@
+# api/management/commands/stress_approvals.py
+import random
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.models import Approval, ApprovalInboxItem, ApprovalWorkflow, Company, Expense, User, WorkflowStep
+from api.services import create_approval_workflows
+from api.stats import compute_dashboard_stats, record_expense_created, stored_dashboard_stats
+from api.views import ApprovalViewSet
+
+act_view = ApprovalViewSet.as_view({'post': 'act'})
+bulk_act_view = ApprovalViewSet.as_view({'post': 'bulk_act'})
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire duplicate clicks, Idempotency-Key retries and overlapping bulk actions at every approval "
+        "step concurrently, then check that each approval was processed exactly once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=200)
+        parser.add_argument('--steps', type=int, default=3)
+        parser.add_argument('--clicks', type=int, default=3, help="Plain duplicate clicks per approval.")
+        parser.add_argument('--retries', type=int, default=2, help="Requests per approval sharing one Idempotency-Key.")
+        parser.add_argument('--bulk-size', type=int, default=25, help="Approvals per overlapping bulk action.")
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Keep the generated company.")
+
+    def handle(self, *args, **options):
+        # Threads need committed rows, so this runs outside a transaction and deletes the company afterwards
+        self.rng = random.Random(options['seed'])
+        self.factory = APIRequestFactory()
+        company = self.setup(options)
+        try:
+            self.run(company, options)
+        finally:
+            if not options['keep']:
+                Company.objects.filter(pk=company.pk).delete()
+
+    def setup(self, options):
+        suffix = uuid.uuid4().hex[:8]
+        company = Company.objects.create(name=f'Approval Stress {suffix}', default_currency='USD')
+        approvers = [
+            User.objects.create_user(username=f'stress-{suffix}-a{step}', role='manager', company=company)
+            for step in range(1, options['steps'] + 1)
+        ]
+        employee = User.objects.create_user(username=f'stress-{suffix}-e', role='employee', company=company, manager=approvers[0])
+        workflow = ApprovalWorkflow.objects.create(name='Stress', company=company)
+        WorkflowStep.objects.bulk_create(
+            WorkflowStep(workflow=workflow, approver=approver, sequence=step) for step, approver in enumerate(approvers, 1)
+        )
+        Expense.objects.bulk_create(
+            Expense(employee=employee, company=company, workflow=workflow, amount=Decimal(self.rng.randint(100, 50000)) / 100,
+                    currency='USD', category='Travel', description=f'Stress {i}')
+            for i in range(options['expenses'])
+        )
+        expenses = list(Expense.objects.filter(company=company).select_related('employee'))
+        record_expense_created(expenses)
+        create_approval_workflows(expenses)
+        return company
+
+    def run(self, company, options):
+        approvals, processed, outcomes, errors, requests = [], Counter(), Counter(), Counter(), 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['threads']) as pool:
+            # Steps go in order, as approvers would; within a step everything races. Each step's
+            # approvals only exist once the one before it was approved.
+            for step in range(1, options['steps'] + 1):
+                current = list(Approval.objects.filter(expense__company=company, sequence=step).select_related('approver'))
+                approvals += current
+                calls = []
+                for approval in current:
+                    key = uuid.uuid4().hex
+                    calls += [(self.act, approval, None)] * options['clicks'] + [(self.act, approval, key)] * options['retries']
+                for start in range(0, len(current), options['bulk_size']):
+                    calls.append((self.bulk_act, current[start:start + options['bulk_size']], None))
+                self.rng.shuffle(calls)
+                requests += len(calls)
+                for ids, outcome in pool.map(lambda call: call[0](call[1], call[2]), calls):
+                    processed.update(ids)
+                    if outcome in ('processed', 'replayed', 'refused'):
+                        outcomes[outcome] += 1
+                    else:
+                        errors[outcome] += 1
+        seconds = time.perf_counter() - started
+        self.stdout.write(
+            f"{requests} requests over {len(approvals)} approvals in {seconds:.1f} s ({connection.vendor}, {options['threads']} threads): "
+            f"{sum(processed.values())} transitions, {outcomes['replayed']} replays, {outcomes['refused']} refused, {sum(errors.values())} errors"
+        )
+
+        problems = [f"{count} x {error}" for error, count in errors.items()]
+        duplicates = [pk for pk, count in processed.items() if count > 1]
+        lost = [approval.pk for approval in approvals if approval.pk not in processed]
+        if len(approvals) != options['expenses'] * options['steps']:
+            problems.append(f"{len(approvals)} approvals reached, expected {options['expenses'] * options['steps']}")
+        if duplicates:
+            problems.append(f"approvals processed more than once: {duplicates[:10]}")
+        if lost:
+            problems.append(f"approvals never processed: {lost[:10]}")
+        if Approval.objects.filter(expense__company=company).exclude(status='approved').exists():
+            problems.append("approvals left pending")
+        if Expense.objects.filter(company=company).exclude(status='approved').exists():
+            problems.append("expenses not approved")
+        if ApprovalInboxItem.objects.filter(expense__company=company).exists():
+            problems.append("inbox items left for decided expenses")
+        if stored_dashboard_stats([company.pk]) != compute_dashboard_stats([company.pk]):
+            problems.append("dashboard totals differ from a recount")
+        if problems:
+            raise CommandError('; '.join(problems))
+        self.stdout.write("OK: every approval was processed exactly once.")
+
+    def act(self, approval, key):
+        # Returns (ids transitioned by this request, outcome)
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        request = self.factory.post(f'/api/approvals/{approval.pk}/act/', {'decision': 'approved'}, format='json', **headers)
+        force_authenticate(request, user=approval.approver)
+        response = self.call(act_view, request, pk=approval.pk)
+        if isinstance(response, str):
+            return [], response
+        if response.status_code == 200:
+            return ([], 'replayed') if response.has_header('Idempotent-Replayed') else ([approval.pk], 'processed')
+        if response.status_code == 400 and 'already been processed' in str(response.data):
+            return [], 'refused'
+        return [], f'{response.status_code} {response.data}'
+
+    def bulk_act(self, approvals, key):
+        # Every approval of one step shares its approver
+        request = self.factory.post('/api/approvals/bulk-act/', {'ids': [approval.pk for approval in approvals], 'decision': 'approved'}, format='json')
+        force_authenticate(request, user=approvals[0].approver)
+        response = self.call(bulk_act_view, request)
+        if isinstance(response, str):
+            return [], response
+        if response.status_code != 200:
+            return [], f'{response.status_code} {response.data}'
+        return response.data['processed'], 'processed'
+
+    def call(self, view, request, **kwargs):
+        try:
+            return view(request, **kwargs)
+        except Exception as error:
+            return f'{type(error).__name__}: {error}'
+        finally:
+            connection.close()
@@ -0,0 +1,140 @@
+# api/media.py
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import ClaimsJWTAuthentication
+from .models import Expense, receipt_storage
+from .storage import content_hash
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def download_setting(name):
+    defaults = {'SENDFILE': '', 'INTERNAL_PREFIX': '/internal-media/', 'MAX_AGE': 31536000}
+    return getattr(settings, 'RECEIPT_DOWNLOADS', {}).get(name, defaults[name])
+
+
+def parse_range(header, size):
+    """
+    (start, end) for a single satisfiable byte range, 'unsatisfiable', or None to send the
+    whole file (no header, a malformed one, or several ranges, which we do not combine).
+    """
+    match = RANGE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(0, size - length), size - 1
+    start, end = int(first), int(last) if last else size - 1
+    if start >= size:
+        return 'unsatisfiable'
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def read_range(path, start, length, block_size=64 * 1024):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(block_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def receipt_user(request):
+    # The API's bearer token, or a logged-in session (the admin site)
+    try:
+        authenticated = ClaimsJWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    if authenticated is not None:
+        return authenticated[0]
+    user = getattr(request, 'user', None)
+    return user if user is not None and user.is_authenticated else None
+
+
+def owns_receipt(user, name):
+    # Content-addressed files are shared by identical uploads, so any expense of the user's company referencing it will do
+    return user.company_id is not None and Expense.objects.filter(
+        Q(receipt=name) | Q(receipt_thumbnail=name), company_id=user.company_id,
+    ).exists()
+
+
+@require_safe
+def serve_receipt(request, name):
+    """
+    Serve a stored receipt or thumbnail to users of the company whose expense references it;
+    anyone else gets a 404, so names cannot be probed. Content-addressed names carry their
+    sha256, which is used as a strong ETag without reading the file. With RECEIPT_DOWNLOADS['SENDFILE'] set, the
+    bytes (and any Range) are left to the web server; otherwise full responses go through
+    FileResponse, which uses the server's wsgi.file_wrapper (sendfile) when available.
+    """
+    user = receipt_user(request)
+    if user is None:
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer realm="api"'})
+    if not owns_receipt(user, name):
+        raise Http404
+    storage = receipt_storage()
+    try:
+        path = storage.path(name)
+        info = os.stat(path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404
+
+    sha = content_hash(name)
+    etag = f'"{sha}"' if sha else f'W/"{info.st_size:x}-{int(info.st_mtime):x}"'
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        # Private: shared caches must not hand one company's receipts to another
+        'Cache-Control': f"private, max-age={download_setting('MAX_AGE')}, immutable" if sha else 'private, no-cache',
+    }
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        tags = parse_etags(if_none_match)
+        if '*' in tags or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in tags):
+            return HttpResponse(status=304, headers=headers)
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    sendfile = download_setting('SENDFILE')
+    if sendfile == 'x-accel-redirect':
+        headers['X-Accel-Redirect'] = quote(download_setting('INTERNAL_PREFIX') + name)
+        return HttpResponse(content_type=content_type, headers=headers)
+    if sendfile == 'x-sendfile':
+        headers['X-Sendfile'] = path
+        return HttpResponse(content_type=content_type, headers=headers)
+
+    byte_range = parse_range(request.headers.get('Range'), info.st_size)
+    if_range = request.headers.get('If-Range')
+    if byte_range and if_range is not None and (if_range != etag or etag.startswith('W/')):
+        # If-Range needs a strong validator; a stale one gets the whole file
+        byte_range = None
+    if byte_range == 'unsatisfiable':
+        headers['Content-Range'] = f'bytes */{info.st_size}'
+        return HttpResponse(status=416, headers=headers)
+    if byte_range:
+        start, end = byte_range
+        headers['Content-Range'] = f'bytes {start}-{end}/{info.st_size}'
+        headers['Content-Length'] = end - start + 1
+        return StreamingHttpResponse(read_range(path, start, end - start + 1), status=206, content_type=content_type, headers=headers)
+
+    return FileResponse(open(path, 'rb'), content_type=content_type, headers=headers)
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_list_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='approvalrule',
+            name='amount_threshold',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text="Matches expenses up to this amount, in the expense's currency.", max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='approvalrule',
+            name='category',
+            field=models.CharField(blank=True, help_text='Matches expenses in this category (case-insensitive).', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='approvalrule',
+            name='parent',
+            field=models.ForeignKey(blank=True, help_text="Makes this rule a condition of an 'all' or 'any' rule instead of a rule of its own.", null=True, on_delete=django.db.models.deletion.CASCADE, related_name='conditions', to='api.approvalrule'),
+        ),
+        migrations.AlterField(
+            model_name='approvalrule',
+            name='rule_type',
+            field=models.CharField(choices=[('percentage', 'Percentage'), ('specific_approver', 'Specific Approver'), ('amount_threshold', 'Amount Threshold'), ('category', 'Category'), ('all', 'All Conditions'), ('any', 'Any Condition')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_approvalrule_conditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('company', 'Company'), ('manager', 'Manager'), ('employee', 'Employee')], max_length=10)),
+                ('pending_count', models.IntegerField(default=0)),
+                ('approved_count', models.IntegerField(default=0)),
+                ('total_approved_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dashboard_stats', to='api.company')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dashboard_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('company', 'scope', 'user'), name='unique_user_dashboard_stats'), models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('company', 'scope'), name='unique_company_dashboard_stats')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_data',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_status',
+            field=models.CharField(blank=True, choices=[('', 'No Receipt'), ('processing', 'Processing'), ('processed', 'Processed'), ('failed', 'Failed')], default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='receipts/thumbnails/'),
+        ),
+    ]
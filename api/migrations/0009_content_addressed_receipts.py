@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:42
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_expense_receipt_pipeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('references', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='receipt',
+            field=models.ImageField(blank=True, null=True, storage=api.models.receipt_storage, upload_to='receipts/'),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='receipt_thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=api.models.receipt_storage, upload_to='receipts/thumbnails/'),
+        ),
+    ]
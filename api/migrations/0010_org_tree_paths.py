@@ -0,0 +1,42 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from api.orgtree import closure_rows
+
+
+def build_org_tree(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    OrgTreePath = apps.get_model('api', 'OrgTreePath')
+    db = schema_editor.connection.alias
+    parents = dict(User.objects.using(db).values_list('id', 'manager_id'))
+    OrgTreePath.objects.using(db).bulk_create(
+        (OrgTreePath(ancestor_id=a, descendant_id=d, depth=depth) for a, d, depth in closure_rows(parents)),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_content_addressed_receipts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrgTreePath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='org_descendant_paths', to=settings.AUTH_USER_MODEL)),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='org_ancestor_paths', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ancestor', 'depth', 'descendant'], name='org_tree_ancestor_idx'), models.Index(fields=['descendant', 'depth', 'ancestor'], name='org_tree_descendant_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_org_tree_path')],
+            },
+        ),
+        migrations.RunPython(build_org_tree, migrations.RunPython.noop),
+    ]
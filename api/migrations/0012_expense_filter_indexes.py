@@ -0,0 +1,45 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+SEARCH_INDEX = 'expense_search_idx'
+
+
+def search_index():
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+    # Must match api.filters.search_vector() for the planner to use it
+    return GinIndex(SearchVector('description', 'category', config='english'), name=SEARCH_INDEX)
+
+
+def add_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('api', 'Expense'), search_index())
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('api', 'Expense'), search_index())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_user_token_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['company', 'status', '-created_at', '-id'], name='expense_company_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['company', 'category', '-created_at', '-id'], name='expense_company_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['company', 'amount'], name='expense_company_amount_idx'),
+        ),
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
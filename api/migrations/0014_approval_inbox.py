@@ -0,0 +1,48 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+
+
+def fill_inbox(apps, schema_editor):
+    # Pending approvals at the lowest pending sequence of an undecided expense
+    Approval = apps.get_model('api', 'Approval')
+    ApprovalInboxItem = apps.get_model('api', 'ApprovalInboxItem')
+    db = schema_editor.connection.alias
+    current = (Approval.objects.using(db).filter(expense_id=OuterRef('expense_id'), status='pending')
+               .values('expense_id').annotate(sequence=Min('sequence')).values('sequence'))
+    actionable = Approval.objects.using(db).filter(
+        status='pending', expense__status__in=['pending', 'in_progress'], sequence=Subquery(current),
+    ).values_list('id', 'approver_id', 'expense_id')
+    ApprovalInboxItem.objects.using(db).bulk_create(
+        (ApprovalInboxItem(approval_id=approval_id, approver_id=approver_id, expense_id=expense_id)
+         for approval_id, approver_id, expense_id in actionable.iterator()),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_idempotency_records'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApprovalInboxItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('approval', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_item', to='api.approval')),
+                ('approver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_items', to=settings.AUTH_USER_MODEL)),
+                ('expense', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_items', to='api.expense')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['approver', '-id'], name='inbox_approver_id_idx')],
+            },
+        ),
+        migrations.RunPython(fill_inbox, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,10 @@
 # api/models.py
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
+from django.core.files.storage import storages
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 
 class Company(models.Model):
     name = models.CharField(max_length=100)
@@ -18,6 +22,32 @@ class User(AbstractUser):
     company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True)
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='employee')
     manager = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, limit_choices_to={'role__in': ['manager', 'admin']})
+    # Bumped whenever a field copied into access tokens changes (see api.authentication)
+    token_version = models.PositiveIntegerField(default=0, editable=False)
+
+    def clean(self):
+        super().clean()
+        if self.pk is not None and self.manager_id is not None and self.in_own_team(self.manager_id):
+            raise ValidationError({'manager': "A user cannot report to themselves or to someone in their own team."})
+
+    def in_own_team(self, user_id):
+        # Themselves or anyone under them, from the org tree
+        return OrgTreePath.objects.filter(ancestor_id=self.pk, descendant_id=user_id).exists()
+
+# Closure table of the User.manager tree: one row per (ancestor, descendant) pair, including
+# each user's depth-0 row for itself. Maintained by api.orgtree; lets "everyone under this
+# manager" resolve in one indexed query at any depth.
+class OrgTreePath(models.Model):
+    ancestor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='org_descendant_paths')
+    descendant = models.ForeignKey(User, on_delete=models.CASCADE, related_name='org_ancestor_paths')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['ancestor', 'descendant'], name='unique_org_tree_path')]
+        indexes = [
+            models.Index(fields=['ancestor', 'depth', 'descendant'], name='org_tree_ancestor_idx'),
+            models.Index(fields=['descendant', 'depth', 'ancestor'], name='org_tree_descendant_idx'),
+        ]
 
 class ApprovalWorkflow(models.Model):
     name = models.CharField(max_length=100)
@@ -38,11 +68,22 @@ class ApprovalRule(models.Model):
     RULE_TYPE_CHOICES = (
         ('percentage', 'Percentage'),
         ('specific_approver', 'Specific Approver'),
+        ('amount_threshold', 'Amount Threshold'),
+        ('category', 'Category'),
+        ('all', 'All Conditions'),
+        ('any', 'Any Condition'),
     )
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='rules')
     rule_type = models.CharField(max_length=20, choices=RULE_TYPE_CHOICES)
     threshold_percentage = models.PositiveIntegerField(null=True, blank=True, help_text="e.g., 60 for 60%")
     specific_approver = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    amount_threshold = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Matches expenses up to this amount, in the expense's currency.")
+    category = models.CharField(max_length=100, blank=True, help_text="Matches expenses in this category (case-insensitive).")
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='conditions', help_text="Makes this rule a condition of an 'all' or 'any' rule instead of a rule of its own.")
+
+def receipt_storage():
+    # settings.STORAGES['receipts'], resolved lazily so tests and deployments can swap it
+    return storages['receipts']
 
 class Expense(models.Model):
     STATUS_CHOICES = (
@@ -51,6 +92,12 @@ class Expense(models.Model):
         ('rejected', 'Rejected'),
         ('in_progress', 'In Progress'),
     )
+    RECEIPT_STATUS_CHOICES = (
+        ('', 'No Receipt'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    )
     employee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expenses')
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='expenses')
     workflow = models.ForeignKey(ApprovalWorkflow, on_delete=models.SET_NULL, null=True, blank=True)
@@ -58,11 +105,27 @@ class Expense(models.Model):
     currency = models.CharField(max_length=3, default='USD')
     category = models.CharField(max_length=100)
     description = models.TextField()
-    receipt = models.ImageField(upload_to='receipts/', null=True, blank=True)
+    receipt = models.ImageField(upload_to='receipts/', storage=receipt_storage, null=True, blank=True)
+    # Filled in by the receipt pipeline (api.receipts) after an upload
+    receipt_status = models.CharField(max_length=20, choices=RECEIPT_STATUS_CHOICES, blank=True, default='')
+    receipt_thumbnail = models.ImageField(upload_to='receipts/thumbnails/', storage=receipt_storage, null=True, blank=True)
+    receipt_data = models.JSONField(null=True, blank=True)
+    receipt_error = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination scans for each list scope
+            models.Index(fields=['company', '-created_at', '-id'], name='expense_company_created_idx'),
+            models.Index(fields=['employee', '-created_at', '-id'], name='expense_employee_created_idx'),
+            # List filters (api.filters); the full-text GIN index is PostgreSQL-only and lives in migration 0012
+            models.Index(fields=['company', 'status', '-created_at', '-id'], name='expense_company_status_idx'),
+            models.Index(fields=['company', 'category', '-created_at', '-id'], name='expense_company_category_idx'),
+            models.Index(fields=['company', 'amount'], name='expense_company_amount_idx'),
+        ]
+
     def __str__(self):
         return f"{self.employee.username} - {self.amount} {self.currency}"
 
@@ -81,6 +144,31 @@ class Approval(models.Model):
     
     class Meta:
         ordering = ['sequence']
+        indexes = [models.Index(fields=['approver', '-id'], name='approval_approver_id_idx')]
+
+# An approver's actionable queue: one row per pending approval at its expense's current step, written and
+# removed by api.services in the same transaction as the approval changes, so inbox reads never touch history
+class ApprovalInboxItem(models.Model):
+    approval = models.OneToOneField(Approval, on_delete=models.CASCADE, related_name='inbox_item')
+    approver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_items')
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='inbox_items')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['approver', '-id'], name='inbox_approver_id_idx')]
+
+# The stored response of a request sent with an Idempotency-Key header (api.idempotency);
+# written in the same transaction as the request's changes, so a retry either replays it or redoes the work
+class IdempotencyRecord(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_records')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key')]
 
 class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
@@ -89,4 +177,60 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='notification_user_created_idx')]
+
+# Running dashboard totals for a company, everyone under a manager or an employee,
+# maintained by api.stats on every expense status or amount change.
+class DashboardStats(models.Model):
+    SCOPE_CHOICES = (
+        ('company', 'Company'),
+        ('manager', 'Manager'),
+        ('employee', 'Employee'),
+    )
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='dashboard_stats')
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='dashboard_stats')
+    pending_count = models.IntegerField(default=0)
+    approved_count = models.IntegerField(default=0)
+    total_approved_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'scope', 'user'], condition=models.Q(user__isnull=False), name='unique_user_dashboard_stats'),
+            models.UniqueConstraint(fields=['company', 'scope'], condition=models.Q(user__isnull=True), name='unique_company_dashboard_stats'),
+        ]
+
+
+# Background work (email, notification fan-out) run by `manage.py run_jobs`, see api.jobs.
+class Job(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx')]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+class StoredFile(models.Model):
+    # One row per file in the content-addressed receipt storage (api.storage), with its reference count
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.references})"
@@ -0,0 +1,122 @@
+# api/orgtree.py
+from collections import defaultdict
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Count, Q, Sum
+
+from .models import Expense, OrgTreePath, User
+from .stats import PENDING_STATUSES, ZERO, apply_stats_deltas
+
+
+def subtree_user_ids(manager):
+    """Subquery of everyone under ``manager`` at any depth (not the manager themselves)."""
+    return OrgTreePath.objects.filter(ancestor=manager, depth__gt=0).values('descendant_id')
+
+
+def closure_rows(parents):
+    """
+    ``(ancestor_id, descendant_id, depth)`` for every pair in the forest described by
+    ``{user_id: manager_id}``. Managers missing from ``parents`` end a chain, and so does a cycle.
+    """
+    chains = {}
+    for user_id in parents:
+        path, node = [], user_id
+        # Walk up until a node whose chain is already known
+        while node is not None and node not in chains and node not in path:
+            path.append(node)
+            node = parents.get(node)
+        above = chains.get(node, [])
+        for node in reversed(path):
+            above = [node] + above
+            chains[node] = above
+    for user_id, chain in chains.items():
+        for depth, ancestor_id in enumerate(chain):
+            yield ancestor_id, user_id, depth
+
+
+def rebuild_org_tree(company_ids=None):
+    users = User.objects.all()
+    if company_ids is not None:
+        users = users.filter(company_id__in=company_ids)
+    parents = dict(users.values_list('id', 'manager_id'))
+    with transaction.atomic(using=router.db_for_write(OrgTreePath)):
+        OrgTreePath.objects.filter(descendant_id__in=list(parents)).delete()
+        insert_paths(closure_rows(parents))
+    return len(parents)
+
+
+def insert_paths(rows):
+    """
+    Insert ``(ancestor_id, descendant_id, depth)`` tuples with one ``executemany``; a rebuild
+    writes roughly users x depth rows, and building a model instance for each dominates otherwise.
+    """
+    meta = OrgTreePath._meta
+    connection = connections[router.db_for_write(OrgTreePath)]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(meta.get_field(name).column) for name in ('ancestor', 'descendant', 'depth'))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {quote(meta.db_table)} ({columns}) VALUES (%s, %s, %s)', list(rows))
+
+
+def add_user(user):
+    """Paths for a new user: itself, plus one per ancestor of its manager."""
+    rows = [OrgTreePath(ancestor_id=user.pk, descendant_id=user.pk, depth=0)]
+    if user.manager_id:
+        rows += [
+            OrgTreePath(ancestor_id=ancestor_id, descendant_id=user.pk, depth=depth + 1)
+            for ancestor_id, depth in OrgTreePath.objects.filter(descendant_id=user.manager_id).values_list('ancestor_id', 'depth')
+        ]
+    OrgTreePath.objects.bulk_create(rows)
+
+
+def check_move(user, manager_id):
+    # Last guard for saves that skipped User.clean(); forms and serializers report the error first
+    if manager_id and user.in_own_team(manager_id):
+        raise IntegrityError(f"User {user.pk} cannot report to {manager_id}: the manager chain would form a cycle.")
+
+
+def move_subtree(user, manager_id):
+    """
+    Re-attach ``user`` and everyone under them below ``manager_id`` (or make them a root).
+
+    Only paths crossing the boundary change: those from the old ancestors into the subtree are
+    dropped and ones from the new ancestors are added. The managers' dashboard rollups move with
+    the subtree's expense totals.
+    """
+    with transaction.atomic(using=router.db_for_write(OrgTreePath)):
+        subtree = dict(OrgTreePath.objects.filter(ancestor_id=user.pk).values_list('descendant_id', 'depth'))
+        old_ancestors = list(OrgTreePath.objects.filter(descendant_id=user.pk, depth__gt=0).values_list('ancestor_id', flat=True))
+        OrgTreePath.objects.filter(descendant_id__in=list(subtree), ancestor_id__in=old_ancestors).delete()
+        new_ancestors = []
+        if manager_id:
+            new_ancestors = list(OrgTreePath.objects.filter(descendant_id=manager_id).values_list('ancestor_id', 'depth'))
+            insert_paths(
+                (ancestor_id, descendant_id, depth + 1 + below)
+                for ancestor_id, depth in new_ancestors
+                for descendant_id, below in subtree.items()
+            )
+        move_manager_stats(user.company_id, subtree, old_ancestors, [ancestor_id for ancestor_id, _ in new_ancestors])
+
+
+def move_manager_stats(company_id, subtree, old_ancestors, new_ancestors):
+    totals = Expense.objects.filter(employee_id__in=list(subtree)).aggregate(
+        pending=Count('id', filter=Q(status__in=PENDING_STATUSES)),
+        approved=Count('id', filter=Q(status='approved')),
+        amount=Sum('amount', filter=Q(status='approved')),
+    )
+    moved = (totals['pending'], totals['approved'], totals['amount'] or ZERO)
+    if not any(moved):
+        return
+    deltas = defaultdict(lambda: [0, 0, ZERO])
+    for ancestors, sign in ((old_ancestors, -1), (new_ancestors, 1)):
+        for ancestor_id in ancestors:
+            entry = deltas[(company_id, 'manager', ancestor_id)]
+            for i in range(3):
+                entry[i] += sign * moved[i]
+    apply_stats_deltas(deltas)
+
+
+def detach_reports(user):
+    """Before ``user`` is deleted: their direct reports become roots, as the SET_NULL on User.manager will make them."""
+    for report in User.objects.filter(manager_id=user.pk).only('id', 'company_id'):
+        move_subtree(report, None)
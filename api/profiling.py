@@ -0,0 +1,275 @@
+# api/profiling.py
+import cProfile
+import hmac
+import logging
+import random
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_safe
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Histogram per metric; api_request_duration_seconds covers every request, the rest only sampled ones
+HISTOGRAMS = {
+    'api_request_duration_seconds': ("Request latency until the response is returned.", SECONDS_BUCKETS),
+    'api_request_db_queries': ("SQL queries per sampled request.", QUERY_BUCKETS),
+    'api_request_db_seconds': ("SQL time per sampled request.", SECONDS_BUCKETS),
+    'api_request_serialize_seconds': ("Serializer time per sampled request.", SECONDS_BUCKETS),
+    'api_request_external_seconds': ("Exchange rate lookups and conversions per sampled request.", SECONDS_BUCKETS),
+}
+
+
+def profiling_setting(name):
+    defaults = {
+        'ENABLED': True, 'SAMPLE_RATE': 0.1, 'SERVER_TIMING': True,
+        'PROFILE_RATE': 0, 'PROFILE_SLOW_MS': 1000, 'PROFILE_DIR': Path(settings.BASE_DIR) / 'profiles',
+        'METRICS_TOKEN': '', 'METRICS_IPS': (),
+    }
+    return getattr(settings, 'PROFILING', {}).get(name, defaults[name])
+
+
+class RequestTimings:
+    """Where a sampled request spent its time, in seconds. Timers of one kind do not nest."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = {'db': 0.0, 'serialize': 0.0, 'external': 0.0}
+        self.running = set()
+
+
+_timings = ContextVar('request_timings', default=None)
+
+
+@contextmanager
+def timed(kind):
+    timings = _timings.get()
+    if timings is None or kind in timings.running:
+        yield
+        return
+    timings.running.add(kind)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.seconds[kind] += time.perf_counter() - started
+        timings.running.discard(kind)
+
+
+def timed_call(kind):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _timings.get() is None:
+                return func(*args, **kwargs)
+            with timed(kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def time_query(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.seconds['db'] += time.perf_counter() - started
+
+
+def instrument_serializers():
+    # Serializer.data and ListSerializer.data are where every view renders its objects
+    from rest_framework.serializers import ListSerializer, Serializer
+
+    for cls in (Serializer, ListSerializer):
+        data = cls.__dict__['data']
+        if not getattr(data.fget, 'profiled', False):
+            fget = timed_call('serialize')(data.fget)
+            fget.profiled = True
+            setattr(cls, 'data', property(fget))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Request counts and histograms per view and method, aggregated in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = Counter()
+        self._histograms = {}
+
+    def record(self, view, method, status, seconds, timings=None):
+        observations = {'api_request_duration_seconds': seconds}
+        if timings is not None:
+            observations['api_request_db_queries'] = timings.queries
+            observations.update(('api_request_{}_seconds'.format(kind), value) for kind, value in timings.seconds.items())
+        with self._lock:
+            self._requests[view, method, status] += 1
+            for name, value in observations.items():
+                histogram = self._histograms.get((name, view, method))
+                if histogram is None:
+                    histogram = self._histograms[name, view, method] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+
+    def render(self):
+        # Prometheus text exposition format 0.0.4
+        with self._lock:
+            requests = sorted(self._requests.items())
+            histograms = sorted((key, list(h.counts), h.sum) for key, h in self._histograms.items())
+        lines = ['# HELP api_requests_total Requests by view, method and status.', '# TYPE api_requests_total counter']
+        lines += [f'api_requests_total{labels(view=view, method=method, status=status)} {count}'
+                  for (view, method, status), count in requests]
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (metric, view, method), counts, total in histograms:
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip([*buckets, '+Inf'], counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{labels(view=view, method=method, le=bound)} {cumulative}')
+                lines.append(f'{name}_sum{labels(view=view, method=method)} {total:g}')
+                lines.append(f'{name}_count{labels(view=view, method=method)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._requests.clear()
+            self._histograms.clear()
+
+
+registry = MetricsRegistry()
+
+
+def labels(**values):
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in values.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(values, escaped)) + '}'
+
+
+def view_label(view_func, method):
+    # ExpenseViewSet.list, ApprovalViewSet.act, DashboardStatsView.get, serve_receipt
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return getattr(view_func, '__name__', 'view')
+    actions = getattr(view_func, 'actions', None)
+    action = actions.get(method.lower()) if actions else method.lower()
+    return f'{view_class.__name__}.{action or method.lower()}'
+
+
+def server_timing(seconds, timings):
+    entries = [f'total;dur={seconds * 1000:.1f}']
+    if timings is not None:
+        entries.append(f'db;dur={timings.seconds["db"] * 1000:.1f};desc="{timings.queries} queries"')
+        entries += [f'{kind};dur={timings.seconds[kind] * 1000:.1f}' for kind in ('serialize', 'external')]
+    return ', '.join(entries)
+
+
+def start_profiler():
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already running in this thread
+        return None
+    return profiler
+
+
+def save_profile(profiler, view, seconds):
+    directory = Path(profiling_setting('PROFILE_DIR'))
+    path = directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{view}-{seconds * 1000:.0f}ms-{uuid.uuid4().hex[:6]}.prof"
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path)
+    except OSError as exc:
+        logger.warning("Could not save profile of %s: %s", view, exc)
+        return None
+    logger.info("%s took %.0f ms; profile saved to %s", view, seconds * 1000, path)
+    return path
+
+
+class ProfilingMiddleware:
+    """
+    Times every request into the in-process histograms served at /api/metrics/. A SAMPLE_RATE
+    share of requests also count their SQL queries and time SQL, serializers and exchange rate
+    work, reported in the Server-Timing header. With PROFILE_RATE above zero that share of
+    requests runs under cProfile, and profiles of requests slower than PROFILE_SLOW_MS are
+    written to PROFILE_DIR (open them with snakeviz).
+
+    Streamed responses are timed until their first byte; queries made while streaming are not counted.
+    """
+
+    def __init__(self, get_response):
+        if not profiling_setting('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings() if random.random() < profiling_setting('SAMPLE_RATE') else None
+        profile_rate = profiling_setting('PROFILE_RATE')
+        profiler = None
+        request.profiling_view = 'unmatched'
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                if timings is not None:
+                    for alias in connections:
+                        stack.enter_context(connections[alias].execute_wrapper(time_query))
+                if profile_rate and random.random() < profile_rate:
+                    profiler = start_profiler()
+                    if profiler is not None:
+                        stack.callback(profiler.disable)
+                response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        seconds = time.perf_counter() - started
+
+        registry.record(request.profiling_view, request.method, response.status_code, seconds, timings)
+        if profiling_setting('SERVER_TIMING'):
+            response['Server-Timing'] = server_timing(seconds, timings)
+        if profiler is not None and seconds * 1000 >= profiling_setting('PROFILE_SLOW_MS'):
+            save_profile(profiler, request.profiling_view, seconds)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profiling_view = view_label(view_func, request.method)
+
+
+@require_safe
+def metrics(request):
+    # Scrapers send METRICS_TOKEN as a bearer token, or come from an address listed in METRICS_IPS.
+    # Neither is set by default, so the endpoint is closed until one is: behind a reverse proxy on
+    # the same host every client's REMOTE_ADDR is the proxy's
+    token = profiling_setting('METRICS_TOKEN')
+    allowed = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not allowed:
+        allowed = request.META.get('REMOTE_ADDR') in profiling_setting('METRICS_IPS')
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,165 @@
+# api/receipts.py
+import os
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import router, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .jobs import enqueue, job_handler
+from .models import Expense
+from .stats import expense_state, record_expense_changes
+
+
+def receipt_setting(name):
+    defaults = {
+        'OCR_BACKEND': 'api.services.perform_ocr_on_receipt',
+        'MAX_DIMENSION': 2000,
+        'THUMBNAIL_SIZE': 256,
+        'PROCESSES': 0,
+    }
+    return getattr(settings, 'RECEIPTS', {}).get(name, defaults[name])
+
+
+def submit_receipt(expense, receipt_file):
+    """
+    Store an uploaded receipt and queue it for processing. The storage backend copies the upload
+    in chunks; the expense row is touched by a single UPDATE.
+    """
+    replaced = [expense.receipt.name, expense.receipt_thumbnail.name]
+    with transaction.atomic(using=router.db_for_write(Expense)):
+        expense.receipt.save(receipt_file.name, receipt_file, save=False)
+        expense.receipt_status, expense.receipt_data, expense.receipt_error = 'processing', None, ''
+        Expense.objects.filter(pk=expense.pk).update(
+            receipt=expense.receipt.name, receipt_thumbnail='', receipt_status='processing',
+            receipt_data=None, receipt_error='', updated_at=timezone.now(),
+        )
+        release_files(expense.receipt.storage, replaced)
+        enqueue('process_receipt', {'expense_id': expense.pk, 'receipt': expense.receipt.name})
+
+
+def release_files(storage, names):
+    # Drops one reference per name; files shared with other expenses stay until their last reference goes
+    for name in names:
+        if name:
+            storage.delete(name)
+
+
+def analyze_receipt(data, ocr_backend, max_dimension, thumbnail_size):
+    """
+    CPU-bound part of the pipeline, safe to run in a worker process: returns the downscaled image
+    (or None when it is already small enough), a JPEG thumbnail and the OCR fields.
+    """
+    image = Image.open(BytesIO(data))
+    image_format = image.format or 'PNG'
+    image = ImageOps.exif_transpose(image)
+    normalized = None
+    if max(image.size) > max_dimension:
+        image.thumbnail((max_dimension, max_dimension))
+        normalized = encode(image, image_format)
+        data = normalized
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+    receipt = BytesIO(data)
+    receipt.name = f'receipt.{image_format.lower()}'
+    return {
+        'image': normalized,
+        'thumbnail': encode(thumbnail.convert('RGB'), 'JPEG'),
+        'ocr': import_string(ocr_backend)(receipt),
+    }
+
+
+def encode(image, image_format):
+    buffer = BytesIO()
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(buffer, format=image_format, quality=85)
+    return buffer.getvalue()
+
+
+@job_handler('process_receipt')
+def process_receipts(payloads):
+    """Analyze a batch of receipts and write each result back in one UPDATE."""
+    receipts = {payload['expense_id']: payload['receipt'] for payload in payloads}
+    expenses = [
+        expense for expense in Expense.objects.filter(pk__in=list(receipts), receipt_status='processing').select_related('employee')
+        # Skip receipts that were replaced after the job was queued; the newer upload has its own job
+        if expense.receipt.name == receipts[expense.pk]
+    ]
+    if not expenses:
+        return
+    options = (receipt_setting('OCR_BACKEND'), receipt_setting('MAX_DIMENSION'), receipt_setting('THUMBNAIL_SIZE'))
+    # Missing files and analysis errors both end up as exceptions in `results`
+    results = [capture(read_file, expense.receipt) for expense in expenses]
+    pending = [(index, data) for index, data in enumerate(results) if not isinstance(data, Exception)]
+    processes = receipt_setting('PROCESSES')
+    if processes > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(processes, len(pending)), initializer=setup_worker,
+                                 initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),)) as pool:
+            futures = [(index, pool.submit(analyze_receipt, data, *options)) for index, data in pending]
+            for index, future in futures:
+                results[index] = capture(future.result)
+    else:
+        for index, data in pending:
+            results[index] = capture(analyze_receipt, data, *options)
+
+    changes = []
+    for expense, result in zip(expenses, results):
+        if isinstance(result, Exception):
+            write_back(expense, receipt_status='failed', receipt_error=str(result) or result.__class__.__name__)
+            continue
+        before = expense_state(expense)
+        fields = {'receipt_status': 'processed', 'receipt_data': result['ocr']}
+        ocr = result['ocr']
+        if ocr.get('amount') is not None:
+            fields['amount'] = Decimal(str(ocr['amount'])).quantize(Decimal('0.01'))
+        if ocr.get('description'):
+            fields['description'] = ocr['description']
+        storage, original = expense.receipt.storage, expense.receipt.name
+        if result['image'] is not None:
+            fields['receipt'] = storage.save(expense.receipt.field.generate_filename(expense, os.path.basename(original)), ContentFile(result['image']))
+        thumbnail_field = expense.receipt_thumbnail.field
+        fields['receipt_thumbnail'] = storage.save(thumbnail_field.generate_filename(expense, f'{expense.pk}.jpg'), ContentFile(result['thumbnail']))
+        if write_back(expense, **fields):
+            if 'receipt' in fields:
+                storage.delete(original)
+            changes.append((expense, before, expense_state(expense)))
+        else:
+            release_files(storage, [fields.get('receipt'), fields['receipt_thumbnail']])
+    record_expense_changes(changes)
+
+
+def write_back(expense, **fields):
+    # Guarded on the receipt name so a result never lands on a newer upload
+    fields['updated_at'] = timezone.now()
+    updated = Expense.objects.filter(pk=expense.pk, receipt=expense.receipt.name).update(**fields)
+    if updated:
+        for name, value in fields.items():
+            setattr(expense, name, value)
+    return updated
+
+
+def read_file(field_file):
+    with field_file.open('rb') as handle:
+        return handle.read()
+
+
+def capture(func, *args):
+    # Unreadable or unsupported images fail the receipt, not the whole job batch
+    try:
+        return func(*args)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as exc:
+        return exc
+
+
+def setup_worker(settings_module):
+    if settings_module:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
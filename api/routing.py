@@ -0,0 +1,164 @@
+# api/routing.py
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Rows shared by every shard: receipt files are content-addressed on one storage, so their
+# reference counts must be counted in one place
+GLOBAL_MODELS = {'api.storedfile'}
+
+
+def routing_setting(name):
+    defaults = {'REPLICAS': {}, 'COMPANY_SHARDS': {}, 'STICKY_SECONDS': 10}
+    return getattr(settings, 'DATABASE_ROUTING', {}).get(name, defaults[name])
+
+
+class RoutingState:
+    """Where the current request's queries go: its company's shard, and whether reads may use a replica."""
+
+    def __init__(self, read_only=False, shard=DEFAULT_DB_ALIAS):
+        self.read_only = read_only
+        self.shard = shard
+        self.user_id = None
+        self.pinned = False
+        self.wrote = False
+
+
+_state = ContextVar('database_routing', default=None)
+
+
+def shard_for_company(company_id):
+    if company_id is None:
+        return DEFAULT_DB_ALIAS
+    shards = routing_setting('COMPANY_SHARDS')
+    return shards.get(company_id, shards.get(str(company_id), DEFAULT_DB_ALIAS))
+
+
+def shard_aliases():
+    return [DEFAULT_DB_ALIAS] + sorted(set(routing_setting('COMPANY_SHARDS').values()) - {DEFAULT_DB_ALIAS})
+
+
+def primary_of(alias):
+    for primary, replicas in routing_setting('REPLICAS').items():
+        if alias in replicas:
+            return primary
+    return alias
+
+
+@contextmanager
+def use_routing(read_only=False, shard=DEFAULT_DB_ALIAS):
+    """Route queries inside the block; requests get one from DatabaseRoutingMiddleware, workers and commands can use it directly."""
+    token = _state.set(RoutingState(read_only, shard))
+    try:
+        yield _state.get()
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_shard(alias):
+    state = _state.get()
+    if state is None:
+        with use_routing(shard=alias):
+            yield
+        return
+    previous, state.shard = state.shard, alias
+    try:
+        yield
+    finally:
+        state.shard = previous
+
+
+def pin_key(user_id):
+    return f'db-pin:{user_id}'
+
+
+def bind_user(user_id, company_id):
+    """Called by authentication: move the request to the user's shard and honour a recent write pin."""
+    state = _state.get()
+    if state is None:
+        return
+    state.user_id = user_id
+    state.shard = shard_for_company(company_id)
+    if state.read_only and routing_setting('REPLICAS').get(state.shard) and cache.get(pin_key(user_id)):
+        state.pinned = True
+
+
+def replica_action(view_func, method):
+    # Views opt in with replica_actions: viewset action names, or 'get' on a plain APIView
+    view_class = getattr(view_func, 'cls', None)
+    allowed = getattr(view_class, 'replica_actions', ())
+    actions = getattr(view_func, 'actions', None)
+    action = actions.get(method.lower()) if actions else method.lower()
+    return action in allowed or (method == 'HEAD' and 'get' in allowed)
+
+
+class DatabaseRouter:
+    """
+    Sends reads of opted-in safe requests to a replica of the company's shard and everything
+    else to the shard's primary. Once anything is written, the rest of the request reads from
+    the primary, and so do the same user's requests for STICKY_SECONDS afterwards.
+
+    A shard holds every row of the companies pinned to it (COMPANY_SHARDS), users included;
+    code outside a request (job workers, commands) runs against the default alias unless it
+    enters use_routing(shard=...).
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or model._meta.label_lower in GLOBAL_MODELS:
+            return None
+        if state.read_only and not state.pinned:
+            replicas = routing_setting('REPLICAS').get(state.shard)
+            if replicas:
+                return random.choice(replicas)
+        return state.shard
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is None or model._meta.label_lower in GLOBAL_MODELS:
+            return None
+        state.pinned = state.wrote = True
+        return state.shard
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A replica holds the same rows as its primary
+        return primary_of(obj1._state.db) == primary_of(obj2._state.db)
+
+
+class DatabaseRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with use_routing() as state:
+            response = self.get_response(request)
+            if state.wrote and state.user_id is not None and routing_setting('REPLICAS').get(state.shard):
+                cache.set(pin_key(state.user_id), True, routing_setting('STICKY_SECONDS'))
+        if response.streaming and state.read_only:
+            # Streamed exports run their queries after the view returns
+            response.streaming_content = routed_stream(state, response.streaming_content)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _state.get()
+        if state is not None and request.method in SAFE_METHODS:
+            state.read_only = replica_action(view_func, request.method)
+
+
+def routed_stream(state, content):
+    iterator = iter(content)
+    while True:
+        token = _state.set(state)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _state.reset(token)
+        yield chunk
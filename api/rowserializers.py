@@ -0,0 +1,136 @@
+# api/rowserializers.py
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db.models.fields.files import FieldFile
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from .serializers import ApprovalInboxSerializer, ApprovalListSerializer, ExpenseListSerializer, NotificationSerializer
+
+
+def converter(field):
+    # What to_representation amounts to for a database value; None when it returns the value as is
+    kind = type(field)
+    if kind is serializers.CharField:
+        return str
+    if kind is serializers.IntegerField:
+        return int
+    if kind is serializers.ReadOnlyField or (kind is serializers.PrimaryKeyRelatedField and field.pk_field is None):
+        return None
+    if kind is serializers.DateTimeField and getattr(field, 'format', api_settings.DATETIME_FORMAT).lower() == ISO_8601:
+        return iso_datetime(field)
+    return field.to_representation
+
+
+def iso_datetime(field):
+    # DateTimeField.to_representation with the field's time zone looked up once instead of per value
+    tz = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if tz is None:
+        return field.to_representation
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        try:
+            text = value.astimezone(tz).isoformat()
+        except OverflowError:
+            return field.to_representation(value)
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return convert
+
+
+class RowSerializer:
+    """
+    Read-only twin of a flat DRF serializer that renders ``values_list()`` rows instead of
+    model instances, with the same output. The field plan (which lookup feeds which field,
+    and how it is converted) is compiled from the serializer's fields on first use; each call
+    then binds one serializer for its context instead of one per row.
+
+    Method fields are called with the row, so they may only read the attributes listed for
+    them in ``method_lookups``. Nested serializers and relations other than primary keys are
+    not supported.
+    """
+
+    def __init__(self, serializer_class, method_lookups=None):
+        self.serializer_class = serializer_class
+        self.method_lookups = method_lookups or {}
+        self._plan = None
+
+    @property
+    def plan(self):
+        # [(field name, lookup or None for method fields)]
+        if self._plan is None:
+            model = self.serializer_class.Meta.model
+            fields = []
+            for name, field in self.serializer_class().fields.items():
+                if field.write_only:
+                    continue
+                if isinstance(field, serializers.SerializerMethodField):
+                    if name not in self.method_lookups:
+                        raise ImproperlyConfigured(f"{self.serializer_class.__name__}.{name} needs method_lookups.")
+                    fields.append((name, None))
+                else:
+                    fields.append((name, self.lookup(model, field)))
+            self._plan = fields
+        return self._plan
+
+    def select(self, fields=None):
+        # The planned fields limited to ``fields`` (None for all), and the lookups they read
+        chosen = [(name, lookup) for name, lookup in self.plan if fields is None or name in fields]
+        lookups = {}
+        for name, lookup in chosen:
+            lookups.update(dict.fromkeys(self.method_lookups[name] if lookup is None else (lookup,)))
+        return chosen, list(lookups)
+
+    def lookup(self, model, field):
+        if isinstance(field, serializers.BaseSerializer) or field.source == '*' or (
+            isinstance(field, serializers.RelatedField) and not isinstance(field, serializers.PrimaryKeyRelatedField)
+        ):
+            raise ImproperlyConfigured(f"{self.serializer_class.__name__}.{field.field_name} cannot be read from a row.")
+        for attr in field.source_attrs:
+            try:
+                model_field = model._meta.get_field(attr)
+            except FieldDoesNotExist:
+                raise ImproperlyConfigured(f"{self.serializer_class.__name__}.{field.field_name} is not a database field.")
+            if model_field.null and model_field.is_relation and attr != field.source_attrs[-1]:
+                # DRF would skip the field when the relation is missing; a row just has None
+                raise ImproperlyConfigured(f"{self.serializer_class.__name__}.{field.field_name} follows a nullable relation.")
+            model = model_field.related_model
+        return '__'.join(field.source_attrs)
+
+    def rows(self, queryset, *extra, fields=None):
+        # Named rows, so KeysetPagination can read its cursor fields (add any that are not serialized)
+        return queryset.values_list(*dict.fromkeys([*self.select(fields)[1], *extra]), named=True)
+
+    def serialize(self, rows, context=None, fields=None):
+        fields, lookups = self.select(fields)
+        serializer = self.serializer_class(context=context or {})
+        model = self.serializer_class.Meta.model
+        bound = serializer.fields
+        columns = []
+        for name, lookup in fields:
+            field = bound[name]
+            if lookup is None:
+                columns.append((name, None, getattr(serializer, field.method_name)))
+            elif isinstance(field, serializers.FileField):
+                model_field = model._meta.get_field(lookup)
+                columns.append((name, lookups.index(lookup),
+                                lambda value, field=field, model_field=model_field: field.to_representation(FieldFile(None, model_field, value))))
+            else:
+                columns.append((name, lookups.index(lookup), converter(field)))
+        data = []
+        for row in rows:
+            item = {}
+            for name, index, convert in columns:
+                if index is None:
+                    item[name] = convert(row)
+                    continue
+                value = row[index]
+                item[name] = value if value is None or convert is None else convert(value)
+            data.append(item)
+        return data
+
+
+expense_rows = RowSerializer(ExpenseListSerializer, method_lookups={'converted_amount': ('amount', 'currency')})
+approval_rows = RowSerializer(ApprovalListSerializer)
+inbox_rows = RowSerializer(ApprovalInboxSerializer)
+notification_rows = RowSerializer(NotificationSerializer)
@@ -0,0 +1,132 @@
+# api/rules.py
+import threading
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ApprovalRule
+
+
+class RuleSet:
+    """
+    A company's approval rules compiled into plain predicates.
+
+    Top-level rules are OR'ed: the expense is auto-approved as soon as one matches. Evaluation
+    touches no database; approval tallies are passed in by the caller.
+    """
+
+    def __init__(self, predicates, needs_tallies, version=None):
+        self.predicates = predicates
+        self.needs_tallies = needs_tallies
+        self.version = version
+
+    def evaluate(self, expense, approver_id, approved_count=0, total_count=0):
+        decision = Decision(expense, approver_id, approved_count, total_count)
+        for predicate in self.predicates:
+            if predicate(decision):
+                return 'approved'
+        return None
+
+
+class Decision:
+    __slots__ = ('expense', 'approver_id', 'approved_count', 'total_count')
+
+    def __init__(self, expense, approver_id, approved_count, total_count):
+        self.expense = expense
+        self.approver_id = approver_id
+        self.approved_count = approved_count
+        self.total_count = total_count
+
+
+def compile_rules(rules, version=None):
+    """Compile ApprovalRule rows (top-level rules and their conditions, in any order) into a RuleSet."""
+    children = defaultdict(list)
+    roots = []
+    for rule in rules:
+        if rule.parent_id:
+            children[rule.parent_id].append(rule)
+        else:
+            roots.append(rule)
+    needs_tallies = any(rule.rule_type == 'percentage' for rule in rules)
+    predicates = [predicate for predicate in (compile_rule(rule, children) for rule in roots) if predicate]
+    return RuleSet(predicates, needs_tallies, version)
+
+
+def compile_rule(rule, children):
+    """Build a predicate over a Decision, or None when the rule is incomplete and can never match."""
+    kind = rule.rule_type
+    if kind == 'specific_approver':
+        approver_id = rule.specific_approver_id
+        if approver_id is None:
+            return None
+        return lambda d: d.approver_id == approver_id
+    if kind == 'percentage':
+        threshold = rule.threshold_percentage
+        if threshold is None:
+            return None
+        return lambda d: d.total_count > 0 and (d.approved_count / d.total_count) * 100 >= threshold
+    if kind == 'amount_threshold':
+        limit = rule.amount_threshold
+        if limit is None:
+            return None
+        return lambda d: d.expense.amount <= limit
+    if kind == 'category':
+        category = rule.category.strip().lower()
+        if not category:
+            return None
+        return lambda d: d.expense.category.strip().lower() == category
+    if kind in ('all', 'any'):
+        conditions = [compile_rule(child, children) for child in children[rule.pk]]
+        if not conditions or None in conditions:
+            # An empty or partly incomplete composite never matches
+            return None
+        combine = all if kind == 'all' else any
+        return lambda d: combine(condition(d) for condition in conditions)
+    return None
+
+
+_rule_sets = {}
+_lock = threading.Lock()
+
+
+def _version_key(company_id):
+    return f'approval-rules-version:{company_id}'
+
+
+def get_rule_set(company_id):
+    """
+    The compiled rules for a company, cached in-process. The cached entry is tagged with a
+    version counter kept in the Django cache, so writes on one process invalidate every
+    process that shares the cache backend.
+    """
+    version = cache.get(_version_key(company_id), 0)
+    rule_set = _rule_sets.get(company_id)
+    if rule_set is not None and rule_set.version == version:
+        return rule_set
+    rule_set = compile_rules(list(ApprovalRule.objects.filter(company_id=company_id)), version)
+    with _lock:
+        _rule_sets[company_id] = rule_set
+    return rule_set
+
+
+def invalidate_rules(company_id, using=None):
+    """
+    Takes effect once the write on ``using`` commits, so no process can compile the old
+    rules under the new version in between.
+    """
+    def invalidate():
+        key = _version_key(company_id)
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+        with _lock:
+            _rule_sets.pop(company_id, None)
+    transaction.on_commit(invalidate, using=using)
+
+
+def clear_rule_sets():
+    with _lock:
+        _rule_sets.clear()
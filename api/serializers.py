@@ -2,17 +2,20 @@
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import *
-from .services import convert_currency
+from .authentication import token_claims
+from .fieldsets import ShapedSerializerMixin
+from .services import convert_currency, get_rate_snapshot, unreached_steps
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
-        token['username'] = user.username
-        token['role'] = user.role
+        # Enough for api.authentication to build request.user without a query
+        for claim, value in token_claims(user).items():
+            token[claim] = value
         return token
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True)
     class Meta:
         model = User
@@ -36,13 +39,14 @@ class SignupSerializer(serializers.ModelSerializer):
         user = User.objects.create_user(username=validated_data['username'], password=validated_data['password'], email=validated_data.get('email', ''), first_name=validated_data.get('first_name', ''), last_name=validated_data.get('last_name', ''), role='admin', company=company)
         return user
 
-class WorkflowStepSerializer(serializers.ModelSerializer):
+class WorkflowStepSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = WorkflowStep
         fields = ['approver', 'sequence']
 
-class ApprovalWorkflowSerializer(serializers.ModelSerializer):
+class ApprovalWorkflowSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     steps = WorkflowStepSerializer(many=True)
+    collapsed = {'steps': serializers.PrimaryKeyRelatedField(many=True, read_only=True)}
     class Meta:
         model = ApprovalWorkflow
         fields = ['id', 'name', 'company', 'steps']
@@ -54,47 +58,145 @@ class ApprovalWorkflowSerializer(serializers.ModelSerializer):
             WorkflowStep.objects.create(workflow=workflow, **step_data)
         return workflow
 
-class ApprovalRuleSerializer(serializers.ModelSerializer):
+class ApprovalRuleSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
+    REQUIRED_FIELDS = {
+        'percentage': 'threshold_percentage',
+        'specific_approver': 'specific_approver',
+        'amount_threshold': 'amount_threshold',
+        'category': 'category',
+    }
+
     class Meta:
         model = ApprovalRule
         fields = '__all__'
         read_only_fields = ['company']
 
+    def validate(self, attrs):
+        rule_type = attrs.get('rule_type', getattr(self.instance, 'rule_type', None))
+        required = self.REQUIRED_FIELDS.get(rule_type)
+        if required and not attrs.get(required, getattr(self.instance, required, None)):
+            raise serializers.ValidationError({required: f"Required for '{rule_type}' rules."})
+        parent = attrs.get('parent')
+        if parent is not None:
+            if parent.rule_type not in ('all', 'any'):
+                raise serializers.ValidationError({'parent': "Conditions can only belong to 'all' or 'any' rules."})
+            if parent.company_id != self.context['request'].user.company_id:
+                raise serializers.ValidationError({'parent': 'Unknown rule.'})
+        return attrs
+
 # ApprovalSerializer is forward-declared for ExpenseSerializer
-class ApprovalSerializer(serializers.ModelSerializer):
+class ApprovalSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     approver = UserSerializer(read_only=True)
-    
+    # Rendered as primary keys unless ?expand= names them
+    collapsed = {'approver': serializers.PrimaryKeyRelatedField(read_only=True)}
+
     class Meta:
         model = Approval
         fields = ['id', 'approver', 'expense', 'sequence', 'status', 'comment', 'updated_at']
 
-class ExpenseSerializer(serializers.ModelSerializer):
+class ExpenseSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     employee = UserSerializer(read_only=True)
     # Use a string here to break the circular dependency
     approvals = ApprovalSerializer(many=True, read_only=True)
+    approval_chain = serializers.SerializerMethodField()
     converted_amount = serializers.SerializerMethodField()
-    
+    collapsed = {
+        'employee': serializers.PrimaryKeyRelatedField(read_only=True),
+        'approvals': serializers.PrimaryKeyRelatedField(many=True, read_only=True),
+    }
+
     class Meta:
         model = Expense
-        fields = ['id', 'employee', 'amount', 'currency', 'converted_amount', 'category', 'description', 'receipt', 'status', 'created_at', 'approvals', 'workflow']
-        read_only_fields = ['employee', 'status', 'approvals', 'converted_amount']
+        fields = ['id', 'employee', 'amount', 'currency', 'converted_amount', 'category', 'description', 'receipt', 'receipt_status', 'receipt_thumbnail', 'status', 'created_at', 'approvals', 'approval_chain', 'workflow']
+        read_only_fields = ['employee', 'status', 'approvals', 'approval_chain', 'converted_amount', 'receipt_status', 'receipt_thumbnail']
+
+    def get_approval_chain(self, obj):
+        # Approvals only exist for the steps reached so far; the rest of the plan comes from the workflow steps
+        approvals = obj.approvals.all()
+        if obj.workflow_id:
+            steps = [(step.sequence, step.approver_id) for step in obj.workflow.steps.all()]
+        else:
+            steps = [(1, obj.employee.manager_id)] if obj.employee.manager_id else []
+        ahead = 'skipped' if obj.status in ('approved', 'rejected') else 'waiting'
+        return [
+            {'sequence': approval.sequence, 'approver': approval.approver_id, 'status': approval.status, 'approval': approval.pk}
+            for approval in approvals
+        ] + [
+            {'sequence': sequence, 'approver': approver_id, 'status': ahead, 'approval': None}
+            for sequence, approver_id in unreached_steps(steps, approvals)
+        ]
 
     def get_converted_amount(self, obj):
         request = self.context.get('request')
         if request and hasattr(request, 'user') and request.user.company:
-            return convert_currency(obj.amount, obj.currency, request.user.company.default_currency)
+            currency = request.user.company.default_currency
+            # One rate snapshot per response, shared by every row through the root context
+            snapshots = self.context.setdefault('rate_snapshots', {})
+            if currency not in snapshots:
+                snapshots[currency] = get_rate_snapshot(currency)
+            return convert_currency(obj.amount, obj.currency, currency, snapshot=snapshots[currency])
         return None
 
 # Now define the ApprovalSerializer fully, including the nested ExpenseSerializer
-class ApprovalSerializer(serializers.ModelSerializer):
+class ApprovalSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     approver = UserSerializer(read_only=True)
-    expense = ExpenseSerializer(read_only=True) 
-    
+    expense = ExpenseSerializer(read_only=True)
+    collapsed = {
+        'approver': serializers.PrimaryKeyRelatedField(read_only=True),
+        'expense': serializers.PrimaryKeyRelatedField(read_only=True),
+    }
+
     class Meta:
         model = Approval
         fields = ['id', 'approver', 'expense', 'sequence', 'status', 'comment', 'updated_at']
 
-class NotificationSerializer(serializers.ModelSerializer):
+# Compact variants used by list endpoints: ids and scalar fields only, no nested graphs
+class ExpenseListSerializer(ExpenseSerializer):
+    employee = serializers.PrimaryKeyRelatedField(read_only=True)
+    approvals = None
+    approval_chain = None
+    collapsed = {}
+
+    class Meta(ExpenseSerializer.Meta):
+        fields = ['id', 'employee', 'amount', 'currency', 'converted_amount', 'category', 'description', 'receipt', 'receipt_status', 'status', 'created_at', 'workflow']
+
+class ApprovalListSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
+    employee_username = serializers.CharField(source='expense.employee.username', read_only=True)
+    expense_description = serializers.CharField(source='expense.description', read_only=True)
+    expense_amount = serializers.DecimalField(source='expense.amount', max_digits=10, decimal_places=2, read_only=True)
+    expense_currency = serializers.CharField(source='expense.currency', read_only=True)
+    expense_status = serializers.CharField(source='expense.status', read_only=True)
+
+    class Meta:
+        model = Approval
+        fields = ['id', 'approver', 'expense', 'sequence', 'status', 'comment', 'updated_at', 'employee_username', 'expense_description', 'expense_amount', 'expense_currency', 'expense_status']
+
+class ApprovalInboxSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
+    # Keyed by the approval, so clients act on /api/approvals/{id}/act/ directly
+    id = serializers.IntegerField(source='approval_id', read_only=True)
+    sequence = serializers.IntegerField(source='approval.sequence', read_only=True)
+    employee_username = serializers.CharField(source='expense.employee.username', read_only=True)
+    expense_description = serializers.CharField(source='expense.description', read_only=True)
+    expense_amount = serializers.DecimalField(source='expense.amount', max_digits=10, decimal_places=2, read_only=True)
+    expense_currency = serializers.CharField(source='expense.currency', read_only=True)
+    expense_status = serializers.CharField(source='expense.status', read_only=True)
+
+    class Meta:
+        model = ApprovalInboxItem
+        fields = ['id', 'expense', 'sequence', 'created_at', 'employee_username', 'expense_description', 'expense_amount', 'expense_currency', 'expense_status']
+
+class BulkApprovalActionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+    decision = serializers.ChoiceField(choices=['approved', 'rejected'])
+    comment = serializers.CharField(required=False, allow_blank=True, default='')
+
+class ReceiptStatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Expense
+        fields = ['id', 'receipt', 'receipt_status', 'receipt_thumbnail', 'receipt_data', 'receipt_error', 'amount', 'description']
+        read_only_fields = fields
+
+class NotificationSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'message', 'is_read', 'created_at']
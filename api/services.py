@@ -1,69 +1,163 @@
 # api/services.py
-from .models import Approval, Notification, Expense, ApprovalRule, User
-import requests
+from collections import defaultdict
+from django.db import router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Approval, ApprovalInboxItem, Notification, Expense, User, WorkflowStep
+from .currency import get_rate_table
+from .jobs import send_notifications
+from .profiling import timed_call
+from .rules import get_rule_set
+from .stats import expense_state, record_expense_changes
 
 def create_approval_workflow(expense: Expense):
-    if expense.workflow:
-        for step in expense.workflow.steps.all():
-            Approval.objects.create(expense=expense, approver=step.approver, sequence=step.sequence)
-            if step.sequence == 1:
-                create_notification(user=step.approver, message=f"New expense from {expense.employee.username} needs your approval.")
-    elif expense.employee.manager:
-        Approval.objects.create(expense=expense, approver=expense.employee.manager, sequence=1)
-        create_notification(user=expense.employee.manager, message=f"New expense from {expense.employee.username} needs your approval.")
+    create_approval_workflows([expense])
+
+def create_approval_workflows(expenses):
+    # Set-based create_approval_workflow: one steps query and one insert per table for any number of expenses.
+    # Only the first sequence of each chain gets Approval rows; process_approval_actions adds the next one when it
+    # becomes active, so steps behind a rejection or an auto-approval are never written.
+    # Each expense needs its employee (with manager_id) loaded.
+    plans = planned_steps(expenses)
+    approvals, notifications = [], []
+    for expense in expenses:
+        message = f"New expense from {expense.employee.username} needs your approval."
+        steps = plans[expense.pk]
+        for sequence, approver_id in steps:
+            if sequence == steps[0][0]:
+                approvals.append(Approval(expense=expense, approver_id=approver_id, sequence=sequence))
+                notifications.append(Notification(user_id=approver_id, message=message))
+    with transaction.atomic(using=router.db_for_write(Approval)):
+        Approval.objects.bulk_create(approvals)
+        ApprovalInboxItem.objects.bulk_create(inbox_items(approvals))
+        send_notifications(notifications)
+
+def inbox_items(approvals):
+    # Newly active approvals (saved, with pks) as rows of their approvers' inboxes
+    return [ApprovalInboxItem(approval=approval, approver_id=approval.approver_id, expense_id=approval.expense_id) for approval in approvals]
+
+def planned_steps(expenses):
+    # {expense id: [(sequence, approver_id), ...]} in sequence order: the expense's workflow steps, or its employee's
+    # manager when it has none. Each expense needs its employee (with manager_id) loaded.
+    workflow_ids = {expense.workflow_id for expense in expenses if expense.workflow_id}
+    steps = defaultdict(list)
+    for step in WorkflowStep.objects.filter(workflow_id__in=workflow_ids).order_by('sequence', 'id'):
+        steps[step.workflow_id].append((step.sequence, step.approver_id))
+    plans = {}
+    for expense in expenses:
+        if expense.workflow_id:
+            plans[expense.pk] = steps[expense.workflow_id]
+        else:
+            plans[expense.pk] = [(1, expense.employee.manager_id)] if expense.employee.manager_id else []
+    return plans
+
+def unreached_steps(steps, approvals):
+    # The planned steps of a chain that have no Approval row yet
+    materialized = {approval.sequence for approval in approvals}
+    return [(sequence, approver_id) for sequence, approver_id in steps if sequence not in materialized]
 
 def evaluate_conditional_rules(expense: Expense, current_approver: User):
-    rules = ApprovalRule.objects.filter(company=expense.company)
-    approvals = expense.approvals.all()
-    for rule in rules:
-        if rule.rule_type == 'specific_approver' and rule.specific_approver == current_approver:
-            return 'approved'
-        if rule.rule_type == 'percentage':
-            approved_count = approvals.filter(status='approved').count()
-            total_approvers = approvals.count()
-            if total_approvers > 0:
-                approval_percentage = (approved_count / total_approvers) * 100
-                if approval_percentage >= rule.threshold_percentage:
-                    return 'approved'
-    return None
+    rule_set = get_rule_set(expense.company_id)
+    tallies = {}
+    if rule_set.needs_tallies:
+        approvals = list(expense.approvals.all())
+        tallies = {
+            'approved_count': sum(1 for approval in approvals if approval.status == 'approved'),
+            'total_count': len(approvals) + len(unreached_steps(planned_steps([expense])[expense.pk], approvals)),
+        }
+    return rule_set.evaluate(expense, current_approver.pk, **tallies)
+
+def lock_approvals(approvals):
+    # Call inside a transaction before deciding on approvals (a queryset): locks the expenses behind them, in id order
+    # so concurrent actions on one expense queue up instead of deadlocking, then re-reads the approvals under lock.
+    # Everything that acts on an expense's approvals takes its row lock first, so the chain read next cannot change.
+    expense_ids = approvals.values('expense_id')
+    list(Expense.objects.select_for_update().filter(pk__in=expense_ids).order_by('pk').values_list('pk', flat=True))
+    return list(approvals.select_for_update(of=('self',)).select_related('approver', 'expense__employee'))
 
 def process_approval_action(approval: Approval, decision: str, comment: str):
-    approval.status = decision
-    approval.comment = comment
-    approval.save()
-    expense = approval.expense
-    create_notification(user=expense.employee, message=f"Your expense '{expense.description}' was {decision} by {approval.approver.username}.")
-    if decision == 'rejected':
-        expense.status = 'rejected'
-        expense.save()
-        return
-    rule_decision = evaluate_conditional_rules(expense, approval.approver)
-    if rule_decision == 'approved':
-        expense.status = 'approved'
-        expense.save()
-        create_notification(user=expense.employee, message=f"Expense auto-approved by conditional rule.")
+    process_approval_actions([approval], decision, comment)
+
+def process_approval_actions(approvals, decision: str, comment: str):
+    # Same outcome as calling process_approval_action on each approval in order, but with one read
+    # and one batched write per table. Each approval needs its approver and expense__employee loaded.
+    if not approvals:
         return
-    next_approval = expense.approvals.filter(sequence=approval.sequence + 1).first()
-    if next_approval:
-        expense.status = 'in_progress'
-        expense.save()
-        create_notification(user=next_approval.approver, message=f"Expense from {expense.employee.username} is ready for your approval.")
-    else:
-        expense.status = 'approved'
-        expense.save()
+    expenses = {}
+    for approval in approvals:
+        approval.expense = expenses.setdefault(approval.expense_id, approval.expense)
+    before = {expense_id: expense_state(expense) for expense_id, expense in expenses.items()}
+    acting = {approval.pk: approval for approval in approvals}
+    chains = defaultdict(list)
+    for other in Approval.objects.filter(expense_id__in=list(expenses)):
+        chains[other.expense_id].append(acting.get(other.pk, other))
+    plans = planned_steps(list(expenses.values()))
+    rule_sets = {company_id: get_rule_set(company_id) for company_id in {expense.company_id for expense in expenses.values()}}
+
+    now, notes, activated = timezone.now(), [], []
+    for approval in approvals:
+        expense, approver = approval.expense, approval.approver.username
+        approval.status, approval.comment, approval.updated_at = decision, comment, now
+        expense.updated_at = now
+        notes.append((expense.employee_id, f"Your expense '{expense.description}' was {decision} by {approver}.",
+                      f"{{count}} of your expenses were {decision} by {approver}."))
+        if decision == 'rejected':
+            expense.status = 'rejected'
+            continue
+        chain = chains[expense.pk]
+        unreached = unreached_steps(plans[expense.pk], chain)
+        approved_count = sum(1 for a in chain if a.status == 'approved')
+        if rule_sets[expense.company_id].evaluate(expense, approval.approver_id, approved_count, len(chain) + len(unreached)) == 'approved':
+            expense.status = 'approved'
+            notes.append((expense.employee_id, "Expense auto-approved by conditional rule.",
+                          "{count} of your expenses were auto-approved by conditional rule."))
+            continue
+        next_sequence = approval.sequence + 1
+        for sequence, approver_id in unreached:
+            if sequence == next_sequence:
+                chain.append(Approval(expense=expense, approver_id=approver_id, sequence=sequence))
+                activated.append(chain[-1])
+        next_approvers = [a.approver_id for a in chain if a.sequence == next_sequence]
+        if next_approvers:
+            expense.status = 'in_progress'
+            notes.extend((approver_id, f"Expense from {expense.employee.username} is ready for your approval.",
+                          "{count} expenses are ready for your approval.") for approver_id in next_approvers)
+        else:
+            expense.status = 'approved'
+
+    with transaction.atomic(using=router.db_for_write(Approval)):
+        Approval.objects.bulk_update(approvals, ['status', 'comment', 'updated_at'])
+        Approval.objects.bulk_create(activated)
+        # Acted approvals leave their inbox, and so does every sibling of an expense that is now decided
+        decided = [expense.pk for expense in expenses.values() if expense.status in ('approved', 'rejected')]
+        ApprovalInboxItem.objects.filter(Q(approval__in=[approval.pk for approval in approvals]) | Q(expense__in=decided)).delete()
+        ApprovalInboxItem.objects.bulk_create(inbox_items(activated))
+        Expense.objects.bulk_update(expenses.values(), ['status', 'updated_at'])
+        send_notifications(coalesce_notifications(notes))
+        record_expense_changes((expense, before[expense.pk], expense_state(expense)) for expense in expenses.values())
+
+def coalesce_notifications(notes):
+    # notes are (user_id, message, summary) tuples; repeated summaries for one user collapse into a single notification
+    groups = {}
+    for user_id, message, summary in notes:
+        groups.setdefault((user_id, summary), []).append(message)
+    return [
+        Notification(user_id=user_id, message=messages[0] if len(messages) == 1 else summary.format(count=len(messages)))
+        for (user_id, summary), messages in groups.items()
+    ]
 
 def create_notification(user, message):
-    Notification.objects.create(user=user, message=message)
+    send_notifications([Notification(user=user, message=message)])
 
 def perform_ocr_on_receipt(image_file):
     return {'amount': 125.50, 'description': 'Mocked from receipt', 'category': 'Meals'}
 
-def convert_currency(amount, from_currency, to_currency):
+@timed_call('external')
+def get_rate_snapshot(base_currency):
+    return get_rate_table().snapshot(base_currency)
+
+@timed_call('external')
+def convert_currency(amount, from_currency, to_currency, snapshot=None):
     if from_currency == to_currency: return amount
-    try:
-        response = requests.get(f"https://api.exchangerate-api.com/v4/latest/{from_currency}")
-        response.raise_for_status()
-        rate = response.json()['rates'].get(to_currency)
-        return round(float(amount) * rate, 2) if rate else None
-    except requests.RequestException:
-        return None
\ No newline at end of file
+    snapshot = snapshot or get_rate_snapshot(to_currency)
+    return snapshot.convert(amount, from_currency, to_currency) if snapshot else None
\ No newline at end of file
@@ -0,0 +1,102 @@
+# api/signals.py
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.db import transaction
+from django.dispatch import receiver
+
+from .authentication import CLAIM_FIELDS, bump_token_versions, forget_token_versions
+from .configcache import bump_config_version
+from .models import ApprovalRule, ApprovalWorkflow, Company, Expense, User, WorkflowStep
+from .orgtree import add_user, check_move, detach_reports, move_subtree
+from .receipts import release_files
+from .rules import invalidate_rules
+from .serializers import UserSerializer
+
+# User fields that appear in /api/users/ responses
+LISTED_USER_FIELDS = frozenset(UserSerializer.Meta.fields) | {'company', 'company_id'}
+
+
+@receiver([post_save, post_delete], sender=ApprovalRule)
+def approval_rules_changed(sender, instance, using=None, **kwargs):
+    # Covers ApprovalRuleViewSet writes, the admin and cascading deletes
+    invalidate_rules(instance.company_id, using)
+    bump_config_version(instance.company_id, using)
+
+
+@receiver([post_save, post_delete], sender=ApprovalWorkflow)
+def workflow_changed(sender, instance, using=None, **kwargs):
+    bump_config_version(instance.company_id, using)
+
+
+@receiver([post_save, post_delete], sender=WorkflowStep)
+def workflow_step_changed(sender, instance, using=None, **kwargs):
+    company_id = ApprovalWorkflow.objects.using(using).filter(pk=instance.workflow_id).values_list('company_id', flat=True).first()
+    bump_config_version(company_id, using)
+
+
+@receiver([post_save, post_delete], sender=User)
+def listed_user_changed(sender, instance, update_fields=None, using=None, **kwargs):
+    # Skips writes that cannot change the user list, like last_login or token_version updates
+    if update_fields is None or not LISTED_USER_FIELDS.isdisjoint(update_fields):
+        bump_config_version(instance.company_id, using)
+
+
+@receiver(post_delete, sender=Expense)
+def expense_deleted(sender, instance, **kwargs):
+    release_files(instance.receipt.storage, [instance.receipt.name, instance.receipt_thumbnail.name])
+
+
+@receiver(pre_save, sender=User)
+def user_changing(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Read the stored row once, so post_save only re-links the org tree and invalidates tokens
+    # when the manager or a field copied into tokens actually changed
+    instance._previous = None
+    written = [name for name in CLAIM_FIELDS
+               if update_fields is None or name in update_fields or name.removesuffix('_id') in update_fields]
+    if raw or instance._state.adding or not written:
+        return
+    previous = instance._previous = User.objects.filter(pk=instance.pk).values('token_version', *written).first()
+    if previous is None:
+        return
+    if 'manager_id' in previous and instance.manager_id != previous['manager_id']:
+        check_move(instance, instance.manager_id)
+    # Never write back an older version than the stored one
+    instance.token_version = previous['token_version']
+    if any(getattr(instance, name) != previous[name] for name in written):
+        instance.token_version += 1
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    if created:
+        add_user(instance)
+        return
+    previous = getattr(instance, '_previous', None)
+    if previous is None:
+        return
+    if 'manager_id' in previous and instance.manager_id != previous['manager_id']:
+        move_subtree(instance, instance.manager_id)
+    if instance.token_version != previous['token_version']:
+        if update_fields is not None and 'token_version' not in update_fields:
+            User.objects.filter(pk=instance.pk).update(token_version=instance.token_version)
+        transaction.on_commit(lambda: forget_token_versions([instance.pk]), using=using)
+
+
+@receiver(pre_save, sender=Company)
+def company_changing(sender, instance, raw=False, **kwargs):
+    instance._previous_currency = None
+    if not raw and not instance._state.adding:
+        instance._previous_currency = Company.objects.filter(pk=instance.pk).values_list('default_currency', flat=True).first()
+
+
+@receiver(post_save, sender=Company)
+def company_saved(sender, instance, created, raw=False, **kwargs):
+    # The currency travels in every member's token
+    if not raw and not created and instance.default_currency != instance._previous_currency:
+        bump_token_versions(User.objects.filter(company=instance))
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    detach_reports(instance)
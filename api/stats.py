@@ -0,0 +1,173 @@
+# api/stats.py
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import DashboardStats, Expense, OrgTreePath
+
+PENDING_STATUSES = ('pending', 'in_progress')
+ZERO = Decimal('0.00')
+
+
+def expense_state(expense):
+    return (expense.status, expense.amount)
+
+
+def contribution(state):
+    if state is None:
+        return (0, 0, ZERO)
+    status, amount = state
+    if status in PENDING_STATUSES:
+        return (1, 0, ZERO)
+    if status == 'approved':
+        return (0, 1, Decimal(str(amount)))
+    return (0, 0, ZERO)
+
+
+def stats_keys(company_id, employee_id, manager_ids):
+    yield (company_id, 'company', None)
+    yield (company_id, 'employee', employee_id)
+    for manager_id in manager_ids:
+        yield (company_id, 'manager', manager_id)
+
+
+def manager_ids_by_employee(employee_ids):
+    """Every manager above each employee, at any depth, from the org tree closure table."""
+    managers = defaultdict(list)
+    paths = OrgTreePath.objects.filter(descendant_id__in=list(employee_ids), depth__gt=0)
+    for employee_id, manager_id in paths.values_list('descendant_id', 'ancestor_id'):
+        managers[employee_id].append(manager_id)
+    return managers
+
+
+def record_expense_changes(changes):
+    """
+    Apply expense changes to the dashboard rollups.
+
+    ``changes`` is an iterable of ``(expense, before, after)`` where ``before`` and ``after`` are
+    ``expense_state`` tuples, or None for a created or deleted expense. Every manager above the
+    expense's employee is updated, looked up with one query for the whole batch.
+    """
+    by_employee = defaultdict(lambda: [0, 0, ZERO])
+    company_ids = set()
+    for expense, before, after in changes:
+        # Any write can move amounts, categories or dates, so cached analytics go stale either way
+        company_ids.add(expense.company_id)
+        new, old = contribution(after), contribution(before)
+        delta = (new[0] - old[0], new[1] - old[1], new[2] - old[2])
+        if not any(delta):
+            continue
+        totals = by_employee[(expense.company_id, expense.employee_id)]
+        totals[0] += delta[0]
+        totals[1] += delta[1]
+        totals[2] += delta[2]
+    if company_ids:
+        transaction.on_commit(lambda: bump_analytics_versions(company_ids), using=router.db_for_write(Expense))
+    if not by_employee:
+        return
+    managers = manager_ids_by_employee(employee_id for _, employee_id in by_employee)
+    deltas = defaultdict(lambda: [0, 0, ZERO])
+    for (company_id, employee_id), delta in by_employee.items():
+        for key in stats_keys(company_id, employee_id, managers[employee_id]):
+            totals = deltas[key]
+            totals[0] += delta[0]
+            totals[1] += delta[1]
+            totals[2] += delta[2]
+    apply_stats_deltas(deltas)
+
+
+def apply_stats_deltas(deltas):
+    """Add ``{(company_id, scope, user_id): (pending, approved, amount)}`` to the stored rollups."""
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+    with transaction.atomic(using=router.db_for_write(DashboardStats)):
+        DashboardStats.objects.bulk_create(
+            [DashboardStats(company_id=company_id, scope=scope, user_id=user_id) for company_id, scope, user_id in deltas],
+            ignore_conflicts=True,
+        )
+        for (company_id, scope, user_id), (pending, approved, amount) in deltas.items():
+            DashboardStats.objects.filter(company_id=company_id, scope=scope, user_id=user_id).update(
+                pending_count=F('pending_count') + pending,
+                approved_count=F('approved_count') + approved,
+                total_approved_amount=F('total_approved_amount') + amount,
+            )
+
+
+def analytics_version_key(company_id):
+    return f'analytics-version:{company_id}'
+
+
+def analytics_version(company_id):
+    return cache.get(analytics_version_key(company_id), 0)
+
+
+def bump_analytics_versions(company_ids):
+    for company_id in company_ids:
+        key = analytics_version_key(company_id)
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def record_expense_created(expenses):
+    record_expense_changes((expense, None, expense_state(expense)) for expense in expenses)
+
+
+def get_dashboard_stats(company_id, scope, user_id=None):
+    row = DashboardStats.objects.filter(company_id=company_id, scope=scope, user_id=user_id).values(
+        'pending_count', 'approved_count', 'total_approved_amount'
+    ).first()
+    return row or {'pending_count': 0, 'approved_count': 0, 'total_approved_amount': ZERO}
+
+
+def compute_dashboard_stats(company_ids=None):
+    """Recompute every rollup from the expense table; returns ``{(company_id, scope, user_id): (pending, approved, amount)}``."""
+    expenses = Expense.objects.all()
+    if company_ids is not None:
+        expenses = expenses.filter(company_id__in=company_ids)
+    rows = list(expenses.values('company_id', 'employee_id').annotate(
+        pending=Count('id', filter=Q(status__in=PENDING_STATUSES)),
+        approved=Count('id', filter=Q(status='approved')),
+        amount=Sum('amount', filter=Q(status='approved')),
+    ))
+    managers = manager_ids_by_employee({row['employee_id'] for row in rows})
+    totals = defaultdict(lambda: [0, 0, ZERO])
+    for row in rows:
+        for key in stats_keys(row['company_id'], row['employee_id'], managers[row['employee_id']]):
+            entry = totals[key]
+            entry[0] += row['pending']
+            entry[1] += row['approved']
+            entry[2] += row['amount'] or ZERO
+    return {key: tuple(value) for key, value in totals.items() if any(value)}
+
+
+def stored_dashboard_stats(company_ids=None):
+    rows = DashboardStats.objects.all()
+    if company_ids is not None:
+        rows = rows.filter(company_id__in=company_ids)
+    return {
+        (row.company_id, row.scope, row.user_id): (row.pending_count, row.approved_count, row.total_approved_amount)
+        for row in rows
+        if row.pending_count or row.approved_count or row.total_approved_amount
+    }
+
+
+def rebuild_dashboard_stats(company_ids=None):
+    expected = compute_dashboard_stats(company_ids)
+    with transaction.atomic(using=router.db_for_write(DashboardStats)):
+        existing = DashboardStats.objects.all()
+        if company_ids is not None:
+            existing = existing.filter(company_id__in=company_ids)
+        existing.delete()
+        DashboardStats.objects.bulk_create(
+            DashboardStats(company_id=company_id, scope=scope, user_id=user_id, pending_count=pending,
+                           approved_count=approved, total_approved_amount=amount)
+            for (company_id, scope, user_id), (pending, approved, amount) in expected.items()
+        )
+    return expected
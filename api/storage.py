@@ -0,0 +1,123 @@
+# api/storage.py
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME = re.compile(r'(?:^|/)([0-9a-f]{64})(?:\.[\w]+)?$')
+
+
+def stored_files():
+    # Looked up lazily: models.py resolves this storage while the model classes are being built
+    return apps.get_model('api', 'StoredFile').objects
+
+
+def content_hash(name):
+    """The sha256 embedded in a content-addressed name, or None for other (legacy) names."""
+    match = HASHED_NAME.search(name)
+    return match.group(1) if match else None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each distinct file once, under a name derived from its sha256.
+
+    ``save`` returns the existing name when the content is already stored and takes one reference
+    on it; ``delete`` releases a reference and only removes the file when none are left. Reference
+    counts live in StoredFile rows so every process sees the same numbers. Names that are not
+    content-addressed (files stored before this backend) are deleted immediately as before.
+    """
+    prefix = 'receipts/sha256'
+
+    def __init__(self, prefix=None, **kwargs):
+        super().__init__(**kwargs)
+        self.prefix = prefix or self.prefix
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        extension = os.path.splitext(name)[1].lower()
+        os.makedirs(self.location, exist_ok=True)
+        # Hash while copying to a temp file next to the destination, so the final move is a rename
+        digest = hashlib.sha256()
+        handle, temp_path = tempfile.mkstemp(dir=self.location, prefix='.upload-')
+        try:
+            with os.fdopen(handle, 'wb') as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+            sha = digest.hexdigest()
+            name = posixpath.join(self.prefix, sha[:2], sha + extension)
+            path = self.path(name)
+            # The reference comes first: it waits for a removal of the same file in progress
+            # (see remove_unreferenced), so the existence check below cannot be overtaken by it
+            self.add_reference(name, os.path.getsize(temp_path))
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return name
+
+    def add_reference(self, name, size):
+        with transaction.atomic():
+            if stored_files().filter(name=name).update(references=F('references') + 1):
+                return
+            try:
+                with transaction.atomic():
+                    stored_files().create(name=name, size=size, references=1)
+            except IntegrityError:
+                # Another upload of the same content created the row first
+                stored_files().filter(name=name).update(references=F('references') + 1)
+
+    def delete(self, name):
+        if not name:
+            return
+        if content_hash(name) is None:
+            # Files stored before this backend are not shared; remove once the caller commits
+            transaction.on_commit(lambda: FileSystemStorage.delete(self, name))
+            return
+        with transaction.atomic():
+            stored = stored_files().select_for_update().filter(name=name).first()
+            if stored is None:
+                return
+            if stored.references > 1:
+                stored_files().filter(pk=stored.pk).update(references=F('references') - 1)
+                return
+            stored.delete()
+            transaction.on_commit(lambda: self.remove_unreferenced(name))
+
+    def remove_unreferenced(self, name):
+        """
+        Delete the file unless the same content was uploaded again since its last reference went
+        away. A placeholder row with no references claims the name while the file is deleted: an
+        upload that inserted the row first (committed or not) makes the insert fail, and one that
+        comes later waits on the row in add_reference until the file is gone, then writes it again.
+        """
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    stored = stored_files().create(name=name, size=0, references=0)
+            except IntegrityError:
+                return
+            FileSystemStorage.delete(self, name)
+            stored.delete()
+
+    def get_available_name(self, name, max_length=None):
+        # Content-addressed names never collide with different content
+        return name
@@ -0,0 +1,92 @@
+# api/streams.py
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .authentication import ClaimsJWTAuthentication
+from .events import get_broker, user_channel
+from .models import Notification
+from .serializers import NotificationSerializer
+
+
+def stream_setting(name):
+    defaults = {'HEARTBEAT_SECONDS': 15, 'MAX_DURATION_SECONDS': 300, 'BATCH_SIZE': 100}
+    return getattr(settings, 'NOTIFICATION_STREAM', {}).get(name, defaults[name])
+
+
+async def authenticate_stream(request):
+    # EventSource cannot send headers, so the access token may also come as ?token=
+    header = request.headers.get('Authorization', '')
+    raw_token = header.split(' ', 1)[1] if header.startswith('Bearer ') else request.GET.get('token')
+    if not raw_token:
+        return None
+    return await sync_to_async(stream_user_id)(raw_token)
+
+
+def stream_user_id(raw_token):
+    # The API's own checks: token version (deactivated users) and simplejwt's revocation
+    authentication = ClaimsJWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token)).pk
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+
+
+def sse(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+
+async def notification_events(user_id, last_id):
+    """
+    Server-sent events for one user: new notifications and the unread count.
+
+    Broker events only wake the stream up; rows are always read from the database past the
+    last delivered id, so a missed wake-up (e.g. a notification written by the job worker in
+    another process) is picked up at the next heartbeat.
+    """
+    notifications = Notification.objects.filter(user_id=user_id)
+    if last_id is None:
+        last_id = await notifications.order_by('-id').values_list('id', flat=True).afirst() or 0
+    deadline = time.monotonic() + stream_setting('MAX_DURATION_SECONDS')
+    unread = None
+    yield 'retry: 3000\n\n'
+    async with get_broker().subscribe(user_channel(user_id)) as subscription:
+        while True:
+            rows = [row async for row in notifications.filter(id__gt=last_id).order_by('id')[:stream_setting('BATCH_SIZE')]]
+            for row in rows:
+                last_id = row.pk
+                yield sse('notification', NotificationSerializer(row).data, event_id=row.pk)
+            count = await notifications.filter(is_read=False).acount()
+            if count != unread:
+                unread = count
+                yield sse('unread', {'count': count}, event_id=last_id)
+            if len(rows) == stream_setting('BATCH_SIZE'):
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if await subscription.get(min(stream_setting('HEARTBEAT_SECONDS'), remaining)) is None:
+                yield ': keep-alive\n\n'
+
+
+async def notification_stream(request):
+    if request.method != 'GET':
+        return HttpResponse(status=405, headers={'Allow': 'GET'})
+    user_id = await authenticate_stream(request)
+    if user_id is None:
+        return HttpResponse('Authentication credentials were not provided or are invalid.', status=401)
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    last_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    response = StreamingHttpResponse(notification_events(user_id, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
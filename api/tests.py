@@ -1,3 +1,1487 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import pstats
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from importlib.util import find_spec
+from io import BytesIO, StringIO
+from pathlib import Path
+from smtplib import SMTPException
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, connection
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import numpy as np
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import claims_user, clear_user_cache, token_claims
+from .configcache import clear_response_cache
+from .currency import FileRateProvider, RateProvider, RateProviderError, RateSnapshot, RateTable
+from .events import InProcessBroker
+from .exports import ExpenseExport
+from .management.commands.loadtest import percentile
+from .jobs import claim_jobs, run_pending, send_email, send_notifications
+from .services import convert_currency, create_notification, get_rate_snapshot, inbox_items
+from .models import Company, User, Expense, Approval, ApprovalInboxItem, Notification, ApprovalWorkflow, WorkflowStep, ApprovalRule, Job, OrgTreePath, StoredFile, receipt_storage
+from .orgtree import rebuild_org_tree
+from .profiling import registry
+from .renderers import FastJSONRenderer
+from .routing import DatabaseRouter, bind_user, pin_key, use_routing
+from .rules import clear_rule_sets, get_rule_set, invalidate_rules
+from .serializers import ApprovalInboxSerializer, ApprovalListSerializer, ExpenseListSerializer, NotificationSerializer
+from .stats import compute_dashboard_stats, record_expense_created, stored_dashboard_stats
+
+OFFLINE_RATES = {'PROVIDER': 'api.currency.FileRateProvider'}
+EAGER_JOBS = {'EAGER': True}
+
+
+@override_settings(EXCHANGE_RATES=OFFLINE_RATES, JOB_QUEUE=EAGER_JOBS)
+class APITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', default_currency='EUR')
+        cls.admin = User.objects.create_user(username='admin', password='pw', role='admin', company=cls.company)
+        cls.manager = User.objects.create_user(username='manager', password='pw', role='manager', company=cls.company, manager=cls.admin)
+        cls.employee = User.objects.create_user(username='employee', password='pw', role='employee', company=cls.company, manager=cls.manager)
+        cls.workflow = ApprovalWorkflow.objects.create(name='Two step', company=cls.company)
+        WorkflowStep.objects.create(workflow=cls.workflow, approver=cls.manager, sequence=1)
+        WorkflowStep.objects.create(workflow=cls.workflow, approver=cls.admin, sequence=2)
+
+    def setUp(self):
+        # Compiled rules and version counters outlive each test's rolled-back transaction
+        cache.clear()
+        clear_rule_sets()
+        clear_user_cache()
+        clear_response_cache()
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def bearer(self, user):
+        response = APIClient().post('/api/token/', {'username': user.username, 'password': 'pw'})
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return client
+
+    def seed_expenses(self, count, employee=None):
+        employee = employee or self.employee
+        currencies = ['USD', 'EUR', 'INR', 'GBP']
+        Expense.objects.bulk_create(
+            Expense(employee=employee, company=self.company, workflow=self.workflow, amount=Decimal('10.00') + i,
+                    currency=currencies[i % len(currencies)], category='Travel', description=f'Expense {i}')
+            for i in range(count)
+        )
+        expenses = list(Expense.objects.filter(employee=employee).select_related('employee').order_by('-id')[:count])
+        record_expense_created(expenses)
+        # The workflow's first step; the second is added once the first is approved
+        approvals = Approval.objects.bulk_create(Approval(expense=expense, approver=self.manager, sequence=1) for expense in expenses)
+        ApprovalInboxItem.objects.bulk_create(inbox_items(approvals))
+        return expenses
+
+
+class QueryBudgetTests(APITestCase):
+    """Listing cost must not grow with the number of rows returned."""
+
+    def count_queries(self, client, url):
+        # Measure the uncached read; configuration endpoints otherwise answer from memory
+        clear_response_cache()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def assertConstantQueries(self, user, url, budget):
+        client = self.client_for(user)
+        self.seed_expenses(5)
+        small = self.count_queries(client, url)
+        self.seed_expenses(200)
+        large = self.count_queries(client, url)
+        self.assertEqual(small, large, f"{url} issued {large} queries for 205 rows but {small} for 5")
+        self.assertLessEqual(large, budget)
+
+    def test_expense_list_as_admin(self):
+        self.assertConstantQueries(self.admin, '/api/expenses/?page_size=200', budget=1)
+
+    def test_expense_list_as_manager(self):
+        self.assertConstantQueries(self.manager, '/api/expenses/?page_size=200', budget=1)
+
+    def test_expense_list_as_employee(self):
+        self.assertConstantQueries(self.employee, '/api/expenses/?page_size=200', budget=1)
+
+    def test_approval_list(self):
+        self.assertConstantQueries(self.manager, '/api/approvals/?page_size=200', budget=1)
+
+    def test_approval_inbox(self):
+        self.assertConstantQueries(self.manager, '/api/approvals/inbox/?page_size=200', budget=1)
+        self.assertEqual(self.count_queries(self.client_for(self.manager), '/api/approvals/inbox/count/'), 1)
+
+    def test_approval_detail(self):
+        client = self.client_for(self.manager)
+        approval = self.seed_expenses(1)[0].approvals.get(sequence=1)
+        # The approval with its expense, the expense's approvals, and the workflow steps for its planned chain
+        self.assertLessEqual(self.count_queries(client, f'/api/approvals/{approval.pk}/'), 3)
+
+    def test_notification_list(self):
+        Notification.objects.bulk_create(Notification(user=self.employee, message=f'n{i}') for i in range(200))
+        self.assertConstantQueries(self.employee, '/api/notifications/?page_size=200', budget=1)
+
+    def test_workflow_list(self):
+        for i in range(50):
+            workflow = ApprovalWorkflow.objects.create(name=f'Flow {i}', company=self.company)
+            WorkflowStep.objects.create(workflow=workflow, approver=self.manager, sequence=1)
+        self.assertConstantQueries(self.admin, '/api/workflows/', budget=2)
+
+    def test_rule_and_user_lists(self):
+        ApprovalRule.objects.bulk_create(
+            ApprovalRule(company=self.company, rule_type='percentage', threshold_percentage=50) for _ in range(50)
+        )
+        self.assertConstantQueries(self.admin, '/api/rules/', budget=1)
+        self.assertConstantQueries(self.admin, '/api/users/', budget=1)
+
+    def test_act_response_reflects_decision(self):
+        expense = self.seed_expenses(1)[0]
+        approval = expense.approvals.get(sequence=1)
+        response = self.client_for(self.manager).post(f'/api/approvals/{approval.pk}/act/', {'decision': 'approved'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'in_progress')
+        self.assertEqual([a['status'] for a in response.data['approvals']], ['approved', 'pending'])
+
+
+class KeysetPaginationTests(APITestCase):
+    def walk(self, client, url):
+        ids, pages = [], 0
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            url, pages = response.data['next'], pages + 1
+        return ids, pages
+
+    def test_walks_every_expense_once_newest_first(self):
+        expenses = self.seed_expenses(23)
+        # Ties on created_at must be broken by id
+        Expense.objects.filter(pk__in=[e.pk for e in expenses[5:15]]).update(created_at=expenses[5].created_at)
+        ids, pages = self.walk(self.client_for(self.admin), '/api/expenses/?page_size=5')
+        expected = list(Expense.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 5)
+
+    def test_previous_link_returns_preceding_page(self):
+        self.seed_expenses(12)
+        client = self.client_for(self.employee)
+        first = client.get('/api/expenses/?page_size=5').data
+        self.assertIsNone(first['previous'])
+        second = client.get(first['next']).data
+        back = client.get(second['previous']).data
+        self.assertEqual([r['id'] for r in back['results']], [r['id'] for r in first['results']])
+
+    def test_list_rows_are_compact(self):
+        self.seed_expenses(1)
+        row = self.client_for(self.employee).get('/api/expenses/').data['results'][0]
+        self.assertEqual(row['employee'], self.employee.pk)
+        self.assertNotIn('approvals', row)
+        approval = self.client_for(self.manager).get('/api/approvals/').data['results'][0]
+        self.assertEqual(approval['employee_username'], 'employee')
+
+    def test_invalid_cursor(self):
+        response = self.client_for(self.admin).get('/api/expenses/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
+class ExpenseImportTests(APITestCase):
+    def csv_file(self, rows):
+        lines = ['amount,currency,category,description,workflow,employee'] + rows
+        return SimpleUploadedFile('feed.csv', '\n'.join(lines).encode(), content_type='text/csv')
+
+    def test_csv_upload_reports_bad_rows_without_aborting(self):
+        upload = self.csv_file([
+            f'12.50,USD,Travel,Taxi,{self.workflow.pk},employee',
+            'abc,USD,Travel,Bad amount,,employee',
+            '8.00,EUR,Meals,Lunch,,',
+            '5.00,USD,Meals,Stranger,,nobody',
+        ])
+        response = self.client_for(self.admin).post('/api/expenses/import/', {'file': upload})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 2))
+        self.assertEqual([error['row'] for error in response.data['errors']], [2, 4])
+        taxi = Expense.objects.get(description='Taxi')
+        self.assertEqual(taxi.employee, self.employee)
+        self.assertEqual(list(taxi.approvals.values_list('approver__username', 'sequence')), [('manager', 1)])
+        self.assertTrue(Notification.objects.filter(user=self.manager, message__contains='employee').exists())
+        # Rows without an employee column belong to the importing user
+        self.assertEqual(Expense.objects.get(description='Lunch').employee, self.admin)
+
+    def test_jsonl_body_is_scoped_to_the_importing_employee(self):
+        body = '\n'.join([
+            '{"amount": "20.00", "category": "Travel", "description": "Train"}',
+            '{"amount": "1.00", "category": "Travel", "description": "Sneaky", "employee": "manager"}',
+            'not json',
+        ])
+        response = self.client_for(self.employee).post('/api/expenses/import/', body, content_type='application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 2))
+        expense = Expense.objects.get(description='Train')
+        self.assertEqual(expense.employee, self.employee)
+        self.assertEqual(list(expense.approvals.values_list('approver__username', flat=True)), ['manager'])
+
+    def test_lines_that_are_not_utf8_are_reported_with_their_line_number(self):
+        content = '\n'.join([
+            'amount,currency,category,description,workflow,employee',
+            '12.50,USD,Travel,Taxi,,employee',
+            '8.00,EUR,Meals,Café,,employee',
+            '"5.00",USD,Meals,"Two',
+            'lines",,employee',
+        ]).encode('latin-1')
+        upload = SimpleUploadedFile('feed.csv', content, content_type='text/csv')
+        response = self.client_for(self.admin).post('/api/expenses/import/', {'file': upload})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 1))
+        error = response.data['errors'][0]
+        self.assertEqual(error['row'], 2)
+        self.assertIn('Line 3 is not valid UTF-8', str(error['errors']))
+
+        body = b'{"amount": "20.00", "category": "Travel", "description": "Train"}\n{"description": "\xff"}\n'
+        response = self.client_for(self.employee).post('/api/expenses/import/', body, content_type='application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+        self.assertIn('Line 2 is not valid UTF-8', str(response.data['errors'][0]['errors']))
+
+    def test_query_count_grows_per_chunk_not_per_row(self):
+        client = self.client_for(self.admin)
+        row = f'10.00,USD,Travel,Fuel,{self.workflow.pk},employee'
+        with CaptureQueriesContext(connection) as small:
+            client.post('/api/expenses/import/', {'file': self.csv_file([row] * 10)})
+        with CaptureQueriesContext(connection) as large:
+            client.post('/api/expenses/import/', {'file': self.csv_file([row] * 900)})
+        # SQLite splits large bulk inserts into parameter-limited batches; PostgreSQL does not
+        if connection.features.max_query_params is None:
+            self.assertEqual(len(small), len(large))
+        self.assertLess(len(large), 900 // 10)
+        self.assertEqual(Expense.objects.filter(description='Fuel').count(), 910)
+        self.assertEqual(Approval.objects.filter(expense__description='Fuel').count(), 910)
+
+
+class ExpenseFilterTests(APITestCase):
+    def ids(self, user=None, **params):
+        response = self.client_for(user or self.admin).get('/api/expenses/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return {row['id'] for row in response.data['results']}
+
+    def test_filters_combine(self):
+        expenses = self.seed_expenses(6)
+        expenses[0].category, expenses[0].description = 'Meals', 'Team lunch with the client'
+        expenses[0].save()
+        Expense.objects.filter(pk=expenses[1].pk).update(status='approved')
+        other = self.seed_expenses(1, employee=self.manager)[0]
+        by_amount = {expense.amount: expense.pk for expense in expenses}
+
+        self.assertEqual(self.ids(status='approved'), {expenses[1].pk})
+        self.assertEqual(self.ids(status='pending,approved'), {expense.pk for expense in expenses} | {other.pk})
+        self.assertEqual(self.ids(category='Meals'), {expenses[0].pk})
+        self.assertEqual(self.ids(currency='usd'), {expense.pk for expense in expenses + [other] if expense.currency == 'USD'})
+        self.assertEqual(self.ids(min_amount='12', max_amount='13.00'), {by_amount[Decimal('12.00')], by_amount[Decimal('13.00')]})
+        self.assertEqual(self.ids(employee=str(self.manager.pk)), {other.pk})
+        self.assertEqual(self.ids(to='2000-01-01'), set())
+        today = timezone.localdate().isoformat()
+        self.assertEqual(len(self.ids(**{'from': today, 'to': today})), 7)
+        # Scoping still applies underneath the filters
+        self.assertEqual(self.ids(self.employee, employee=str(self.manager.pk)), set())
+
+    def test_search_matches_description_and_category(self):
+        expenses = self.seed_expenses(3)
+        expenses[0].description = 'Team lunch with the client'
+        expenses[0].save()
+        self.assertEqual(self.ids(search='LUNCH client'), {expenses[0].pk})
+        self.assertEqual(len(self.ids(search='travel')), 3)
+        self.assertEqual(self.ids(search='lunch dinner'), set())
+
+    def test_invalid_filters_are_rejected(self):
+        client = self.client_for(self.admin)
+        for params in ({'status': 'lost'}, {'from': 'tomorrow'}, {'min_amount': 'ten'}, {'employee': 'me'},
+                       {'min_amount': 'NaN'}, {'max_amount': 'Infinity'}, {'min_amount': 'sNaN'}):
+            response = client.get('/api/expenses/', params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.data)
+            self.assertEqual(client.get('/api/expenses/export/', params).status_code, 400, params)
+
+
+class RowSerializerTests(APITestCase):
+    def test_list_endpoints_render_like_the_model_serializers(self):
+        expenses = self.seed_expenses(6)
+        Expense.objects.filter(pk=expenses[0].pk).update(receipt='receipts/a.png', description='Line\u2028break "quoted"')
+        create_notification(self.manager, 'Hello\u2029there')
+        cases = [
+            (self.admin, '/api/expenses/', ExpenseListSerializer, Expense.objects.order_by('-created_at', '-id')),
+            (self.manager, '/api/approvals/', ApprovalListSerializer, Approval.objects.filter(approver=self.manager).order_by('-id')),
+            (self.manager, '/api/approvals/inbox/', ApprovalInboxSerializer, ApprovalInboxItem.objects.filter(approver=self.manager).order_by('-id')),
+            (self.manager, '/api/notifications/', NotificationSerializer, Notification.objects.filter(user=self.manager).order_by('-created_at', '-id')),
+        ]
+        for user, url, serializer_class, queryset in cases:
+            with self.subTest(url=url):
+                response = self.client_for(user).get(url)
+                self.assertEqual(response.status_code, 200)
+                context = {'request': response.renderer_context['request']}
+                expected = serializer_class(queryset, many=True, context=context).data
+                self.assertEqual(JSONRenderer().render(response.data['results']), JSONRenderer().render(expected))
+                self.assertEqual(response.content, JSONRenderer().render(response.data))
+        self.assertIn('"receipt":"http://testserver/api/media/receipts/a.png"', self.client_for(self.admin).get('/api/expenses/').content.decode())
+
+    def test_fast_renderer_matches_drf_output(self):
+        payloads = [
+            {'when': timezone.now(), 'day': timezone.localdate(), 'amount': Decimal('1.10'), 'text': 'a\u2028b\u2029c"\\\x01é',
+             'values': [1, 2.5, None, True, (1, 2)], 'results': [{'id': 1}]},
+            {1: 'integer keys'},
+            {'big': 2 ** 70},
+            None,
+        ]
+        for data in payloads:
+            with self.subTest(data=data):
+                self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        indented = 'application/json; indent=2'
+        self.assertEqual(FastJSONRenderer().render(payloads[0], indented), JSONRenderer().render(payloads[0], indented))
+
+    @skipUnless(find_spec('orjson'), "orjson is not installed")
+    def test_orjson_path_renders_drf_bytes(self):
+        data = {'when': timezone.now(), 'amount': Decimal('12.30'), 'text': 'line\u2028paragraph\u2029end',
+                'rows': [{'id': 1, 'created_at': timezone.now(), 'converted_amount': Decimal('-0.50')}]}
+        expected = JSONRenderer().render(data)
+        # No fallback to DRF's renderer: the bytes come from orjson
+        with mock.patch.object(JSONRenderer, 'render', side_effect=AssertionError('fell back to DRF')):
+            rendered = FastJSONRenderer().render(data)
+        self.assertEqual(rendered, expected)
+        self.assertIn(b'line\\u2028paragraph\\u2029end', rendered)
+
+    def test_benchmark_checks_both_paths_render_the_same(self):
+        out = StringIO()
+        call_command('benchmark_serializers', '--rows', '20,40', '--repeat', '1', stdout=out)
+        self.assertEqual(out.getvalue().count('x\n'), 4)
+
+
+class FieldsetTests(APITestCase):
+    def get(self, user, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_for(user).get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data, queries
+
+    def test_sparse_detail_skips_relations_and_computed_fields(self):
+        expense = self.seed_expenses(1)[0]
+        with mock.patch('api.serializers.get_rate_snapshot') as snapshot:
+            data, queries = self.get(self.admin, f'/api/expenses/{expense.pk}/?fields=id,amount,status')
+        self.assertEqual(data, {'id': expense.pk, 'amount': '10.00', 'status': 'pending'})
+        snapshot.assert_not_called()
+        self.assertEqual(len(queries), 1)
+
+        approval = expense.approvals.get()
+        data, queries = self.get(self.manager, f'/api/approvals/{approval.pk}/?fields=id,expense.amount,expense.employee&expand=expense')
+        self.assertEqual(data, {'id': approval.pk, 'expense': {'amount': '10.00', 'employee': self.employee.pk}})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('api_user', queries[0]['sql'])
+
+    def test_expand_nests_only_what_is_named(self):
+        expense = self.seed_expenses(1)[0]
+        data, _ = self.get(self.admin, f'/api/expenses/{expense.pk}/?expand=approvals.approver')
+        self.assertEqual(data['employee'], self.employee.pk)
+        self.assertEqual(data['approvals'][0]['approver']['username'], 'manager')
+        self.assertEqual([step['status'] for step in data['approval_chain']], ['pending', 'waiting'])
+
+        data, _ = self.get(self.admin, f'/api/expenses/{expense.pk}/?expand=')
+        self.assertEqual((data['employee'], data['approvals']), (self.employee.pk, [expense.approvals.get().pk]))
+
+        self.seed_expenses(3)
+        data, queries = self.get(self.admin, '/api/expenses/?expand=employee&fields=id,employee')
+        self.assertEqual(data['results'][0]['employee']['username'], 'employee')
+        self.assertEqual(set(data['results'][0]), {'id', 'employee'})
+        self.assertEqual(len(queries), 1)
+
+        data, _ = self.get(self.admin, '/api/workflows/?expand=')
+        self.assertEqual(data[0]['steps'], list(self.workflow.steps.order_by('pk').values_list('pk', flat=True)))
+
+    def test_sparse_lists_read_only_the_chosen_columns(self):
+        self.seed_expenses(3)
+        data, queries = self.get(self.admin, '/api/expenses/?fields=id,status')
+        self.assertEqual([set(row) for row in data['results']], [{'id', 'status'}] * 3)
+        self.assertNotIn('description', queries[0]['sql'])
+        data, _ = self.get(self.manager, '/api/approvals/inbox/?fields=id,expense_amount')
+        self.assertEqual([set(row) for row in data['results']], [{'id', 'expense_amount'}] * 3)
+
+    def test_invalid_fieldsets_are_rejected(self):
+        client = self.client_for(self.admin)
+        for url, error in [
+            ('/api/expenses/?fields=id,nope', 'Unknown field: nope.'),
+            ('/api/expenses/?fields=employee.username', 'employee has no fields to choose; expand it first.'),
+            ('/api/approvals/?expand=expense.workflow', 'Cannot expand: expense.workflow.'),
+            ('/api/notifications/?expand=user', 'Cannot expand: user.'),
+            ('/api/users/?fields=password', 'Unknown field: password.'),
+        ]:
+            with self.subTest(url=url):
+                response = client.get(url)
+                self.assertEqual((response.status_code, response.data), (400, {'error': error}))
+
+
+class ExpenseExportTests(APITestCase):
+    def export(self, user=None, **params):
+        response = self.client_for(user or self.admin).get('/api/expenses/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_streams_rows_with_approvals_and_converted_amounts(self):
+        expenses = self.seed_expenses(5)
+        with mock.patch.object(ExpenseExport, 'chunk_size', 2), CaptureQueriesContext(connection) as queries:
+            rows = list(csv.DictReader(StringIO(self.export().decode())))
+        # One expense query read through a cursor, plus one approvals query per chunk of 2
+        self.assertEqual(len(queries), 1 + 3)
+        self.assertEqual([int(row['id']) for row in rows], sorted(expense.pk for expense in expenses))
+        eur = next(row for row in rows if row['currency'] == 'EUR')
+        self.assertEqual((eur['converted_amount'], eur['converted_currency']), (str(float(eur['amount'])), 'EUR'))
+        self.assertEqual(eur['approvals'], '1:manager:pending')
+        self.assertEqual(eur['employee'], 'employee')
+
+    def test_csv_cells_that_look_like_formulas_are_quoted(self):
+        expense = self.seed_expenses(1)[0]
+        Expense.objects.filter(pk=expense.pk).update(description='=HYPERLINK("http://evil.example","Click")', category='@SUM(A1)')
+        row = next(csv.DictReader(StringIO(self.export().decode())))
+        self.assertEqual(row['description'], '\'=HYPERLINK("http://evil.example","Click")')
+        self.assertEqual(row['category'], "'@SUM(A1)")
+        self.assertEqual(row['employee'], 'employee')
+        self.assertFalse(row['amount'].startswith("'"))
+
+    def test_filters_and_validation(self):
+        expense = self.seed_expenses(3)[0]
+        Expense.objects.filter(pk=expense.pk).update(status='approved')
+        rows = list(csv.DictReader(StringIO(self.export(status='approved', **{'from': timezone.localdate().isoformat()}).decode())))
+        self.assertEqual([int(row['id']) for row in rows], [expense.pk])
+        self.assertEqual(self.export(to='2000-01-01').decode().strip().count('\n'), 0)
+        client = self.client_for(self.admin)
+        self.assertEqual(client.get('/api/expenses/export/', {'output': 'xlsx'}).status_code, 400)
+        self.assertEqual(client.get('/api/expenses/export/', {'from': 'yesterday'}).status_code, 400)
+
+    @skipIf(find_spec('pyarrow'), 'pyarrow is installed')
+    def test_columnar_formats_need_pyarrow(self):
+        response = self.client_for(self.admin).get('/api/expenses/export/', {'output': 'parquet'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pyarrow', response.data['error'])
+
+    @skipUnless(find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_parquet_and_arrow_round_trip(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        expenses = self.seed_expenses(5)
+        with mock.patch.object(ExpenseExport, 'chunk_size', 2):
+            parquet = pq.ParquetFile(pa.BufferReader(self.export(output='parquet')))
+            stream = pa.ipc.open_stream(self.export(output='arrow')).read_all()
+        self.assertEqual(parquet.metadata.num_row_groups, 3)  # one per chunk
+        table = parquet.read()
+        self.assertEqual(table.column('id').to_pylist(), sorted(expense.pk for expense in expenses))
+        self.assertEqual(stream.column('amount').to_pylist(), [Decimal(row) for row in table.column('amount').to_pylist()])
+
+
+class BulkApprovalActionTests(APITestCase):
+    def outcome(self, expenses):
+        expenses = Expense.objects.filter(pk__in=[e.pk for e in expenses]).order_by('id')
+        return [(e.status, [a.status for a in e.approvals.order_by('sequence')]) for e in expenses]
+
+    def act_sequentially(self, user, approvals, decision):
+        client = self.client_for(user)
+        for approval in approvals:
+            client.post(f'/api/approvals/{approval.pk}/act/', {'decision': decision})
+
+    def bulk_act(self, user, approvals, decision):
+        ids = [approval.pk for approval in approvals]
+        return self.client_for(user).post('/api/approvals/bulk-act/', {'ids': ids, 'decision': decision}, format='json')
+
+    def first_steps(self, expenses, sequence=1):
+        return list(Approval.objects.filter(expense__in=expenses, sequence=sequence).order_by('expense_id'))
+
+    def assertMatchesSequential(self, decision, rule=None):
+        if rule:
+            ApprovalRule.objects.create(company=self.company, **rule)
+        sequential, bulk = self.seed_expenses(4), self.seed_expenses(4)
+        self.act_sequentially(self.manager, self.first_steps(sequential), decision)
+        self.bulk_act(self.manager, self.first_steps(bulk), decision)
+        self.assertEqual(self.outcome(sequential), self.outcome(bulk))
+        if decision == 'approved':
+            self.act_sequentially(self.admin, self.first_steps(sequential, 2), decision)
+            self.bulk_act(self.admin, self.first_steps(bulk, 2), decision)
+            self.assertEqual(self.outcome(sequential), self.outcome(bulk))
+
+    def test_approve_matches_sequential_act(self):
+        self.assertMatchesSequential('approved')
+
+    def test_reject_matches_sequential_act(self):
+        self.assertMatchesSequential('rejected')
+
+    def test_percentage_rule_matches_sequential_act(self):
+        self.assertMatchesSequential('approved', rule={'rule_type': 'percentage', 'threshold_percentage': 50})
+
+    def test_specific_approver_rule_matches_sequential_act(self):
+        self.assertMatchesSequential('approved', rule={'rule_type': 'specific_approver', 'specific_approver': self.manager})
+
+    def test_notifications_are_coalesced_per_recipient(self):
+        expenses = self.seed_expenses(3)
+        self.bulk_act(self.manager, self.first_steps(expenses), 'approved')
+        self.assertEqual(list(self.employee.notifications.values_list('message', flat=True)),
+                         ['3 of your expenses were approved by manager.'])
+        self.assertEqual(list(self.admin.notifications.values_list('message', flat=True)),
+                         ['3 expenses are ready for your approval.'])
+
+    def test_reports_unactionable_ids(self):
+        expenses = self.seed_expenses(2)
+        mine = self.first_steps(expenses)
+        self.act_sequentially(self.manager, mine[:1], 'approved')
+        theirs = self.first_steps(expenses, 2)
+        response = self.bulk_act(self.manager, mine + theirs[:1], 'rejected')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['processed'], [mine[1].pk])
+        self.assertEqual([error['id'] for error in response.data['errors']], [mine[0].pk, theirs[0].pk])
+
+    def test_query_count_is_independent_of_batch_size(self):
+        counts = []
+        # The first batch also compiles the company's rules
+        for size in (1, 3, 60):
+            approvals = self.first_steps(self.seed_expenses(size))
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.bulk_act(self.manager, approvals, 'approved').status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[1], counts[2])
+
+    def test_rejects_invalid_payload(self):
+        response = self.client_for(self.manager).post('/api/approvals/bulk-act/', {'ids': [], 'decision': 'maybe'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'ids', 'decision'})
+
+
+class IdempotentApprovalTests(APITestCase):
+    def test_retries_with_the_same_key_replay_the_first_response(self):
+        approval = self.seed_expenses(1)[0].approvals.get(sequence=1)
+        client = self.client_for(self.manager)
+        act = lambda decision: client.post(f'/api/approvals/{approval.pk}/act/', {'decision': decision}, HTTP_IDEMPOTENCY_KEY='retry-1')
+        first = act('approved')
+        self.assertEqual(first.status_code, 200)
+        notifications = Notification.objects.count()
+        with self.assertNumQueries(1):
+            retry = act('approved')
+        self.assertEqual((retry.status_code, retry.data), (200, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Notification.objects.count(), notifications)
+        self.assertEqual(act('rejected').status_code, 422)
+
+    def test_repeated_actions_transition_once(self):
+        expense = self.seed_expenses(1)[0]
+        approval = expense.approvals.get(sequence=1)
+        client = self.client_for(self.manager)
+        self.assertEqual(client.post(f'/api/approvals/{approval.pk}/act/', {'decision': 'approved'}).status_code, 200)
+        self.assertEqual(client.post(f'/api/approvals/{approval.pk}/act/', {'decision': 'approved'}).status_code, 400)
+        response = client.post('/api/approvals/bulk-act/', {'ids': [approval.pk], 'decision': 'approved'}, format='json')
+        self.assertEqual(response.data['processed'], [])
+        self.assertEqual(Notification.objects.filter(user=self.admin).count(), 1)
+        self.assertEqual(stored_dashboard_stats(), compute_dashboard_stats())
+
+
+class ApprovalInboxTests(APITestCase):
+    def inbox(self, user):
+        client = self.client_for(user)
+        results = client.get('/api/approvals/inbox/').data['results']
+        self.assertEqual(client.get('/api/approvals/inbox/count/').data['count'], len(results))
+        return [(item['id'], item['sequence']) for item in results]
+
+    def test_inbox_holds_only_actionable_approvals(self):
+        first, second = self.seed_expenses(2)
+        step1 = {expense.pk: expense.approvals.get().pk for expense in (first, second)}
+        # Newest first
+        self.assertEqual(self.inbox(self.manager), [(step1[second.pk], 1), (step1[first.pk], 1)])
+        self.assertEqual(self.inbox(self.admin), [])
+
+        self.client_for(self.manager).post(f'/api/approvals/{step1[first.pk]}/act/', {'decision': 'approved'})
+        step2 = first.approvals.get(sequence=2).pk
+        self.assertEqual(self.inbox(self.manager), [(step1[second.pk], 1)])
+        self.assertEqual(self.inbox(self.admin), [(step2, 2)])
+
+        self.client_for(self.admin).post(f'/api/approvals/{step2}/act/', {'decision': 'rejected'})
+        self.client_for(self.manager).post('/api/approvals/bulk-act/', {'ids': [step1[second.pk]], 'decision': 'rejected'}, format='json')
+        self.assertEqual(self.inbox(self.manager), [])
+        self.assertEqual(self.inbox(self.admin), [])
+
+    def test_deciding_an_expense_clears_parallel_approvers(self):
+        WorkflowStep.objects.create(workflow=self.workflow, approver=self.admin, sequence=1)
+        response = self.client_for(self.employee).post('/api/expenses/', {
+            'amount': '80.00', 'currency': 'EUR', 'category': 'Travel', 'description': 'Train', 'workflow': self.workflow.pk,
+        })
+        approvals = dict(Approval.objects.filter(expense_id=response.data['id']).values_list('approver_id', 'pk'))
+        self.assertEqual(self.inbox(self.admin), [(approvals[self.admin.pk], 1)])
+        self.client_for(self.manager).post(f'/api/approvals/{approvals[self.manager.pk]}/act/', {'decision': 'rejected'})
+        self.assertEqual(self.inbox(self.admin), [])
+
+    def test_override_clears_the_inbox(self):
+        self.admin.is_staff = True
+        self.admin.save()
+        expense = self.seed_expenses(1)[0]
+        self.assertEqual(len(self.inbox(self.manager)), 1)
+        response = self.client_for(self.admin).post(f'/api/expenses/{expense.pk}/override/', {'decision': 'approved'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.inbox(self.manager), [])
+        self.assertFalse(ApprovalInboxItem.objects.filter(expense=expense).exists())
+
+
+class ApprovalChainTests(APITestCase):
+    def chain(self, expense):
+        data = self.client_for(self.employee).get(f'/api/expenses/{expense.pk}/').data
+        return [(step['sequence'], step['approver'], step['status']) for step in data['approval_chain']]
+
+    def test_steps_are_written_when_they_become_active(self):
+        response = self.client_for(self.employee).post('/api/expenses/', {
+            'amount': '80.00', 'currency': 'EUR', 'category': 'Travel', 'description': 'Train', 'workflow': self.workflow.pk,
+        })
+        expense = Expense.objects.get(pk=response.data['id'])
+        self.assertEqual(list(expense.approvals.values_list('sequence', flat=True)), [1])
+        self.assertEqual(self.chain(expense), [(1, self.manager.pk, 'pending'), (2, self.admin.pk, 'waiting')])
+
+        self.client_for(self.manager).post(f'/api/approvals/{expense.approvals.get().pk}/act/', {'decision': 'approved'})
+        self.assertEqual(self.chain(expense), [(1, self.manager.pk, 'approved'), (2, self.admin.pk, 'pending')])
+        self.assertTrue(Notification.objects.filter(user=self.admin, message__contains='ready for your approval').exists())
+
+    def test_rejection_leaves_later_steps_unwritten(self):
+        expense = self.seed_expenses(1)[0]
+        self.client_for(self.manager).post(f'/api/approvals/{expense.approvals.get().pk}/act/', {'decision': 'rejected'})
+        self.assertEqual(expense.approvals.count(), 1)
+        self.assertEqual(self.chain(expense), [(1, self.manager.pk, 'rejected'), (2, self.admin.pk, 'skipped')])
+
+
+@skipUnless(connection.features.has_select_for_update, "Concurrent writers need row locks (PostgreSQL)")
+@override_settings(EXCHANGE_RATES=OFFLINE_RATES, JOB_QUEUE=EAGER_JOBS)
+class ConcurrentApprovalTests(TransactionTestCase):
+    def test_no_lost_or_duplicate_transitions(self):
+        out = StringIO()
+        call_command('stress_approvals', expenses=40, threads=16, stdout=out)
+        self.assertIn('processed exactly once', out.getvalue())
+
+
+class RuleEngineTests(APITestCase):
+    def approve_first_step(self, **expense_fields):
+        expense = self.seed_expenses(1)[0]
+        Expense.objects.filter(pk=expense.pk).update(**expense_fields)
+        approval = expense.approvals.get(sequence=1)
+        self.client_for(self.manager).post(f'/api/approvals/{approval.pk}/act/', {'decision': 'approved'})
+        return Expense.objects.get(pk=expense.pk).status
+
+    def create_rule(self, **data):
+        response = self.client_for(self.admin).post('/api/rules/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def test_amount_threshold_and_category(self):
+        self.create_rule(rule_type='amount_threshold', amount_threshold='50.00')
+        self.assertEqual(self.approve_first_step(amount=Decimal('20.00')), 'approved')
+        self.assertEqual(self.approve_first_step(amount=Decimal('80.00')), 'in_progress')
+
+    def test_all_and_any_combinations(self):
+        combined = self.create_rule(rule_type='all')
+        self.create_rule(rule_type='category', category='meals', parent=combined)
+        self.create_rule(rule_type='amount_threshold', amount_threshold='100.00', parent=combined)
+        self.assertEqual(self.approve_first_step(category='Meals', amount=Decimal('30.00')), 'approved')
+        self.assertEqual(self.approve_first_step(category='Meals', amount=Decimal('300.00')), 'in_progress')
+        self.assertEqual(self.approve_first_step(category='Travel', amount=Decimal('30.00')), 'in_progress')
+
+    def test_rule_writes_invalidate_the_compiled_rules(self):
+        self.assertEqual(self.approve_first_step(), 'in_progress')
+        with self.captureOnCommitCallbacks() as callbacks:
+            rule = self.create_rule(rule_type='specific_approver', specific_approver=self.manager.pk)
+        # Nothing is invalidated until the write commits
+        self.assertEqual(self.approve_first_step(), 'in_progress')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.approve_first_step(), 'approved')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_for(self.admin).delete(f'/api/rules/{rule}/')
+        self.assertEqual(self.approve_first_step(), 'in_progress')
+
+    def test_rule_type_requires_its_parameter(self):
+        response = self.client_for(self.admin).post('/api/rules/', {'rule_type': 'percentage'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('threshold_percentage', response.data)
+
+    def test_act_query_count_does_not_grow_with_rules(self):
+        def act_queries():
+            approval = self.seed_expenses(1)[0].approvals.get(sequence=1)
+            with CaptureQueriesContext(connection) as queries:
+                self.client_for(self.manager).post(f'/api/approvals/{approval.pk}/act/', {'decision': 'approved'})
+            return len(queries)
+        ApprovalRule.objects.create(company=self.company, rule_type='percentage', threshold_percentage=100)
+        act_queries()  # compile and cache
+        few = act_queries()
+        self.assertEqual(len(get_rule_set(self.company.pk).predicates), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            ApprovalRule.objects.bulk_create(
+                ApprovalRule(company=self.company, rule_type='percentage', threshold_percentage=100) for _ in range(30)
+            )
+            invalidate_rules(self.company.pk)
+        act_queries()
+        self.assertEqual(act_queries(), few)
+        self.assertEqual(len(get_rule_set(self.company.pk).predicates), 31)
+
+
+class DashboardStatsTests(APITestCase):
+    def assertNoDrift(self):
+        normalize = lambda rows: {key: (p, a, Decimal(t).quantize(Decimal('0.01'))) for key, (p, a, t) in rows.items()}
+        self.assertEqual(normalize(stored_dashboard_stats()), normalize(compute_dashboard_stats()))
+
+    def dashboard(self, user):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client_for(user).get('/api/dashboard-stats/').data
+        self.assertLessEqual(len(queries), 1)
+        return data
+
+    def test_rollups_follow_every_status_change(self):
+        employee_client = self.client_for(self.employee)
+        for amount in ('10.00', '20.00', '30.00'):
+            employee_client.post('/api/expenses/', {'amount': amount, 'currency': 'USD', 'category': 'Travel',
+                                                    'description': f'Trip {amount}', 'workflow': self.workflow.pk})
+        self.assertEqual(self.dashboard(self.employee)['pending_count'], 3)
+        first, second, third = Expense.objects.order_by('amount')
+        approvals = {e.pk: e.approvals.get(sequence=1) for e in (first, second, third)}
+
+        manager = self.client_for(self.manager)
+        manager.post(f'/api/approvals/{approvals[first.pk].pk}/act/', {'decision': 'approved'})
+        self.client_for(self.admin).post(f'/api/approvals/{first.approvals.get(sequence=2).pk}/act/', {'decision': 'approved'})
+        manager.post('/api/approvals/bulk-act/', {'ids': [approvals[second.pk].pk], 'decision': 'rejected'}, format='json')
+        employee_client.patch(f'/api/expenses/{first.pk}/', {'amount': '15.00'})
+        self.assertNoDrift()
+
+        self.assertEqual(self.dashboard(self.employee), {'pending_count': 1, 'approved_count': 1, 'total_approved_amount': '15.00'})
+        self.assertEqual(self.dashboard(self.manager), {'pending_count': 1, 'approved_count': 1, 'total_approved_amount': '15.00'})
+        employee_client.delete(f'/api/expenses/{third.pk}/')
+        self.assertEqual(self.dashboard(self.admin)['pending_count'], 0)
+        self.assertNoDrift()
+
+    def test_override_and_import_update_rollups(self):
+        self.admin.is_staff = True
+        self.admin.save()
+        upload = SimpleUploadedFile('feed.csv', b'amount,category,description,employee\n5.00,Meals,Lunch,employee\n', content_type='text/csv')
+        self.client_for(self.admin).post('/api/expenses/import/', {'file': upload})
+        expense = Expense.objects.get(description='Lunch')
+        self.client_for(self.admin).post(f'/api/expenses/{expense.pk}/override/', {'decision': 'approved'})
+        self.assertNoDrift()
+        self.assertEqual(self.dashboard(self.admin)['total_approved_amount'], '5.00')
+
+    def test_rebuild_command_repairs_drift(self):
+        self.seed_expenses(3)
+        Expense.objects.update(status='approved')
+        out = StringIO()
+        with self.assertRaises(SystemExit):
+            call_command('rebuild_dashboard_stats', '--check', stdout=out)
+        call_command('rebuild_dashboard_stats', stdout=out)
+        self.assertNoDrift()
+        self.assertEqual(self.dashboard(self.admin)['approved_count'], 3)
+
+
+class ClaimsAuthenticationTests(APITestCase):
+    def test_requests_are_authenticated_from_claims(self):
+        client = self.bearer(self.employee)
+        client.get('/api/dashboard-stats/')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/dashboard-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1, [q['sql'] for q in queries])
+        response = client.post('/api/expenses/', {'amount': '12.00', 'currency': 'USD', 'category': 'Meals', 'description': 'Lunch'})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Expense.objects.get().employee, self.employee)
+
+    def test_claims_user_loads_other_fields_on_demand(self):
+        user = claims_user(self.employee.pk, token_claims(self.employee))
+        self.assertEqual(user.company.default_currency, 'EUR')
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, self.employee.email)
+
+    def test_changes_apply_to_tokens_issued_before_them(self):
+        self.seed_expenses(2)
+        client = self.bearer(self.manager)
+        self.assertEqual(len(client.get('/api/expenses/').data['results']), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manager.role = 'employee'
+            self.manager.save()
+        self.assertEqual(client.get('/api/expenses/').data['results'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.default_currency = 'USD'
+            self.company.save()
+        self.assertEqual(self.bearer(self.admin).get('/api/analytics/spend/').data['currency'], 'USD')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manager.is_active = False
+            self.manager.save(update_fields=['is_active'])
+        self.assertEqual(client.get('/api/expenses/').status_code, 401)
+        self.assertEqual(User.objects.get(pk=self.manager.pk).token_version, 3)
+
+
+class ConfigCacheTests(APITestCase):
+    def test_steady_state_reads_skip_the_database(self):
+        client = self.client_for(self.admin)
+        first = client.get('/api/workflows/')
+        with self.assertNumQueries(0):
+            second = client.get('/api/workflows/')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get('/api/workflows/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+            self.assertEqual(client.get('/api/rules/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+    def test_writes_change_the_version(self):
+        client = self.client_for(self.admin)
+        before = client.get('/api/workflows/')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/workflows/', {'name': 'One step', 'steps': [{'approver': self.manager.pk, 'sequence': 1}]}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        after = client.get('/api/workflows/', HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(len(after.data), len(before.data) + 1)
+
+        users = client.get('/api/users/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.employee.first_name = 'Erin'
+            self.employee.save()
+        self.assertIn('Erin', [user['first_name'] for user in client.get('/api/users/').data])
+        etag = client.get('/api/users/')['ETag']
+        self.assertNotEqual(etag, users['ETag'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.employee.save(update_fields=['last_login'])
+        self.assertEqual(client.get('/api/users/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_companies_do_not_share_cached_responses(self):
+        other = Company.objects.create(name='Other', default_currency='USD')
+        outsider = User.objects.create_user(username='outsider', password='pw', role='admin', company=other)
+        self.client_for(self.admin).get('/api/users/')
+        self.assertEqual([user['username'] for user in self.client_for(outsider).get('/api/users/').data], ['outsider'])
+
+
+@skipUnless('replica' in settings.DATABASES, "Needs the 'replica' alias of backend.test_settings")
+@override_settings(DATABASE_ROUTING={'REPLICAS': {'default': ['replica']}})
+class DatabaseRoutingTests(APITestCase):
+    # 'replica' is a second database (backend.test_settings), filled by hand where a real one would stream from the primary
+    databases = {'default', 'replica'}
+
+    def replicate(self):
+        for model in (Company, User, OrgTreePath, ApprovalWorkflow, Expense):
+            model.objects.using('replica').bulk_create(model.objects.using('default').order_by('pk'))
+
+    def test_router_picks_the_company_shard_and_its_replicas(self):
+        router = DatabaseRouter()
+        self.assertIsNone(router.db_for_read(Expense))
+        with override_settings(DATABASE_ROUTING={'REPLICAS': {'shard2': ['shard2-replica']}, 'COMPANY_SHARDS': {self.company.pk: 'shard2'}}):
+            with use_routing(read_only=True):
+                bind_user(self.employee.pk, self.company.pk)
+                self.assertEqual(router.db_for_read(Expense), 'shard2-replica')
+                self.assertIsNone(router.db_for_read(StoredFile))
+                self.assertEqual(router.db_for_write(Expense), 'shard2')
+                self.assertEqual(router.db_for_read(Expense), 'shard2')
+            with use_routing(read_only=True):
+                bind_user(self.employee.pk, self.company.pk + 1)
+                self.assertEqual(router.db_for_read(Expense), 'default')
+            shard2, replica, primary = Expense(), Expense(), Expense()
+            shard2._state.db, replica._state.db, primary._state.db = 'shard2', 'shard2-replica', 'default'
+            self.assertTrue(router.allow_relation(shard2, replica))
+            self.assertFalse(router.allow_relation(primary, replica))
+
+    def test_reads_go_to_the_replica_until_the_user_writes(self):
+        self.seed_expenses(2)
+        self.replicate()
+        Expense.objects.update(description='Not replicated yet')
+        client = self.bearer(self.employee)
+        descriptions = lambda: {row['description'] for row in client.get('/api/expenses/').data['results']}
+        self.assertEqual(descriptions(), {'Expense 0', 'Expense 1'})
+        self.assertNotIn(b'Not replicated yet', b''.join(client.get('/api/expenses/export/').streaming_content))
+
+        response = client.post('/api/expenses/', {'amount': '12.00', 'currency': 'USD', 'category': 'Meals', 'description': 'Lunch'})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(descriptions(), {'Not replicated yet', 'Lunch'})
+        cache.delete(pin_key(self.employee.pk))
+        self.assertEqual(descriptions(), {'Expense 0', 'Expense 1'})
+
+    def test_companies_pinned_to_a_shard_are_served_from_it(self):
+        # Ids stay unique across shards, as per-shard sequence ranges would keep them
+        with use_routing(shard='replica'):
+            other = Company.objects.create(pk=1000, name='Sharded', default_currency='USD')
+            sharded = User.objects.create_user(pk=1000, username='sharded', password='pw', role='admin', company=other)
+        self.assertFalse(User.objects.filter(username='sharded').exists())
+        with override_settings(DATABASE_ROUTING={'COMPANY_SHARDS': {other.pk: 'replica'}}):
+            client = self.bearer(sharded)
+            self.assertEqual([user['username'] for user in client.get('/api/users/').data], ['sharded'])
+            self.assertEqual([user['username'] for user in self.bearer(self.admin).get('/api/users/').data],
+                             ['admin', 'manager', 'employee'])
+
+
+class OrgTreeTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.director = User.objects.create_user(username='director', password='pw', role='manager', company=self.company, manager=self.admin)
+        self.manager.manager = self.director
+        self.manager.save()
+
+    def paths(self):
+        return set(OrgTreePath.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def assertConsistent(self):
+        stored = self.paths()
+        rebuild_org_tree()
+        self.assertEqual(stored, self.paths())
+        normalize = lambda rows: {key: (p, a, Decimal(t).quantize(Decimal('0.01'))) for key, (p, a, t) in rows.items()}
+        self.assertEqual(normalize(stored_dashboard_stats()), normalize(compute_dashboard_stats()))
+
+    def test_director_sees_expenses_of_the_whole_subtree(self):
+        self.seed_expenses(3)
+        response = self.client_for(self.director).get('/api/expenses/')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(self.client_for(self.director).get('/api/dashboard-stats/').data['pending_count'], 3)
+        self.assertEqual(self.client_for(self.director).get('/api/analytics/spend/').data['summary']['count'], 3)
+        self.assertIn((self.admin.pk, self.employee.pk, 3), self.paths())
+        self.assertConsistent()
+
+    def test_moving_a_manager_moves_its_subtree_and_rollups(self):
+        self.seed_expenses(4)
+        Expense.objects.filter(pk__in=Expense.objects.order_by('id').values('pk')[:2]).update(status='approved')
+        call_command('rebuild_dashboard_stats', stdout=StringIO())
+        peer = User.objects.create_user(username='peer', password='pw', role='manager', company=self.company, manager=self.admin)
+        self.manager.manager = peer
+        self.manager.save()
+        self.assertEqual(self.client_for(self.director).get('/api/expenses/').data['results'], [])
+        self.assertEqual(len(self.client_for(peer).get('/api/expenses/').data['results']), 4)
+        self.assertConsistent()
+        self.manager.manager = None
+        self.manager.save(update_fields=['manager'])
+        self.assertConsistent()
+
+    def test_cycles_are_rejected(self):
+        self.director.manager = self.employee
+        with self.assertRaises(ValidationError) as caught:
+            self.director.full_clean()
+        self.assertIn('manager', caught.exception.message_dict)
+        with self.assertRaises(IntegrityError):
+            self.director.save()
+        self.assertConsistent()
+
+    def test_admin_form_reports_cycles(self):
+        self.admin.is_staff = self.admin.is_superuser = True
+        self.admin.save()
+        self.client.force_login(self.admin)
+        url = f'/admin/api/user/{self.director.pk}/change/'
+        form = self.client.get(url).context['adminform'].form
+        data = {name: value for name, value in form.initial.items() if value is not None and name not in ('groups', 'user_permissions')}
+        data.update(manager=self.employee.pk, last_login_0='', last_login_1='', date_joined_0='2024-01-01', date_joined_1='00:00:00')
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('manager', response.context['adminform'].form.errors)
+        self.assertConsistent()
+
+    def test_deleting_a_manager_detaches_its_reports(self):
+        self.seed_expenses(2)
+        self.manager.delete()
+        self.assertEqual(self.client_for(self.director).get('/api/dashboard-stats/').data['pending_count'], 0)
+        self.assertConsistent()
+
+
+class SpendAnalyticsTests(APITestCase):
+    def analytics(self, user=None, **params):
+        response = self.client_for(user or self.admin).get('/api/analytics/spend/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_groups_convert_to_company_currency_in_one_pass(self):
+        other = User.objects.create_user(username='other', password='pw', role='employee', company=self.company, manager=self.admin)
+        self.seed_expenses(8)
+        self.seed_expenses(2, employee=other)
+        expenses = list(Expense.objects.filter(company=self.company))
+        snapshot = get_rate_snapshot('EUR')
+        expected = sorted(float(convert_currency(e.amount, e.currency, 'EUR', snapshot=snapshot)) for e in expenses)
+
+        data = self.analytics(group_by='employee,manager')
+        self.assertEqual(data['currency'], 'EUR')
+        self.assertEqual(data['summary']['count'], 10)
+        self.assertAlmostEqual(data['summary']['total'], sum(expected), places=2)
+        self.assertEqual(data['summary']['p50'], round(float(np.percentile(expected, 50)), 2))
+        by_employee = {group['employee']: group for group in data['groups']}
+        self.assertEqual((by_employee['employee']['count'], by_employee['employee']['manager_id']), (8, self.manager.pk))
+        self.assertEqual((by_employee['other']['count'], by_employee['other']['manager_id']), (2, self.admin.pk))
+        self.assertEqual(data['trend'][0]['month'], timezone.now().strftime('%Y-%m'))
+        self.assertIsNone(data['trend'][0]['change_pct'])
+
+        # Managers only see their team
+        self.assertEqual(self.analytics(self.manager)['summary']['count'], 8)
+
+    def test_results_are_cached_until_an_expense_changes(self):
+        self.seed_expenses(3)
+        first = self.analytics()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.analytics(), first)
+        expense = Expense.objects.filter(currency='EUR').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.employee).patch(f'/api/expenses/{expense.pk}/', {'amount': '1000.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(self.analytics()['summary']['total'], first['summary']['total'] + 1000 - float(expense.amount), places=2)
+
+    def test_filters_and_validation(self):
+        self.seed_expenses(3)
+        self.assertEqual(self.analytics(**{'to': '2000-01-01'})['summary']['count'], 0)
+        self.assertEqual(self.analytics(status='approved')['groups'], [])
+        client = self.client_for(self.admin)
+        self.assertEqual(client.get('/api/analytics/spend/', {'group_by': 'weekday'}).status_code, 400)
+        self.assertEqual(client.get('/api/analytics/spend/', {'from': 'soon'}).status_code, 400)
+
+
+@override_settings(JOB_QUEUE={'EAGER': False, 'BACKOFF_SECONDS': 10})
+class JobQueueTests(APITestCase):
+    def test_user_creation_queues_email_and_worker_delivers_it(self):
+        response = self.client_for(self.admin).post('/api/users/', {
+            'username': 'newbie', 'password': 'pw', 'email': 'newbie@example.com', 'role': 'employee'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Job.objects.get().kind, 'send_email')
+        call_command('run_jobs', '--once', stdout=StringIO())
+        self.assertEqual(mail.outbox[0].to, ['newbie@example.com'])
+        self.assertEqual(Job.objects.get().status, 'done')
+
+    def test_notifications_are_inserted_by_the_worker_in_one_batch(self):
+        approvals = Approval.objects.filter(expense__in=self.seed_expenses(3), sequence=1)
+        self.client_for(self.manager).post('/api/approvals/bulk-act/', {'ids': [a.pk for a in approvals], 'decision': 'approved'}, format='json')
+        for i in range(20):
+            create_notification(self.employee, f'event {i}')
+        self.assertFalse(Notification.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(run_pending(), 21)
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "api_notification"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Notification.objects.count(), 22)
+
+    def test_failures_retry_with_backoff_and_isolate_bad_jobs(self):
+        send_notifications([Notification(user_id=self.employee.pk, message='ok')])
+        send_notifications([Notification(user_id=10 ** 9, message='orphan')])
+        with mock.patch('api.jobs.Notification.objects.bulk_create', side_effect=[DatabaseError('batch'), [], DatabaseError('bad user')]), \
+                self.assertLogs('api.jobs', 'ERROR'):
+            run_pending()
+        good, bad = Job.objects.order_by('id')
+        self.assertEqual(good.status, 'done')
+        self.assertEqual((bad.status, bad.attempts), ('queued', 1))
+        self.assertGreater(bad.run_at, timezone.now() + timedelta(seconds=5))
+        self.assertEqual(run_pending(), 0)
+
+
+    @override_settings(JOB_QUEUE={'MAX_ATTEMPTS': 2, 'RUNNING_TIMEOUT': 60})
+    def test_jobs_that_crash_their_worker_run_out_of_attempts(self):
+        send_notifications([Notification(user_id=self.employee.pk, message='boom')])
+        job = Job.objects.get()
+
+        def worker_dies():
+            # Claimed, then left running past RUNNING_TIMEOUT
+            Job.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+            job.refresh_from_db()
+        self.assertEqual(claim_jobs(10), [job])
+        worker_dies()
+        # Reclaimed as a failed attempt and claimed again
+        self.assertEqual(claim_jobs(10), [job])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('running', 1))
+        self.assertIn('worker stopped', job.last_error)
+        worker_dies()
+        self.assertEqual(claim_jobs(10), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_email_failures_never_resend_delivered_mail(self):
+        for address in ('a@example.com', 'bad@example.com', 'c@example.com'):
+            send_email('Hello', 'Body', 'noreply@example.com', [address])
+        send = LocmemEmailBackend.send_messages
+
+        def flaky(backend, messages):
+            if messages[0].to == ['bad@example.com']:
+                raise SMTPException('rejected')
+            return send(backend, messages)
+        with mock.patch.object(LocmemEmailBackend, 'send_messages', flaky), self.assertLogs('api.jobs', 'ERROR'):
+            self.assertEqual(run_pending(), 3)
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com'], ['c@example.com']])
+        self.assertEqual([(job.status, job.attempts) for job in Job.objects.order_by('id')], [('done', 0), ('queued', 1), ('done', 0)])
+        self.assertIn('SMTPException', Job.objects.get(status='queued').last_error)
+
+
+@override_settings(NOTIFICATION_STREAM={'HEARTBEAT_SECONDS': 0.05, 'MAX_DURATION_SECONDS': 0.2, 'BATCH_SIZE': 2})
+class NotificationStreamTests(APITestCase):
+    async def read_stream(self, user, **params):
+        token = str(AccessToken.for_user(user))
+        response = await AsyncClient().get('/api/notifications/stream/', {'token': token, **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return ''.join([chunk.decode() async for chunk in response.streaming_content])
+
+    async def test_streams_backlog_after_last_event_id_and_unread_count(self):
+        first = await Notification.objects.acreate(user=self.employee, message='first')
+        await Notification.objects.acreate(user=self.employee, message='second')
+        await Notification.objects.acreate(user=self.employee, message='third', is_read=True)
+        await Notification.objects.acreate(user=self.manager, message='not yours')
+        body = await self.read_stream(self.employee, last_event_id=first.pk)
+        self.assertNotIn('"first"', body)
+        self.assertIn('"second"', body)
+        self.assertIn('"third"', body)
+        self.assertNotIn('not yours', body)
+        self.assertIn('event: unread\nid: ', body)
+        self.assertIn('data: {"count":2}', body)
+        self.assertIn(': keep-alive', body)
+
+    async def test_new_connection_starts_from_latest_notification(self):
+        await Notification.objects.acreate(user=self.employee, message='old news')
+        body = await self.read_stream(self.employee)
+        self.assertNotIn('old news', body)
+        self.assertIn('data: {"count":1}', body)
+
+    async def test_rejects_missing_or_invalid_token(self):
+        response = await AsyncClient().get('/api/notifications/stream/', {'token': 'nope'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_rejects_tokens_of_deactivated_users(self):
+        token = str(AccessToken.for_user(self.manager))
+        await self.read_stream(self.manager)
+
+        def deactivate():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.manager.is_active = False
+                self.manager.save(update_fields=['is_active'])
+        await sync_to_async(deactivate)()
+        response = await AsyncClient().get('/api/notifications/stream/', {'token': token})
+        self.assertEqual(response.status_code, 401)
+
+
+def image_upload(size=(40, 60), name='receipt.png', image_format='PNG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'white').save(buffer, format=image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{image_format.lower()}')
+
+
+class ReceiptPipelineTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.expense = self.seed_expenses(1)[0]
+
+    def upload(self, upload):
+        return self.client_for(self.employee).post(f'/api/expenses/{self.expense.pk}/upload-receipt/', {'receipt': upload}, format='multipart')
+
+    @override_settings(JOB_QUEUE={'EAGER': False})
+    def test_upload_returns_202_and_worker_writes_results_back(self):
+        response = self.upload(image_upload())
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['receipt']['receipt_status'], 'processing')
+        self.assertEqual(Job.objects.get().kind, 'process_receipt')
+        with CaptureQueriesContext(connection) as queries:
+            run_pending()
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "api_expense"')]
+        self.assertEqual(len(updates), 1)
+
+        data = self.client_for(self.employee).get(response.data['status_url']).data
+        self.assertEqual(data['receipt_status'], 'processed')
+        self.assertEqual((data['amount'], data['description']), ('125.50', 'Mocked from receipt'))
+        self.assertEqual(data['receipt_data']['category'], 'Meals')
+        self.expense.refresh_from_db()
+        with Image.open(self.expense.receipt_thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.format, 'JPEG')
+        normalize = lambda rows: {key: (p, a, Decimal(t).quantize(Decimal('0.01'))) for key, (p, a, t) in rows.items()}
+        self.assertEqual(normalize(stored_dashboard_stats()), normalize(compute_dashboard_stats()))
+
+    @override_settings(RECEIPTS={'MAX_DIMENSION': 100, 'THUMBNAIL_SIZE': 16})
+    def test_large_images_are_downscaled_and_thumbnailed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.upload(image_upload(size=(400, 200), name='big.jpg', image_format='JPEG')).status_code, 202)
+        self.expense.refresh_from_db()
+        with Image.open(self.expense.receipt.path) as receipt, Image.open(self.expense.receipt_thumbnail.path) as thumbnail:
+            self.assertEqual(receipt.size, (100, 50))
+            self.assertEqual(thumbnail.size, (16, 8))
+        # The original upload was replaced by the downscaled copy
+        self.assertEqual(set(StoredFile.objects.values_list('name', flat=True)), {self.expense.receipt.name, self.expense.receipt_thumbnail.name})
+        self.assertEqual(stored_paths(), {self.expense.receipt.path, self.expense.receipt_thumbnail.path})
+
+    @override_settings(RECEIPTS={'OCR_BACKEND': 'api.tests.fake_ocr'})
+    def test_ocr_backend_is_pluggable_and_bad_images_fail_cleanly(self):
+        self.upload(image_upload())
+        self.expense.refresh_from_db()
+        self.assertEqual((self.expense.amount, self.expense.receipt_data), (Decimal('9.99'), {'amount': '9.99'}))
+
+        self.upload(SimpleUploadedFile('receipt.png', b'not an image', content_type='image/png'))
+        data = self.client_for(self.employee).get(f'/api/expenses/{self.expense.pk}/receipt/').data
+        self.assertEqual(data['receipt_status'], 'failed')
+        self.assertTrue(data['receipt_error'])
+
+
+def fake_ocr(image_file):
+    return {'amount': '9.99'}
+
+
+def stored_paths():
+    return {os.path.join(root, name) for root, _, names in os.walk(settings.MEDIA_ROOT) for name in names}
+
+
+@override_settings(JOB_QUEUE={'EAGER': False})
+class ReceiptStorageTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.expenses = self.seed_expenses(2)
+        self.image = image_upload(size=(64, 64)).read()
+
+    def upload(self, expense, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.employee).post(
+                f'/api/expenses/{expense.pk}/upload-receipt/', {'receipt': SimpleUploadedFile('r.png', content)}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        expense.refresh_from_db()
+        return expense.receipt.name
+
+    def test_identical_uploads_share_one_file_until_the_last_reference_goes(self):
+        first, second = (self.upload(expense, self.image) for expense in self.expenses)
+        self.assertEqual(first, second)
+        self.assertIn(hashlib.sha256(self.image).hexdigest(), first)
+        self.assertEqual(StoredFile.objects.get(name=first).references, 2)
+        self.assertEqual(len(stored_paths()), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_for(self.employee).delete(f'/api/expenses/{self.expenses[0].pk}/')
+        self.assertEqual(StoredFile.objects.get(name=first).references, 1)
+        self.assertEqual(len(stored_paths()), 1)
+
+        # Replacing the last reference removes the file
+        self.upload(self.expenses[1], image_upload(size=(8, 8)).read())
+        self.assertFalse(StoredFile.objects.filter(name=first).exists())
+        self.assertEqual(len(stored_paths()), 1)
+
+    def test_removal_racing_a_new_upload_keeps_the_file(self):
+        name = self.upload(self.expenses[0], self.image)
+        storage = receipt_storage()
+        # The last reference went away; its removal runs while the same content is uploaded again
+        StoredFile.objects.filter(name=name).delete()
+        add_reference = storage.add_reference
+
+        def removed_first(*args):
+            storage.remove_unreferenced(name)
+            add_reference(*args)
+        with mock.patch.object(storage, 'add_reference', removed_first):
+            self.assertEqual(storage.save('again.png', SimpleUploadedFile('again.png', self.image)), name)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+
+        # A removal after the new reference leaves the file alone
+        storage.remove_unreferenced(name)
+        self.assertTrue(storage.exists(name))
+
+    def test_serves_strong_etags_and_byte_ranges(self):
+        name = self.upload(self.expenses[0], self.image)
+        url, size = f'/api/media/{name}', len(self.image)
+        client = self.bearer(self.manager)
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.image)
+        etag = response['ETag']
+        self.assertEqual(etag, f'"{hashlib.sha256(self.image).hexdigest()}"')
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        partial = client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual((partial.status_code, partial['Content-Range']), (206, f'bytes 10-19/{size}'))
+        self.assertEqual(b''.join(partial.streaming_content), self.image[10:20])
+        suffix = client.get(url, HTTP_RANGE='bytes=-5', HTTP_IF_RANGE=etag)
+        self.assertEqual(b''.join(suffix.streaming_content), self.image[-5:])
+        self.assertEqual(client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"').status_code, 200)
+        self.assertEqual(client.get(url, HTTP_RANGE=f'bytes={size}-').status_code, 416)
+        self.assertEqual(client.get('/api/media/../settings.py').status_code, 404)
+
+        with override_settings(RECEIPT_DOWNLOADS={'SENDFILE': 'x-accel-redirect', 'INTERNAL_PREFIX': '/internal/'}):
+            offloaded = client.get(url)
+        self.assertEqual((offloaded['X-Accel-Redirect'], offloaded.content), (f'/internal/{name}', b''))
+
+    def test_receipts_are_only_served_to_the_owning_company(self):
+        name = self.upload(self.expenses[0], self.image)
+        thumbnail = receipt_storage().save('receipts/thumbnails/t.jpg', SimpleUploadedFile('t.jpg', self.image))
+        Expense.objects.filter(pk=self.expenses[0].pk).update(receipt_thumbnail=thumbnail)
+        other = Company.objects.create(name='Other', default_currency='USD')
+        outsider = User.objects.create_user(username='outsider', password='pw', role='admin', company=other)
+
+        anonymous = APIClient()
+        self.assertEqual(anonymous.get(f'/api/media/{name}').status_code, 401)
+        invalid = APIClient()
+        invalid.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertEqual(invalid.get(f'/api/media/{name}').status_code, 401)
+        for path in (name, thumbnail):
+            self.assertEqual(self.bearer(outsider).get(f'/api/media/{path}').status_code, 404)
+            self.assertEqual(self.bearer(self.employee).get(f'/api/media/{path}').status_code, 200)
+        self.assertIn('private', self.bearer(self.employee).get(f'/api/media/{name}')['Cache-Control'])
+
+        # A file no expense references is not served, even to a signed-in user
+        receipt_storage().save('receipts/orphan.png', SimpleUploadedFile('orphan.png', self.image))
+        self.assertEqual(self.bearer(self.admin).get('/api/media/receipts/orphan.png').status_code, 404)
+
+
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+
+    @override_settings(PROFILING={'SAMPLE_RATE': 1, 'METRICS_IPS': ('127.0.0.1',)})
+    def test_sampled_request_reports_server_timing_and_metrics(self):
+        self.seed_expenses(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_for(self.admin).get('/api/expenses/')
+        timing = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'total', 'db', 'serialize', 'external'})
+        self.assertIn(f'desc="{len(queries)} queries"', timing['db'])
+
+        metrics = self.client.get('/api/metrics/')
+        self.assertEqual(metrics.status_code, 200)
+        text = metrics.content.decode()
+        self.assertIn('api_requests_total{view="ExpenseViewSet.list",method="GET",status="200"} 1', text)
+        self.assertIn(f'api_request_db_queries_bucket{{view="ExpenseViewSet.list",method="GET",le="+Inf"}} 1', text)
+        self.assertIn('api_request_serialize_seconds_count{view="ExpenseViewSet.list",method="GET"} 1', text)
+
+    @override_settings(PROFILING={'SAMPLE_RATE': 0, 'METRICS_TOKEN': 'scrape'})
+    def test_unsampled_requests_only_time_latency_and_metrics_need_token(self):
+        response = self.client_for(self.manager).get('/api/approvals/')
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+$')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        text = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer scrape').content.decode()
+        self.assertIn('api_request_duration_seconds_count{view="ApprovalViewSet.list",method="GET"} 1', text)
+        self.assertNotIn('api_request_db_seconds_count{view="ApprovalViewSet.list"', text)
+
+    def test_metrics_are_closed_without_a_token_or_allowlist(self):
+        # The test client's REMOTE_ADDR is 127.0.0.1, as every request is behind a local proxy
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    def test_slow_requests_save_a_profile(self):
+        directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        with override_settings(PROFILING={'PROFILE_RATE': 1, 'PROFILE_SLOW_MS': 0, 'PROFILE_DIR': directory}):
+            self.client_for(self.admin).get('/api/expenses/')
+        with override_settings(PROFILING={'PROFILE_RATE': 1, 'PROFILE_SLOW_MS': 60000, 'PROFILE_DIR': directory}):
+            self.client_for(self.admin).get('/api/expenses/')
+        profiles = list(directory.glob('*-ExpenseViewSet.list-*.prof'))
+        self.assertEqual(len(profiles), 1)
+        functions = {function for _, _, function in pstats.Stats(str(profiles[0])).stats}
+        self.assertIn('list', functions)
+
+
+class LoadToolingTests(APITestCase):
+    def test_seed_data_builds_manager_trees_and_manifest(self):
+        manifest = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'seed.json'
+        call_command('seed_data', '--companies', '2', '--users', '30', '--fanout', '3', '--expenses', '2',
+                     '--manifest', str(manifest), stdout=StringIO())
+        data = json.loads(manifest.read_text())
+        self.assertEqual(len(data['companies']), 2)
+        for seeded in data['companies']:
+            company = Company.objects.get(pk=seeded['id'])
+            users = User.objects.filter(company=company)
+            self.assertEqual(users.count(), 30)
+            self.assertEqual(users.filter(manager__isnull=True).get().role, 'admin')
+            self.assertFalse(users.filter(role='employee', manager__role='employee').exists())
+            expenses = Expense.objects.filter(company=company)
+            self.assertEqual(expenses.count(), users.filter(role='employee').count() * 2)
+            self.assertFalse(expenses.filter(approvals__isnull=True).exists())
+        self.assertTrue(User.objects.get(username=data['companies'][0]['users'][0]['username']).check_password(data['password']))
+        normalize = lambda rows: {key: (p, a, Decimal(t).quantize(Decimal('0.01'))) for key, (p, a, t) in rows.items()}
+        self.assertEqual(normalize(stored_dashboard_stats()), normalize(compute_dashboard_stats()))
+
+    def test_percentiles_use_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, p) for p in (0.5, 0.95, 0.99)], [50, 95, 99])
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+
+class FakeRateProvider(RateProvider):
+    def __init__(self):
+        self.calls = []
+        self.failing = False
+
+    def fetch(self, base):
+        self.calls.append(base)
+        if self.failing:
+            raise RateProviderError(f"{base} is down")
+        return {'USD': len(self.calls), 'EUR': 0.5}
+
+
+class RateTableTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.enterContext(mock.patch('api.currency.time.monotonic', lambda: self.now))
+        self.provider = FakeRateProvider()
+        self.table = RateTable(self.provider, ttl=100, max_bases=2, retry_after=30)
+
+    def test_snapshots_are_refreshed_after_the_ttl(self):
+        first = self.table.snapshot('USD')
+        self.now += 99
+        self.assertIs(self.table.snapshot('USD'), first)
+        self.now += 1
+        refreshed = self.table.snapshot('USD')
+        self.assertEqual((refreshed.rates['USD'], self.provider.calls), (2, ['USD', 'USD']))
+
+    def test_least_recently_used_base_is_evicted(self):
+        self.table.snapshot('USD')
+        self.table.snapshot('EUR')
+        self.table.snapshot('USD')  # EUR is now the least recently used
+        self.table.snapshot('GBP')
+        self.assertEqual(list(self.table._snapshots), ['USD', 'GBP'])
+        self.table.snapshot('EUR')
+        self.assertEqual(self.provider.calls, ['USD', 'EUR', 'GBP', 'EUR'])
+
+    def test_failing_provider_serves_last_known_rates_and_backs_off(self):
+        good = self.table.snapshot('USD')
+        self.provider.failing = True
+        self.now += 200
+        with self.assertLogs('api.currency', 'WARNING'):
+            self.assertIs(self.table.snapshot('USD'), good)
+        # No new attempt until retry_after has passed
+        self.now += 29
+        self.assertIs(self.table.snapshot('USD'), good)
+        self.assertEqual(len(self.provider.calls), 2)
+        self.now += 1
+        self.provider.failing = False
+        self.assertEqual(self.table.snapshot('USD').rates['USD'], 3)
+
+        # A base that never loaded has nothing to serve
+        self.provider.failing = True
+        with self.assertLogs('api.currency', 'WARNING'):
+            self.assertIsNone(self.table.snapshot('JPY'))
+
+
+class FileRateProviderTests(SimpleTestCase):
+    def test_rates_pivot_to_the_requested_base(self):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'rates.json'
+        path.write_text(json.dumps({'base': 'USD', 'rates': {'EUR': 0.5, 'INR': 80}}))
+        provider = FileRateProvider(path)
+        self.assertEqual(provider.fetch('USD'), {'USD': 1, 'EUR': 0.5, 'INR': 80})
+        self.assertEqual(provider.fetch('EUR'), {'USD': 2, 'EUR': 1, 'INR': 160})
+        self.assertEqual(RateSnapshot('EUR', provider.fetch('EUR'), 0).convert(Decimal('10'), 'USD', 'INR'), 800)
+        with self.assertRaises(RateProviderError):
+            provider.fetch('GBP')
+        with self.assertRaises(RateProviderError):
+            FileRateProvider(path.with_name('missing.json')).fetch('USD')
+
+
+class InProcessBrokerTests(SimpleTestCase):
+    def test_publish_from_another_thread_wakes_subscriber(self):
+        broker = InProcessBroker()
+
+        async def listen():
+            async with broker.subscribe('user:1') as subscription:
+                threading.Thread(target=broker.publish, args=('user:1', {'type': 'notification'})).start()
+                return await subscription.get(timeout=2)
+
+        self.assertEqual(asyncio.run(listen()), {'type': 'notification'})
+        self.assertEqual(dict(broker._subscribers), {})
@@ -2,7 +2,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import MyTokenObtainPairView, SignupView, UserViewSet, ExpenseViewSet, ApprovalViewSet, NotificationViewSet, DashboardStatsView, ApprovalWorkflowViewSet, ApprovalRuleViewSet
+from .media import serve_receipt
+from .profiling import metrics
+from .streams import notification_stream
+from .views import MyTokenObtainPairView, SignupView, UserViewSet, ExpenseViewSet, ApprovalViewSet, NotificationViewSet, DashboardStatsView, SpendAnalyticsView, ApprovalWorkflowViewSet, ApprovalRuleViewSet
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
@@ -13,9 +16,14 @@ router.register(r'workflows', ApprovalWorkflowViewSet, basename='workflow')
 router.register(r'rules', ApprovalRuleViewSet, basename='rule')
 
 urlpatterns = [
+    # Before the router, which would read 'stream' as a notification id
+    path('notifications/stream/', notification_stream, name='notification_stream'),
     path('', include(router.urls)),
     path('signup/', SignupView.as_view(), name='signup'),
     path('token/', MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('dashboard-stats/', DashboardStatsView.as_view(), name='dashboard_stats'),
+    path('analytics/spend/', SpendAnalyticsView.as_view(), name='spend_analytics'),
+    path('media/<path:name>', serve_receipt, name='receipt_media'),
+    path('metrics/', metrics, name='metrics'),
 ]
\ No newline at end of file
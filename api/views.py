@@ -1,25 +1,104 @@
 # api/views.py
-from django.core.mail import send_mail
+from datetime import timedelta
 from django.conf import settings
 from rest_framework import viewsets, generics, permissions, status, views
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, NotFound
 from rest_framework.response import Response
-from django.db.models import Sum
+from rest_framework.reverse import reverse
+from django.db import router, transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .models import *
 from .serializers import *
 from .services import *
 from .permissions import IsAdminOrReadOnly
+from .pagination import KeysetPagination
+from .rowserializers import approval_rows, expense_rows, inbox_rows, notification_rows
+from .configcache import CompanyConfigCacheMixin
+from .fieldsets import FULL, FieldsetMixin
+from .analytics import DEFAULT_STATUSES, DIMENSIONS, spend_analytics
+from .importers import ExpenseImporter
+from .filters import FilterError, filter_expenses
+from .idempotency import idempotent
+from .exports import EXPORT_FORMATS, ExpenseExport, ExportUnavailable, require_pyarrow
+from .orgtree import subtree_user_ids
+from .receipts import release_files, submit_receipt
+from .routing import shard_aliases, use_shard
+from .events import publish_user_events
+from .jobs import send_email
+from .stats import expense_state, get_dashboard_stats, record_expense_changes, record_expense_created
+
+def visible_expenses(user):
+    # Admins see their company's expenses, managers their reporting subtree's, employees their own
+    if user.role == 'admin':
+        return Expense.objects.filter(company=user.company)
+    if user.role == 'manager':
+        return Expense.objects.filter(employee__in=subtree_user_ids(user), company=user.company)
+    return Expense.objects.filter(employee=user)
+
+def paginated_rows(view, queryset, row_serializer):
+    # List responses built from values_list() rows rather than model instances (api.rowserializers);
+    # ?fields= narrows the columns read
+    ordering = getattr(view, 'cursor_ordering', KeysetPagination.ordering)
+    fields = view.shape.fields
+    page = view.paginate_queryset(row_serializer.rows(queryset, *(field.lstrip('-') for field in ordering), fields=fields))
+    return view.get_paginated_response(row_serializer.serialize(page, view.get_serializer_context(), fields=fields))
+
+def expense_relations(shape, prefix=''):
+    # select_related and prefetch_related lookups for what an ExpenseSerializer of this shape renders
+    select, prefetch = [], []
+    chain = shape.includes('approval_chain')
+    if chain or shape.nests('employee'):
+        select.append(f'{prefix}employee')
+    if chain:
+        select.append(f'{prefix}workflow')
+        prefetch.append(f'{prefix}workflow__steps')
+    if chain or shape.includes('approvals'):
+        approvals = Approval.objects.all()
+        if shape.nests('approvals') and shape.child('approvals').nests('approver'):
+            approvals = approvals.select_related('approver')
+        prefetch.append(Prefetch(f'{prefix}approvals', queryset=approvals))
+    return select, prefetch
+
+def with_relations(queryset, select, prefetch):
+    # select_related() without arguments would follow every foreign key
+    return (queryset.select_related(*select) if select else queryset).prefetch_related(*prefetch)
+
+def with_expense_relations(queryset, shape=FULL):
+    # Everything ExpenseSerializer nests, loaded in a constant number of queries
+    return with_relations(queryset, *expense_relations(shape))
+
+def with_approval_relations(queryset, shape=FULL):
+    select, prefetch = ['approver'] if shape.nests('approver') else [], []
+    if shape.nests('expense'):
+        nested_select, prefetch = expense_relations(shape.child('expense'), 'expense__')
+        select += ['expense', *nested_select]
+    return with_relations(queryset, select, prefetch)
 
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
+    def post(self, request, *args, **kwargs):
+        # Users live on their company's shard; try each until the credentials match
+        aliases = shard_aliases()
+        for alias in aliases:
+            with use_shard(alias):
+                try:
+                    return super().post(request, *args, **kwargs)
+                except AuthenticationFailed:
+                    if alias == aliases[-1]:
+                        raise
+
 class SignupView(generics.CreateAPIView):
     queryset = User.objects.all()
     permission_classes = (permissions.AllowAny,)
     serializer_class = SignupSerializer
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(CompanyConfigCacheMixin, FieldsetMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly]
     serializer_class = UserSerializer
     
@@ -37,26 +116,96 @@ class UserViewSet(viewsets.ModelViewSet):
         message = f'Hello {user.username},\n\nAn account has been created for you in the Expensify portal. You can now log in with the password provided.'
         from_email = 'admin@expensify.com'
         recipient_list = [user.email]
-        send_mail(subject, message, from_email, recipient_list)
+        # Delivered by the job worker so SMTP latency stays off the request
+        send_email(subject, message, from_email, recipient_list)
 
-class ExpenseViewSet(viewsets.ModelViewSet):
+class ExpenseViewSet(FieldsetMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ExpenseSerializer
+    pagination_class = KeysetPagination
+    replica_actions = ('list', 'retrieve', 'export')
+
+    def get_serializer_class(self):
+        # Lists are compact rows unless ?expand= asks for nested relations
+        return ExpenseListSerializer if self.action == 'list' and self.shape.expand is None else ExpenseSerializer
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == 'admin':
-            return Expense.objects.filter(company=user.company)
-        elif user.role == 'manager':
-            return Expense.objects.filter(employee__manager=user, company=user.company)
-        else:
-            return Expense.objects.filter(employee=user)
+        queryset = visible_expenses(self.request.user)
+        if self.action in ('list', 'export'):
+            queryset = filter_expenses(queryset, self.request.query_params)
+        if self.action in ('receipt', 'export') or (self.action == 'list' and self.shape.expand is None):
+            return queryset
+        return with_expense_relations(queryset, self.shape)
+
+    def list(self, request, *args, **kwargs):
+        try:
+            queryset = self.filter_queryset(self.get_queryset())
+        except FilterError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if self.shape.expand is not None:
+            page = self.paginate_queryset(queryset)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return paginated_rows(self, queryset, expense_rows)
     
     def perform_create(self, serializer):
         # Correctly save the expense first
         expense = serializer.save(employee=self.request.user, company=self.request.user.company)
         # Then, create the approval workflow for that expense
         create_approval_workflow(expense)
+        record_expense_created([expense])
+
+    def perform_update(self, serializer):
+        before = expense_state(serializer.instance)
+        receipt = serializer.instance.receipt.name
+        expense = serializer.save()
+        record_expense_changes([(expense, before, expense_state(expense))])
+        if expense.receipt.name != receipt:
+            release_files(expense.receipt.storage, [receipt])
+
+    def perform_destroy(self, instance):
+        before = expense_state(instance)
+        instance.delete()
+        record_expense_changes([(instance, before, None)])
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        # Multipart uploads send the file as 'file'; anything else is read straight from the body.
+        # JSON Lines is detected from the file name or content type, CSV is the default.
+        if request.content_type.startswith('multipart/'):
+            source = request.FILES.get('file')
+            if source is None:
+                return Response({'error': 'No import file provided.'}, status=status.HTTP_400_BAD_REQUEST)
+            name, content_type = source.name.lower(), source.content_type or ''
+        else:
+            source, name, content_type = request.stream, '', request.content_type
+        if source is None:
+            return Response({'error': 'Empty request body.'}, status=status.HTTP_400_BAD_REQUEST)
+        is_jsonl = name.endswith(('.jsonl', '.ndjson')) or 'json' in content_type
+        report = ExpenseImporter(request.user).run(source, 'jsonl' if is_jsonl else 'csv')
+        return Response(report, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # ?output= rather than ?format=, which DRF reserves for renderer selection
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response({'error': f"output must be one of: {', '.join(EXPORT_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # Same filters as the list
+            queryset = self.get_queryset()
+        except FilterError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if output != 'csv':
+            try:
+                require_pyarrow()
+            except ExportUnavailable as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        currency = request.user.company.default_currency if request.user.company else 'USD'
+        export = ExpenseExport(queryset, currency)
+        content_type, extension = EXPORT_FORMATS[output]
+        response = StreamingHttpResponse(getattr(export, output)(), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="expenses-{timezone.now():%Y%m%d}.{extension}"'
+        return response
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
     def override(self, request, pk=None):
@@ -65,8 +214,13 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         if decision not in ['approved', 'rejected']:
             return Response({'error': 'Decision must be approved or rejected.'}, status=status.HTTP_400_BAD_REQUEST)
         
+        before = expense_state(expense)
         expense.status = decision
-        expense.save()
+        with transaction.atomic(using=router.db_for_write(Expense)):
+            expense.save()
+            # A decided expense leaves every approver's inbox
+            ApprovalInboxItem.objects.filter(expense=expense).delete()
+        record_expense_changes([(expense, before, expense_state(expense))])
         create_notification(
             user=expense.employee,
             message=f"Your expense '{expense.description}' was overridden to '{decision}' by an administrator."
@@ -83,80 +237,169 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         if not receipt_file:
             return Response({'error': 'No receipt file provided.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        expense.receipt = receipt_file
-        expense.save()
-        
-        ocr_data = perform_ocr_on_receipt(receipt_file)
-        
-        expense.amount = ocr_data.get('amount', expense.amount)
-        expense.description = ocr_data.get('description', expense.description)
-        expense.save()
-        
+        submit_receipt(expense, receipt_file)
+        # Processed by the job worker; poll the receipt endpoint for the outcome
+        expense.refresh_from_db()
         return Response({
-            'message': 'Receipt uploaded and processed.',
-            'ocr_data': ocr_data,
-            'expense': ExpenseSerializer(expense).data
-        })
+            'message': 'Receipt uploaded and queued for processing.',
+            'status_url': reverse('expense-receipt', args=[expense.pk], request=request),
+            'receipt': ReceiptStatusSerializer(expense, context={'request': request}).data,
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def receipt(self, request, pk=None):
+        expense = self.get_object()
+        return Response(ReceiptStatusSerializer(expense, context={'request': request}).data)
 
-class ApprovalViewSet(viewsets.ReadOnlyModelViewSet):
+class ApprovalViewSet(FieldsetMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ApprovalSerializer
+    pagination_class = KeysetPagination
+    replica_actions = ('list', 'retrieve', 'inbox', 'inbox_count')
+    shaped_actions = ('list', 'retrieve', 'inbox')
+    cursor_ordering = ('-id',)
+
+    def get_serializer_class(self):
+        if self.action == 'inbox':
+            return ApprovalInboxSerializer
+        return ApprovalListSerializer if self.action == 'list' and self.shape.expand is None else ApprovalSerializer
 
     def get_queryset(self):
-        return Approval.objects.filter(approver=self.request.user)
+        queryset = Approval.objects.filter(approver=self.request.user)
+        if self.action in ('act', 'bulk_act') or (self.action == 'list' and self.shape.expand is None):
+            return queryset
+        # ApprovalSerializer nests the expense, its employee and all of its approvals
+        return with_approval_relations(queryset, self.shape)
+
+    def list(self, request, *args, **kwargs):
+        if self.shape.expand is not None:
+            return super().list(request, *args, **kwargs)
+        return paginated_rows(self, self.get_queryset(), approval_rows)
+
+    @action(detail=False)
+    def inbox(self, request):
+        # What the user can act on now, from the inbox index rather than the whole approval history
+        return paginated_rows(self, ApprovalInboxItem.objects.filter(approver=request.user), inbox_rows)
+
+    @action(detail=False, url_path='inbox/count')
+    def inbox_count(self, request):
+        return Response({'count': ApprovalInboxItem.objects.filter(approver=request.user).count()})
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def act(self, request, pk=None):
         approval = self.get_object()
         decision, comment = request.data.get('decision'), request.data.get('comment', '')
-        if approval.approver != request.user:
-            return Response({'error': 'Not authorized.'}, status=status.HTTP_403_FORBIDDEN)
-        if approval.status != 'pending':
-            return Response({'error': 'This approval has already been processed.'}, status=status.HTTP_400_BAD_REQUEST)
-        if decision not in ['approved', 'rejected']:
-            return Response({'error': "Decision must be 'approved' or 'rejected'."}, status=status.HTTP_400_BAD_REQUEST)
-        process_approval_action(approval, decision, comment)
-        return Response(ExpenseSerializer(approval.expense, context={'request': request}).data)
+        with transaction.atomic(using=router.db_for_write(Approval)):
+            # The status check and the transition happen under the expense's row lock
+            approvals = lock_approvals(Approval.objects.filter(pk=approval.pk))
+            if not approvals:
+                raise NotFound()
+            approval = approvals[0]
+            if approval.status != 'pending':
+                return Response({'error': 'This approval has already been processed.'}, status=status.HTTP_400_BAD_REQUEST)
+            if decision not in ['approved', 'rejected']:
+                return Response({'error': "Decision must be 'approved' or 'rejected'."}, status=status.HTTP_400_BAD_REQUEST)
+            process_approval_action(approval, decision, comment)
+        expense = with_expense_relations(Expense.objects.filter(pk=approval.expense_id)).get()
+        return Response(ExpenseSerializer(expense, context={'request': request}).data)
+
+    @action(detail=False, methods=['post'], url_path='bulk-act')
+    @idempotent
+    def bulk_act(self, request):
+        serializer = BulkApprovalActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids, decision, comment = (serializer.validated_data[key] for key in ('ids', 'decision', 'comment'))
+        ids = list(dict.fromkeys(ids))
+        with transaction.atomic(using=router.db_for_write(Approval)):
+            found = {approval.pk: approval for approval in lock_approvals(self.get_queryset().filter(pk__in=ids))}
+            processed, errors = [], []
+            for pk in ids:
+                approval = found.get(pk)
+                if approval is None:
+                    errors.append({'id': pk, 'error': 'Not found.'})
+                elif approval.status != 'pending':
+                    errors.append({'id': pk, 'error': 'This approval has already been processed.'})
+                else:
+                    processed.append(approval)
+            process_approval_actions(processed, decision, comment)
+        expenses = expense_rows.rows(Expense.objects.filter(pk__in={approval.expense_id for approval in processed}))
+        return Response({
+            'processed': [approval.pk for approval in processed],
+            'errors': errors,
+            'expenses': expense_rows.serialize(expenses, self.get_serializer_context()),
+        })
 
-class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+class NotificationViewSet(FieldsetMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = NotificationSerializer
+    pagination_class = KeysetPagination
+    replica_actions = ('list', 'retrieve')
 
     def get_queryset(self):
         return Notification.objects.filter(user=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        return paginated_rows(self, self.get_queryset(), notification_rows)
+
     @action(detail=False, methods=['post'])
     def mark_all_as_read(self, request):
         self.get_queryset().update(is_read=True)
+        publish_user_events([request.user.pk], {'type': 'unread'})
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 class DashboardStatsView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
+    replica_actions = ('get',)
     
     def get(self, request, *args, **kwargs):
-        user, queryset = request.user, Expense.objects.filter(company=request.user.company)
-        if user.role == 'manager':
-            queryset = queryset.filter(employee__manager=user)
-        elif user.role == 'employee':
-            queryset = queryset.filter(employee=user)
-        stats = {
-            'pending_count': queryset.filter(status__in=['pending', 'in_progress']).count(),
-            'approved_count': queryset.filter(status='approved').count(),
-            'total_approved_amount': queryset.filter(status='approved').aggregate(total=Sum('amount'))['total'] or 0
-        }
+        # Reads the rollup maintained by api.stats instead of aggregating the expense table
+        user = request.user
+        if user.role == 'admin':
+            stats = get_dashboard_stats(user.company_id, 'company')
+        elif user.role == 'manager':
+            stats = get_dashboard_stats(user.company_id, 'manager', user.pk)
+        else:
+            stats = get_dashboard_stats(user.company_id, 'employee', user.pk)
         return Response(DashboardStatsSerializer(stats).data)
 
-class ApprovalWorkflowViewSet(viewsets.ModelViewSet):
+class SpendAnalyticsView(views.APIView):
+    # Stays on the primary, like the config viewsets: its cache is keyed on a version that a
+    # lagging replica could fill with older rows
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        # Same scopes as the expense list; totals are in the company's default currency
+        user = request.user
+        queryset = visible_expenses(user)
+        params = request.query_params
+        today = timezone.localdate()
+        start, end = parse_date(params.get('from', '')), parse_date(params.get('to', ''))
+        if ('from' in params and start is None) or ('to' in params and end is None):
+            return Response({'error': "'from' and 'to' must be dates (YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
+        start, end = start or today - timedelta(days=365), end or today
+        group_by = [value for value in params.get('group_by', 'category,month').split(',') if value]
+        if any(value not in DIMENSIONS for value in group_by):
+            return Response({'error': f"group_by accepts: {', '.join(DIMENSIONS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        statuses = [value for value in params.get('status', ','.join(DEFAULT_STATUSES)).split(',') if value]
+        queryset = queryset.filter(created_at__date__gte=start, created_at__date__lte=end)
+        currency = user.company.default_currency if user.company else 'USD'
+        result = spend_analytics(queryset, user.company_id, currency, group_by, statuses,
+                                 cache_key_parts=(user.role, user.pk if user.role != 'admin' else None, start, end))
+        return Response({'from': start, 'to': end, **result})
+
+class ApprovalWorkflowViewSet(CompanyConfigCacheMixin, FieldsetMixin, viewsets.ModelViewSet):
     serializer_class = ApprovalWorkflowSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly]
 
     def get_queryset(self):
-        return ApprovalWorkflow.objects.filter(company=self.request.user.company)
+        queryset = ApprovalWorkflow.objects.filter(company=self.request.user.company)
+        return queryset.prefetch_related('steps') if self.shape.includes('steps') else queryset
     
     def perform_create(self, serializer):
         serializer.save(company=self.request.user.company)
 
-class ApprovalRuleViewSet(viewsets.ModelViewSet):
+class ApprovalRuleViewSet(CompanyConfigCacheMixin, FieldsetMixin, viewsets.ModelViewSet):
     serializer_class = ApprovalRuleSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly]
     
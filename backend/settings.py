@@ -26,7 +26,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',  # outermost, so it times everything below
     'django.middleware.security.SecurityMiddleware',
+    'api.routing.DatabaseRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware', # Add this
     'django.middleware.common.CommonMiddleware',
@@ -74,13 +76,29 @@ DATABASES = {
     }
 }
 
+# Read replicas and company shards (api.routing). Add the aliases to DATABASES, then e.g.
+#   'REPLICAS': {'default': ['replica1']},    # reads of opted-in GET endpoints
+#   'COMPANY_SHARDS': {42: 'shard2'},          # company id -> alias holding its rows
+# Requests that wrote stick to the primary for STICKY_SECONDS so users read their own writes
+DATABASE_ROUTERS = ['api.routing.DatabaseRouter']
+DATABASE_ROUTING = {
+    'REPLICAS': {},
+    'COMPANY_SHARDS': {},
+    'STICKY_SECONDS': 10,
+}
+
 # Use our custom user model
 AUTH_USER_MODEL = 'api.User'
 
 # Django REST Framework Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.ClaimsJWTAuthentication',
+    ),
+    # DRF's JSON, encoded with orjson when it is installed
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
 }
 
@@ -89,13 +107,95 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
+# Access tokens carry the user's role, company and currency; api.authentication trusts them
+# while the user's token version (kept in the cache below) is unchanged
+AUTH_CLAIMS = {
+    'CACHE_SIZE': 10000,   # full User rows kept per process for tokens issued before a change
+    'VERSION_TTL': 300,    # seconds a cached token version may be reused
+}
+# Compiled approval rules are versioned through this cache. Use a shared backend
+# (Redis, Memcached) when running several worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Exchange rates used by convert_currency. Point PROVIDER at api.currency.FileRateProvider
+# (OPTIONS: {'path': ...}) for offline deployments; it defaults to the bundled api/data/exchange_rates.json.
+EXCHANGE_RATES = {
+    'PROVIDER': config('EXCHANGE_RATE_PROVIDER', default='api.currency.ExchangeRateAPIProvider'),
+    'OPTIONS': {},
+    'TTL': 3600,         # seconds before a base currency's snapshot is refreshed
+    'MAX_BASES': 32,     # snapshots kept before the least recently used base is evicted
+    'RETRY_AFTER': 60,   # seconds to keep serving last known rates after a provider failure
+}
+
+# Background jobs (api.jobs), processed by `python manage.py run_jobs`.
+# JOBS_EAGER=True runs them inline instead, for tests and single-process development.
+JOB_QUEUE = {
+    'EAGER': config('JOBS_EAGER', default=False, cast=bool),
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 10,        # doubled on every failed attempt
+    'MAX_BACKOFF_SECONDS': 3600,
+    'RUNNING_TIMEOUT': 600,       # running jobs older than this are requeued
+    'KEEP_DONE_SECONDS': 86400,
+}
+
+# Receipt pipeline (api.receipts): uploads return 202 and are processed by the job worker.
+# OCR_BACKEND is a dotted path to a callable taking an image file and returning the extracted fields.
+RECEIPTS = {
+    'OCR_BACKEND': config('RECEIPT_OCR_BACKEND', default='api.services.perform_ocr_on_receipt'),
+    'MAX_DIMENSION': 2000,   # larger images are downscaled in place
+    'THUMBNAIL_SIZE': 256,
+    'PROCESSES': 0,          # >1 analyzes each job batch in a process pool
+}
+
+# /api/workflows/, /api/rules/ and /api/users/ are versioned per company (ETag, Last-Modified)
+# and their serialized data kept in an in-process LRU until the company's configuration changes
+CONFIG_CACHE = {
+    'MAX_ENTRIES': 1000,
+}
+
+# Approval actions sent with an Idempotency-Key header replay their stored response for TTL seconds (api.idempotency)
+IDEMPOTENCY = {
+    'TTL': 86400,
+}
+
+# Spend analytics (/api/analytics/spend/), computed with pandas and cached per company until an expense changes
+ANALYTICS = {
+    'CACHE_TTL': 300,     # seconds; also bounds how long results lag exchange rate updates
+    'MAX_GROUPS': 5000,   # largest groups returned, by total
+}
+
+# Server-sent notification stream at /api/notifications/stream/ (serve through backend.asgi).
+# EVENT_BROKER can point at any class with the api.events.InProcessBroker interface.
+EVENT_BROKER = 'api.events.InProcessBroker'
+NOTIFICATION_STREAM = {
+    'HEARTBEAT_SECONDS': 15,      # keep-alive interval, also when the stream re-checks the database
+    'MAX_DURATION_SECONDS': 300,  # clients reconnect with Last-Event-ID after this
+    'BATCH_SIZE': 100,
+}
+
+# Request timing (api.profiling): Server-Timing headers, and Prometheus metrics at /api/metrics/
+PROFILING = {
+    'SAMPLE_RATE': 0.1,         # share of requests that also time SQL, serializers and exchange rates
+    'PROFILE_RATE': 0,          # share of requests run under cProfile; keep at 0 unless investigating
+    'PROFILE_SLOW_MS': 1000,    # profiles of faster requests are discarded
+    'PROFILE_DIR': BASE_DIR / 'profiles',
+    'METRICS_TOKEN': config('METRICS_TOKEN', default=''),  # bearer token for scrapers; /api/metrics/ is closed without it
+    'METRICS_IPS': (),          # addresses allowed without the token; never list a reverse proxy's own address
+}
+
 # Email Configuration (for development)
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend' # Use the SMTP backend
+# EMAIL_BACKEND=django.core.mail.backends.locmem.EmailBackend (or .console / .filebased) keeps mail local.
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend') # Use the SMTP backend
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
-EMAIL_HOST_USER = config('EMAIL_USER')          # Reads from your .env file
-EMAIL_HOST_PASSWORD = config('EMAIL_PASSWORD')  # Reads from your .env file
+EMAIL_HOST_USER = config('EMAIL_USER', default='')          # Reads from your .env file
+EMAIL_HOST_PASSWORD = config('EMAIL_PASSWORD', default='')  # Reads from your .env file
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -112,3 +212,18 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Receipts and thumbnails are stored once per distinct content (api.storage) and served by
+# api.media.serve_receipt. Behind nginx or Apache set RECEIPT_SENDFILE to 'x-accel-redirect' or
+# 'x-sendfile' so the web server sends the bytes; INTERNAL_PREFIX is the nginx internal location
+# that maps to MEDIA_ROOT.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'receipts': {'BACKEND': 'api.storage.ContentAddressedStorage', 'OPTIONS': {'base_url': '/api/media/'}},
+}
+RECEIPT_DOWNLOADS = {
+    'SENDFILE': config('RECEIPT_SENDFILE', default=''),
+    'INTERNAL_PREFIX': '/internal-media/',
+    'MAX_AGE': 31536000,  # content-addressed files never change
+}
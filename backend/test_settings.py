@@ -0,0 +1,8 @@
+# backend/test_settings.py
+# python manage.py test api --settings=backend.test_settings
+# The app's settings plus a 'replica' alias on the same engine as 'default'. DatabaseRoutingTests
+# fills it by hand where a real replica would stream from the primary; the test runner creates
+# (and drops) its test database next to the default one.
+from .settings import *  # noqa: F401,F403
+
+DATABASES['replica'] = {**DATABASES['default'], 'NAME': f"{DATABASES['default']['NAME']}_replica"}
@@ -26,7 +26,9 @@ async function apiFetch(endpoint, options = {}) {
     }
 
     try {
-        const response = await fetch(`${API_BASE_URL}${endpoint}`, config);
+        // Pagination links (`next`) are absolute URLs
+        const url = endpoint.startsWith('http') ? endpoint : `${API_BASE_URL}${endpoint}`;
+        const response = await fetch(url, config);
         
         if (response.status === 204) return null; // Handle No Content responses
 
@@ -50,12 +52,15 @@ const auth = {
     login: (username, password) => apiFetch('/token/', { method: 'POST', body: { username, password } }),
     signup: (data) => apiFetch('/signup/', { method: 'POST', body: data }),
 };
+// List endpoints are cursor-paginated and return { next, previous, results }; pass `next` to get the following page.
 const expenses = {
-    getAll: () => apiFetch('/expenses/'),
+    getAll: (next) => apiFetch(next || '/expenses/'),
     create: (data) => apiFetch('/expenses/', { method: 'POST', body: data }), // Accepts plain object now
 };
 const approvals = {
     getAll: () => apiFetch('/approvals/'),
+    // Only the approvals waiting on the current user
+    inbox: (next) => apiFetch(next || '/approvals/inbox/'),
     act: (id, decision, comment) => apiFetch(`/approvals/${id}/act/`, { method: 'POST', body: { decision, comment } }),
 };
 const users = {
@@ -4,7 +4,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const loader = document.getElementById('loader');
     const toast = document.getElementById('toast');
     const modal = document.getElementById('modal');
-    const State = { currentUser: null, workflows: [] };
+    const State = { currentUser: null, workflows: [], nextPage: null };
 
     // --- UI HELPER FUNCTIONS ---
     const showLoader = () => loader.classList.remove('hidden');
@@ -149,34 +149,23 @@ document.addEventListener('DOMContentLoaded', () => {
             try {
                 if (page === 'expenses' && State.currentUser.role === 'employee') {
                     title.textContent = 'My Expenses';
-                    const data = await expenses.getAll();
-                    const tableRows = data.map(exp => `
-                        <tr>
-                            <td>${exp.description}</td>
-                            <td>${exp.amount} ${exp.currency}</td>
-                            <td><span class="status-badge status-${exp.status.replace('_','')}">${exp.status}</span></td>
-                            <td>${new Date(exp.created_at).toLocaleDateString()}</td>
-                        </tr>`).join('');
+                    const page = await expenses.getAll();
+                    const data = page.results;
                     content.innerHTML = `
                         <div class="page-content-header"><h2>All My Expenses</h2><button class="button-primary" id="new-expense-btn">New Expense</button></div>
-                        <div class="table-wrapper"><table><thead><tr><th>Description</th><th>Amount</th><th>Status</th><th>Created</th></tr></thead><tbody>${tableRows}</tbody></table></div>`;
+                        <div class="table-wrapper"><table><thead><tr><th>Description</th><th>Amount</th><th>Status</th><th>Created</th></tr></thead><tbody></tbody></table></div>
+                        <div class="load-more"><button class="button-primary hidden" id="load-more-btn" data-page="expenses">Load more</button></div>`;
+                    this.appendPage(page, this.expenseRow);
                     if (!data.length) content.querySelector('tbody').innerHTML = `<tr><td colspan="4"><div class="empty-state"><p>No expenses found. Click 'New Expense' to start.</p></div></td></tr>`;
                 } else if (page === 'approvals' && (State.currentUser.role === 'manager' || State.currentUser.role === 'admin')) {
                     if (State.currentUser.username.toLowerCase().includes('cfo')) { title.textContent = 'Chief Officer Portal'; } 
                     else { title.textContent = 'Team Approvals'; }
-                    const data = await approvals.getAll();
-                    const pending = data.filter(a => a.status === 'pending');
-                    const tableRows = pending.map(appr => `
-                        <tr>
-                            <td>${appr.expense.employee.username}</td>
-                            <td>${appr.expense.description}</td>
-                            <td>${appr.expense.amount} ${appr.expense.currency}</td>
-                            <td>
-                                <button class="button-primary button-success approve-btn" data-id="${appr.id}">Approve</button>
-                                <button class="button-primary button-danger reject-btn" data-id="${appr.id}">Reject</button>
-                            </td>
-                        </tr>`).join('');
-                    content.innerHTML = `<div class="page-content-header"><h2>Pending Approvals</h2></div><div class="table-wrapper"><table><thead><tr><th>Employee</th><th>Description</th><th>Amount</th><th>Actions</th></tr></thead><tbody>${tableRows}</tbody></table></div>`;
+                    // The inbox holds only the approvals waiting on this user, filtered by the server
+                    const page = await approvals.inbox();
+                    const pending = page.results;
+                    content.innerHTML = `<div class="page-content-header"><h2>Pending Approvals</h2></div><div class="table-wrapper"><table><thead><tr><th>Employee</th><th>Description</th><th>Amount</th><th>Actions</th></tr></thead><tbody></tbody></table></div>
+                        <div class="load-more"><button class="button-primary hidden" id="load-more-btn" data-page="approvals">Load more</button></div>`;
+                    this.appendPage(page, this.approvalRow);
                     if (!pending.length) content.innerHTML = `<div class="page-content-header"><h2>Pending Approvals</h2></div><div class="empty-state"><p>No pending approvals. Great job!</p></div>`;
                 } else if (page === 'users' && State.currentUser.role === 'admin') {
                     title.textContent = 'User Management';
@@ -200,6 +189,42 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         },
 
+        expenseRow: (exp) => `
+            <tr>
+                <td>${exp.description}</td>
+                <td>${exp.amount} ${exp.currency}</td>
+                <td><span class="status-badge status-${exp.status.replace('_','')}">${exp.status}</span></td>
+                <td>${new Date(exp.created_at).toLocaleDateString()}</td>
+            </tr>`,
+
+        approvalRow: (appr) => `
+            <tr>
+                <td>${appr.employee_username}</td>
+                <td>${appr.expense_description}</td>
+                <td>${appr.expense_amount} ${appr.expense_currency}</td>
+                <td>
+                    <button class="button-primary button-success approve-btn" data-id="${appr.id}">Approve</button>
+                    <button class="button-primary button-danger reject-btn" data-id="${appr.id}">Reject</button>
+                </td>
+            </tr>`,
+
+        // Adds a page of rows to the table and keeps its `next` cursor for the "Load more" button
+        appendPage(page, renderRow) {
+            document.querySelector('#page-content tbody').insertAdjacentHTML('beforeend', page.results.map(renderRow).join(''));
+            State.nextPage = page.next;
+            document.getElementById('load-more-btn').classList.toggle('hidden', !page.next);
+        },
+
+        async loadMore(button) {
+            if (!State.nextPage) return;
+            button.disabled = true;
+            try {
+                if (button.dataset.page === 'expenses') this.appendPage(await expenses.getAll(State.nextPage), this.expenseRow);
+                else this.appendPage(await approvals.inbox(State.nextPage), this.approvalRow);
+            } catch (error) { showToast(error.message, 'error'); }
+            finally { button.disabled = false; }
+        },
+
         async renderNewExpenseModal() {
             showLoader();
             try {
@@ -246,6 +271,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (target.closest('.nav-link')) { return; } // Let the hashchange event handle navigation
             if (target.id === 'new-expense-btn') { this.renderNewExpenseModal(); return; }
             if (target.id === 'new-user-btn') { this.renderNewUserModal(); return; }
+            if (target.id === 'load-more-btn') { this.loadMore(target); return; }
 
             const approvalId = target.dataset.id;
             if (target.classList.contains('approve-btn')) {